@@ -1,23 +1,23 @@
 "combine counts into a single report"
 
 from __future__ import print_function
+from collections import defaultdict
 from functools import wraps
 from os import path as fp
 import sys
 
 from ..args import add_common_args, add_report_args
-from ..fold import select_testing
+from ..fold import fold_groupings
 from ..io import (load_predictions, load_fold_dict)
-from ..score import (score_edges, score_edus,
-                     score_edges_by_label,
-                     build_confusion_matrix)
+from ..score import (empty_confusion_matrix,
+                     score_predictions)
 from ..report import (CombinedReport,
                       EdgeReport,
                       EduReport,
                       LabelReport)
-from ..table import (DataPack)
+from ..table import (UNRELATED)
 from ..harness.report import (ReportPack)
-from .util import (load_args_multipack,
+from .util import (iter_args_multipack,
                    get_output_dir, announce_output_dir)
 
 # pylint: disable=too-few-public-methods
@@ -82,29 +82,58 @@ def _validate_report_args(wrapped):
 def main(args):
     "subcommand main (invoked from outer script)"
     output_dir = get_output_dir(args)
-    mpack = load_args_multipack(args)
     if args.fold is not None:
         fold_dict = load_fold_dict(args.fold_file)
-        mpack = select_testing(mpack, fold_dict, args.fold)
+        fold_groupings(fold_dict, args.fold)  # sanity check
+    else:
+        fold_dict = None
 
-    dpack = DataPack.vstack(mpack.values())
     predictions = load_predictions(args.predictions)
-    edge_counts = score_edges(dpack, predictions)
-    edge_label_counts = score_edges_by_label(dpack, predictions)
-    edu_counts = score_edus(dpack, predictions)
-    cmatrix = build_confusion_matrix(dpack, predictions)
-
+    pred_map = {(id1, id2): rel for id1, id2, rel in predictions}
+
+    # we score the documents one at a time as we stream them in,
+    # and accumulate the counts
+    edge_counts = []
+    edu_report = EduReport()
+    edge_label_counts = defaultdict(list)
+    cmatrix = None
+    labels = None
+    num_edges = 0
+    for grouping, dpack in iter_args_multipack(args, targets_only=True):
+        if fold_dict is not None and fold_dict.get(grouping) != args.fold:
+            continue
+        # predictions for this document, lined up with its pairings
+        d_predictions = dpack.label_numbers(
+            pred_map.get((e1.id, e2.id), UNRELATED)
+            for e1, e2 in dpack.pairings)
+        scores = score_predictions(dpack, d_predictions)
+        edge_counts.append(scores.edges)
+        edu_report.add(scores.edus)
+        for label, count in scores.edges_by_label:
+            edge_label_counts[label].append(count)
+        if cmatrix is None:
+            cmatrix = empty_confusion_matrix(dpack)
+            labels = dpack.labels
+        cmatrix += scores.confusion
+        num_edges += len(dpack)
+    if cmatrix is None:
+        if args.fold is None:
+            sys.exit("No documents to report on")
+        else:
+            sys.exit("No documents to report on in fold {} (is the "
+                     "fold file for this corpus?)".format(args.fold))
+
+    key = (fp.basename(args.predictions),)
     rel_report = CombinedReport(LabelReport,
-                                {(k,): LabelReport([v])
-                                 for k, v in edge_label_counts})
-
-    key = (fp.basename(args.prediction),)
+                                {(k,): LabelReport(v)
+                                 for k, v in edge_label_counts.items()})
     rpack = ReportPack(edge=CombinedReport(EdgeReport,
-                                           {key: edge_counts}),
+                                           {key: EdgeReport(edge_counts)}),
+                       edge_by_label={key: rel_report},
                        edu=CombinedReport(EduReport,
-                                          {key: edu_counts}),
-                       edge_by_rel=rel_report,
-                       confusion=cmatrix,
-                       confusion_labels=dpack.labels)
-    rpack.dump(output_dir)
+                                          {key: edu_report}),
+                       confusion={key: cmatrix},
+                       confusion_labels=labels,
+                       num_edges=num_edges)
+    rpack.dump(output_dir, header=key[0])
     announce_output_dir(output_dir)
@@ -4,10 +4,9 @@ from __future__ import print_function
 from os import path as fp
 
 from .util import (get_output_dir, announce_output_dir,
-                   load_args_multipack)
+                   iter_args_multipack)
 from ..args import add_common_args
-from ..fold import (select_testing)
-from ..io import (load_fold_dict, write_predictions_output)
+from ..io import (load_fold_dict, append_prediction_labels)
 
 
 def config_argparser(psr):
@@ -39,12 +38,22 @@ def main_for_harness(args):
     (see `select_data`)
     """
     output_dir = get_output_dir(args)
-    mpack = load_args_multipack(args)
     fold_dict = load_fold_dict(args.fold_file)
-    for fold in set(fold_dict.values()):
-        fpack = select_testing(mpack, fold_dict, fold)
-        filename = fp.join(output_dir, "gold-" + str(fold))
-        write_predictions_output(fpack, gold_predictions(fpack), filename)
+    # we stream the documents through, so we need to have all of the
+    # fold files open at the same time
+    streams = {}
+    try:
+        for fold in set(fold_dict.values()):
+            filename = fp.join(output_dir, "gold-" + str(fold))
+            streams[fold] = open(filename, 'wb')
+        for grouping, dpack in iter_args_multipack(args, targets_only=True):
+            if grouping not in fold_dict:
+                continue
+            append_prediction_labels(dpack, dpack.target,
+                                     streams[fold_dict[grouping]])
+    finally:
+        for stream in streams.values():
+            stream.close()
     announce_output_dir(output_dir)
 
 
@@ -8,7 +8,7 @@ import os
 import sys
 import tempfile
 
-from attelo.io import load_multipack
+from attelo.io import (iter_multipack, load_multipack)
 
 
 def load_args_multipack(args):
@@ -22,6 +22,18 @@ def load_args_multipack(args):
                           verbose=not args.quiet)
 
 
+def iter_args_multipack(args, targets_only=False):
+    '''
+    Stream the multipack specified via command line arguments,
+    one grouping at a time (see :py:func:`attelo.io.iter_multipack`)
+    '''
+    return iter_multipack(args.edus,
+                          args.pairings,
+                          args.features,
+                          args.vocab,
+                          targets_only=targets_only)
+
+
 def get_output_dir(args):
     """
     Return the output directory specified on (or inferred from) the command
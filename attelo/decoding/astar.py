@@ -18,6 +18,7 @@ import sys
 import numpy
 from collections import defaultdict, namedtuple
 from enum import Enum
+from itertools import islice
 
 from attelo.optimisation.astar import State, Search, BeamSearch
 from .interface import Decoder
@@ -127,78 +128,140 @@ class DiscData(object):
 
     RF: right frontier, = admissible attachment point of current discourse unit
 
+    States are never modified once built, which lets successors share
+    most of their structure with their parent, so that making one is
+    constant time:
+
+    * the edus to link are an index into an edu order shared by all
+      states in the search
+    * the right frontier is a linked stack of `(edu, below)` cells
+      (most recent edu on top); linking a new edu pushes it onto the
+      cell it attaches to (or the one below), sharing everything under
+
     :param parent: parent state (previous decision)
 
     :param link: current decision (a triplet: target edu, source edu, relation)
     :type link: (string, string, string)
 
+    :param accessible: initial right frontier
+    :type accessible: [string]
+
     :param tolink: remaining unattached discourse units
     :type tolink: [string]
     """
+    __slots__ = ['parent', '_link', '_frontier', '_order', '_next']
+
     def __init__(self, parent=None, accessible=None, tolink=None):
-        self._accessible = accessible or []
         self.parent = parent
         self._link = None
-        self._tolink = tolink or []
+        self._frontier = None
+        for edu in accessible or []:
+            self._frontier = (edu, self._frontier)
+        self._order = tuple(tolink or [])
+        self._next = 0
+
+    def _successor(self, link, frontier):
+        """return a new state in which we have made the given link and
+        have the given frontier"""
+        new = object.__new__(type(self))
+        new.parent = self
+        new._link = link
+        new._frontier = frontier
+        new._order = self._order
+        new._next = self._next + 1
+        return new
+
+    def frontier(self):
+        """return the cells of the right frontier (see above), from the
+        oldest edu to the most recent one
+
+        :rtype: [(string, tuple)]
+        """
+        cells = []
+        cell = self._frontier
+        while cell is not None:
+            cells.append(cell)
+            cell = cell[1]
+        cells.reverse()
+        return cells
 
     def accessible(self):
         """return the list of edus that are on the right frontier
 
         :rtype: [string]
         """
-        return self._accessible
+        return [cell[0] for cell in self.frontier()]
 
     def final(self):
         "return `True` if there are no more links to be made"
-        return self._tolink == []
+        return self._next >= len(self._order)
+
+    def next_edu(self):
+        "return the next edu to be linked"
+        return self._order[self._next]
+
+    def position(self):
+        "return how many edus have been linked so far"
+        return self._next
 
     def tobedone(self):
         """return the list of edus to be linked
 
         :rtype: [string]
         """
-        return self._tolink
+        return list(self._order[self._next:])
 
     def last_link(self):
         "return the link that was made to get to this state, if any"
         return self._link
 
+    def link_cell(self, cell, from_edu, relation,
+                  rfc=RfcConstraint.full):
+        """
+        return the state we get by attaching the next edu (`from_edu`)
+        to the edu in the given right frontier cell (see `link`)
+        """
+        to_edu = cell[0]
+        # update the right frontier -- coord relations replace their
+        # attachment points, subord are appended, and evrything below
+        # disappear from the RF
+        # unknown relations are subord
+        if rfc == RfcConstraint.full and\
+                SUBORD_COORD.get(relation, "subord") == "coord":
+            frontier = (from_edu, cell[1])
+        elif rfc in [RfcConstraint.full, RfcConstraint.simple]:
+            frontier = (from_edu, cell)
+        elif rfc == RfcConstraint.none:
+            frontier = (from_edu, self._frontier)
+        else:
+            raise Exception("Unknown RFC: {}".format(rfc))
+        return self._successor((to_edu, from_edu, relation), frontier)
+
     def link(self, to_edu, from_edu, relation,
              rfc=RfcConstraint.full):
         """
+        return the state we get by attaching `from_edu` (which should
+        be the next edu) to `to_edu`, which must be on the right
+        frontier
+
         rfc = "full": use the distinction coord/subord
         rfc = "simple": consider everything as subord
         rfc = "none" no constraint on attachment
         """
-        #if to_edu not in self.accessible():
-        #    print("error: unreachable node", to_edu, "(ignored)", file= sys.stderr)
-        if True:
-            index = self.accessible().index(to_edu)
-            self._link = (to_edu, from_edu, relation)
-            # update the right frontier -- coord relations replace their
-            # attachment points, subord are appended, and evrything below
-            # disappear from the RF
-            # unknown relations are subord
-            #print(type(relation), file= sys.stderr)
-            #print(map(type, SUBORD_COORD.values()), file= sys.stderr)
-            if rfc == RfcConstraint.full and\
-                SUBORD_COORD.get(relation, "subord") == "coord":
-                self._accessible = self._accessible[:index]
-            elif rfc == RfcConstraint.simple:
-                self._accessible = self._accessible[:index + 1]
-            elif rfc == RfcConstraint.none:
-                pass
-            else:
-                raise Exception("Unknown RFC: {}".format(rfc))
-            self._accessible.append(from_edu)
+        cell = self._frontier
+        while cell is not None and cell[0] != to_edu:
+            cell = cell[1]
+        if cell is None:
+            raise ValueError("unreachable node: {}".format(to_edu))
+        return self.link_cell(cell, from_edu, relation, rfc=rfc)
 
     def __str__(self):
         template = ("{link}/ "
                     "accessibility={accessibility}/ "
                     "to attach={to_attach}")
         return template.format(link=self._link,
-                               accessibility=self._accessible,
-                               to_attach=[str(x) for x in self._tolink])
+                               accessibility=self.accessible(),
+                               to_attach=[str(x) for x in self.tobedone()])
 
     def __repr__(self):
         return str(self)
@@ -270,16 +333,15 @@ class DiscourseState(State):
         TODO: adapt to disc parse, according to choice made for data -> especially update to RFC
         """
         res = []
-        one = self.data().tobedone()[0]
+        data = self.data()
+        one = data.next_edu()
         transform = self._mk_score_transform()
         #print ">> taking care of node ", one
-        for attachmt in self.data().accessible():
-            new = copy.deepcopy(self.data())
-            new.tobedone().pop(0)
-            relation, prob = self.proba((attachmt, one))
+        for cell in data.frontier():
+            relation, prob = self.proba((cell[0], one))
             if prob is not None:
-                new.link(attachmt, one, relation, rfc=self.strategy())
-                new.parent = self.data()
+                new = data.link_cell(cell, one, relation,
+                                     rfc=self.strategy())
                 score = transform(prob)
                 res.append((new, score))
         return res
@@ -302,6 +364,9 @@ class DiscourseState(State):
     def h_average(self):
         """return the average probability possible when n nodes still need to be attached
         assuming the best overall prob in the distrib"""
+        avg_costs = self.shared()["heuristics"].get("average_cost_suffix")
+        if avg_costs is not None:
+            return avg_costs[self.data().position()]
         missing_links = self.data().tobedone()
         transform = self._mk_score_transform()
         return sum(transform(self.shared()["heuristics"]["average"][x])
@@ -316,8 +381,15 @@ class DiscourseState(State):
         return transform(prob) * missing_links
 
     def h_best(self):
-        """return the best probability possible when n nodes still need to be attached
-        assuming the best overall prob in the distrib"""
+        """return the lowest cost possible for attaching the nodes that
+        still need to be attached, ie. the sum of their best incoming
+        attachment costs (this is admissible)
+
+        If the edus to link were given to :py:func:`preprocess_heuristics`,
+        these sums are precomputed, and this is just a lookup"""
+        best_costs = self.shared()["heuristics"].get("best_cost_suffix")
+        if best_costs is not None:
+            return best_costs[self.data().position()]
         missing_links = self.data().tobedone()
         transform = self._mk_score_transform()
         return sum(transform(self.shared()["heuristics"]["best_attach"][x])
@@ -337,9 +409,19 @@ class TwoStageNROData(DiscData):
                                               tolink=tolink)
         self._accessible_global = accessible or []
         self._accessible_sentence = accessible or []
+        self._tolink = tolink or []
         self._intra = True
         self._current_sentence = 1
 
+    def final(self):
+        return self._tolink == []
+
+    def tobedone(self):
+        """
+        wip: unlike the parent class, this is mutable
+        """
+        return self._tolink
+
     def accessible(self):
         """
         wip:
@@ -407,11 +489,12 @@ class TwoStageNRO(DiscourseState):
 
 ###################################
 
-class DiscourseSearch(Search):
+class DiscourseSearchMixin(object):
     """
-    subtype of astar search for discourse: should be the same for
-    every astar decoder, provided the discourse state is a subclass
-    of DiscourseState
+    discourse specific part of the search (state building and
+    solution recovery), shared by the astar and beam variants:
+    should be the same for every astar decoder, provided the
+    discourse state is a subclass of DiscourseState
 
     recover solution should be as is, provided a state has at least the following
     info:
@@ -433,9 +516,12 @@ class DiscourseSearch(Search):
         return res
 
 
+class DiscourseSearch(DiscourseSearchMixin, Search):
+    "astar search for discourse"
 
-class DiscourseBeamSearch(DiscourseSearch, BeamSearch):
-    pass
+
+class DiscourseBeamSearch(DiscourseSearchMixin, BeamSearch):
+    "beam search for discourse"
 
 
 class Heuristic(Enum):
@@ -486,10 +572,13 @@ class AstarArgs(namedtuple('AstarArgs',
 
 
 
-def preprocess_heuristics(cands):
+def preprocess_heuristics(cands, tolink=None, use_prob=True):
     """precompute a set of useful information used by heuristics, such as
              - best probability
              - table of best probability when attaching a node, indexed on that node
+             - (if the list of edus to link is given) arrays of the
+               lowest possible (and average) cost of attaching all
+               edus from a given position in that list onwards
 
     format of cands is format given in main decoder: a list of
     (arg1,arg2,proba,best_relation)
@@ -498,12 +587,34 @@ def preprocess_heuristics(cands):
     result["best_overall"] = max([x[2] for x in cands])
     result["best_attach"] = defaultdict(float)
     result["average"] = defaultdict(list)
+    lowest = {}
     for du1, du2, score, label in cands:
         result["best_attach"][du2.id] = max(result["best_attach"][du2.id], score)
         result["average"][du2.id].append(score)
+        lowest[du2.id] = min(lowest.get(du2.id, numpy.inf), score)
 
     for one in result["average"]:
         result["average"][one] = sum(result["average"][one])/len(result["average"][one])
+
+    if tolink is not None:
+        def suffix_sums(costs):
+            "sum of costs from each position onwards"
+            return numpy.append(numpy.cumsum(costs[::-1])[::-1], 0.)
+
+        if use_prob:
+            # cost is -log(prob): the highest prob gives the lowest cost
+            best = [result["best_attach"].get(x, 0.) for x in tolink]
+            average = [result["average"].get(x, 0.) for x in tolink]
+            with numpy.errstate(divide='ignore'):
+                best = -numpy.log(best)
+                average = -numpy.log(average)
+        else:
+            # scores are costs
+            best = [lowest.get(x, numpy.inf) for x in tolink]
+            average = [result["average"].get(x, numpy.inf) for x in tolink]
+        result["best_cost_suffix"] = suffix_sums(best)
+        result["average_cost_suffix"] = suffix_sums(average)
+
     #print(result, file= sys.stderr)
     return result
 
@@ -515,22 +626,29 @@ def preprocess_heuristics(cands):
 #   the original strategy should be called simpleNRO or NRO
 class AstarDecoder(Decoder):
     """wrapper for astar decoder to be used by processing pipeline
-    returns the best structure
+    returns the best structure (or the n best ones, see `decode_nbest`)
     """
     def __init__(self, astar_args):
         self._heuristic = astar_args.heuristics
         self._args = astar_args
 
-    def decode(self, dpack):
+    def _launch(self, dpack):
+        """start searching for solutions on the given datapack
+
+        :rtype: (DiscourseSearch, iterator(DiscourseState))
+        """
         cands = simple_candidates(dpack)
         probs = get_prob_map(cands)
         edus = [x.id for x in get_sorted_edus(cands)]
         print("\t %s nodes to attach"%(len(edus)-1), file=sys.stderr)
 
         heuristic = HEURISTICS[self._heuristic]
+        heuristic_info = preprocess_heuristics(cands,
+                                               tolink=edus[1:],
+                                               use_prob=self._args.use_prob)
         search_shared = {"probs": probs,
                          "use_prob": self._args.use_prob,
-                         "heuristics": preprocess_heuristics(cands),
+                         "heuristics": heuristic_info,
                          "RFC": self._args.rfc}
         if self._args.beam:
             astar = DiscourseBeamSearch(heuristic=heuristic,
@@ -539,8 +657,30 @@ class AstarDecoder(Decoder):
         else:
             astar = DiscourseSearch(heuristic=heuristic,
                                     shared=search_shared)
-            genall = astar.launch(DiscData(accessible=[edus[0]], tolink=edus[1:]),
-                                  norepeat=True, verbose=False)
+        genall = astar.launch(DiscData(accessible=[edus[0]], tolink=edus[1:]),
+                              norepeat=True, verbose=False)
+        return astar, genall
+
+    def decode(self, dpack):
+        astar, genall = self._launch(dpack)
         endstate = genall.next()
         sol = astar.recover_solution(endstate)
         return convert_prediction(dpack, sol)
+
+    def decode_nbest(self, dpack, nbest):
+        """return the (up to) `nbest` best structures we can find,
+        best first, each as a copy of the datapack with predictions
+        set, along with its cost
+
+        This is a single search: we just keep pulling solutions out
+        of it, so its queue (and seen states if any; though in natural
+        reading order each state can only be reached in one way) carry
+        over from one solution to the next, and nothing is explored
+        twice
+
+        :rtype: [(DataPack, float)]
+        """
+        astar, genall = self._launch(dpack)
+        return [(convert_prediction(dpack, astar.recover_solution(state)),
+                 state.cost())
+                for state in islice(genall, nbest)]
@@ -2,12 +2,12 @@
 Baseline decoders
 """
 
+import numpy as np
+
 from .interface import Decoder
-from .util import (convert_prediction,
-                   get_sorted_edus,
-                   get_prob_map,
-                   DecoderException,
-                   simple_candidates)
+from .util import (document_edu_indices,
+                   prediction_from_mask,
+                   DecoderException)
 
 # pylint: disable=too-few-public-methods
 
@@ -18,39 +18,36 @@ class LocalBaseline(Decoder):
         self._threshold = threshold if use_prob else 0.0
 
     def decode(self, dpack):
-        cands = simple_candidates(dpack)
-        results = [(e1.id, e2.id, lab) for e1, e2, w, lab in cands
-                   if w > self._threshold]
-        return convert_prediction(dpack, results)
+        return prediction_from_mask(dpack,
+                                    dpack.graph.attach > self._threshold)
 
 
 class LastBaseline(Decoder):
     "attach to last, always"
 
     def decode(self, dpack):
-        cands = simple_candidates(dpack)
-        labels_probs = get_prob_map(cands)
-
-        def get_prediction(edu1, edu2):
-            """Return triple of EDU ids and label from the probability
-            distribution (or None if no attachment)"""
-            span1 = edu1.span()
-            span2 = edu2.span()
-            id_pair = (edu1.id, edu2.id)
-            if id_pair in labels_probs:
-                label, _ = labels_probs[id_pair]
-                return (edu1.id, edu2.id, label)
-            elif span1 == span2:
-                return None
-            else:
-                raise DecoderException("Could not find row with EDU pairs "
-                                       "%s and %s: " % (edu1.id, edu2.id))
-
-        edus = get_sorted_edus(cands)
-        ordered_pairs = zip(edus[:-1], edus[1:])
-        results = []
-        for edu1, edu2 in ordered_pairs:
-            prediction = get_prediction(edu1, edu2)
-            if prediction:
-                results.append(prediction)
-        return convert_prediction(dpack, results)
+        pairings, rows, docs, src_idx, tgt_idx =\
+            document_edu_indices(dpack)
+        table = pairings.table
+        starts = table.start[rows]
+        ends = table.end[rows]
+        # EDUs in textual order within each document; each attaches
+        # to the one right before it
+        order = np.lexsort((np.arange(len(rows)), ends, starts, docs))
+        same_doc = docs[order][1:] == docs[order][:-1]
+        edu1 = order[:-1][same_doc]
+        edu2 = order[1:][same_doc]
+
+        num_edus = len(rows)
+        pair_keys = src_idx * num_edus + tgt_idx
+        wanted = edu1 * num_edus + edu2
+        missing = ~np.in1d(wanted, pair_keys)
+        # EDUs with the same span just don't attach to each other
+        missing &= ((starts[edu1] != starts[edu2]) |
+                    (ends[edu1] != ends[edu2]))
+        if missing.any():
+            idx = np.flatnonzero(missing)[0]
+            ids = [table.edus[rows[x]].id for x in (edu1[idx], edu2[idx])]
+            raise DecoderException("Could not find row with EDU pairs "
+                                   "%s and %s: " % tuple(ids))
+        return prediction_from_mask(dpack, np.in1d(pair_keys, wanted))
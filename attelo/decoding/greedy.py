@@ -9,13 +9,16 @@ July 2012
 '''
 
 from __future__ import print_function
+from bisect import bisect_left
+from collections import defaultdict
+import heapq
 import sys
 
+import numpy as np
+
 from .interface import Decoder
-from .util import (convert_prediction,
-                   get_sorted_edus,
-                   get_prob_map,
-                   simple_candidates)
+from .util import (edu_pairing_indices,
+                   prediction_from_edges)
 
 # pylint: disable=too-few-public-methods
 
@@ -54,6 +57,69 @@ def is_embedded(one, two):
     return two.id != one.id and two.start <= one.start and one.end <= two.end
 
 
+def _neighbour_sets(starts, ends):
+    '''
+    Neighbours of each EDU, as sets of EDU numbers, for EDUs sorted
+    by (start, end). Two EDUs are neighbours if they are strictly
+    adjacent or if one is embedded in the other (see
+    :py:func:`are_strictly_adjacent` and :py:func:`is_embedded`).
+
+    Rather than checking every pair of EDUs against every other EDU,
+    we use the fact that an EDU has at most one strictly adjacent
+    EDU to its right: the one (if any) whose start is the first
+    position on or after its end that is an endpoint of another EDU,
+    provided no other EDU has an endpoint there. Overlapping EDUs
+    (which are always adjacent) are found by sweeping through the
+    sorted starts. This is O(n log n), plus the number of
+    overlapping pairs.
+
+    :type starts: [int]
+    :type ends: [int]
+    :rtype: [set(int)]
+    '''
+    num_edus = len(starts)
+    neighbours = [set() for _ in range(num_edus)]
+
+    def add(one, two):
+        'mark two EDUs as neighbours'
+        neighbours[one].add(two)
+        neighbours[two].add(one)
+
+    # strictly adjacent (no EDU endpoints in between)
+    owners = defaultdict(set)
+    for edu in range(num_edus):
+        owners[starts[edu]].add(edu)
+        owners[ends[edu]].add(edu)
+    positions = sorted(owners)
+    for one in range(num_edus):
+        i = bisect_left(positions, ends[one])
+        if owners[positions[i]] == set([one]):
+            i += 1
+        if i == len(positions):
+            continue
+        others = owners[positions[i]] - set([one])
+        if len(others) == 1:
+            two = others.pop()
+            if starts[two] == positions[i]:
+                add(one, two)
+
+    # overlapping (with zero-width EDUs, only if strictly inside)
+    for one in range(num_edus):
+        two = one + 1
+        while two < num_edus and starts[two] < ends[one]:
+            if ends[two] > starts[one]:
+                add(one, two)
+            two += 1
+
+    # zero-width EDUs embedded in others (including at the edges)
+    for one in range(num_edus):
+        if starts[one] == ends[one]:
+            for two in range(num_edus):
+                if two != one and starts[two] <= starts[one] <= ends[two]:
+                    add(one, two)
+    return neighbours
+
+
 def get_neighbours(edus):
     '''
     Return a mapping from each EDU to its neighbours
@@ -61,36 +127,59 @@ def get_neighbours(edus):
     :type edus: [Edu]
     :rtype: Dict Edu [Edu]
     '''
-
+    order = sorted(range(len(edus)),
+                   key=lambda i: (edus[i].start, edus[i].end))
+    nsets = _neighbour_sets([edus[i].start for i in order],
+                            [edus[i].end for i in order])
     neighbours = dict()
-    for one in edus:
-        one_neighbours = []
-        one_neighbours_ids = set()
-        for two in edus:
-            if one.id != two.id:
-                if are_strictly_adjacent(one, two, edus):
-                    if two.id not in one_neighbours_ids:
-                        one_neighbours_ids.add(two.id)
-                        one_neighbours.append(two)
-                if is_embedded(one, two) or is_embedded(two, one):
-                    if two.id not in one_neighbours_ids:
-                        one_neighbours_ids.add(two.id)
-                        one_neighbours.append(two)
-
-        neighbours[one] = one_neighbours
-
+    for pos, nset in enumerate(nsets):
+        # neighbours are listed in the same order as the input
+        neighbours[edus[order[pos]]] = [edus[i] for i in
+                                        sorted(order[x] for x in nset)]
     return neighbours
 
 
 class LocallyGreedyState(object):
     '''
     the mutable parts of the locally greedy algorithm
+
+    EDUs are numbered in order of their spans
+
+    :param neighbours: neighbours of each EDU (EDU numbers, in order)
+    :type neighbours: [[int]]
+
+    :param probs: attachment probability for each pair of EDUs
+                  (0 for pairs that are not candidates)
+    :type probs: 2D array(float)
+
+    :param verbose: print the number of EDUs left to attach at
+                    each step
+    :type verbose: bool
     '''
-    def __init__(self, instances):
-        self._edus = get_sorted_edus(instances)
-        self._edu_ids = set(x.id for x in self._edus)
-        self._neighbours = get_neighbours(self._edus)
-        self._prob_dist = get_prob_map(instances)
+    def __init__(self, neighbours, probs, verbose=False):
+        self._neighbours = [list(x) for x in neighbours]
+        self._neighbour_sets = [set(x) for x in neighbours]
+        self._probs = probs
+        self._alive = [True] * len(neighbours)
+        self._num_alive = len(neighbours)
+        self._verbose = verbose
+        # candidate links: we want the highest probability, and on
+        # ties, the earliest source EDU and then the earliest of its
+        # neighbours
+        self._heap = []
+        for source in range(len(neighbours)):
+            self._push_links(source, 0)
+
+    def _push_links(self, source, start):
+        '''
+        Add candidate links from the source to its neighbours,
+        from position `start` in its list of neighbours onwards
+        '''
+        nbrs = self._neighbours[source]
+        probs = self._probs[source, nbrs[start:]].tolist()
+        for idx, prob in enumerate(probs, start):
+            if prob > 0.:
+                heapq.heappush(self._heap, (-prob, source, idx, nbrs[idx]))
 
     def _remove_edu(self, original, target):
         '''
@@ -98,14 +187,22 @@ class LocallyGreedyState(object):
         (that the original in meant to point to): remove the original
         edu and merge its neighbourhood into that of the target
         '''
-        self._edus.remove(original)
-        self._edu_ids.remove(original.id)
+        self._alive[original] = False
+        self._num_alive -= 1
+        if not self._alive[target]:
+            # a removed EDU can still be attached to, but since it
+            # won't be attaching to anything, its neighbourhood no
+            # longer matters
+            return
         # PM : added to propagate locality to percolated span heads
         tgt_neighbours = self._neighbours[target]
-        tgt_neighbours.extend(self._neighbours[original])
-        # print(neighbours[new_span], file=sys.stderr)
-        tgt_neighbours = [x for x in tgt_neighbours
-                          if x.id in self._edu_ids and x.id != target.id]
+        tgt_set = self._neighbour_sets[target]
+        start = len(tgt_neighbours)
+        for edu in self._neighbours[original]:
+            if edu not in tgt_set:
+                tgt_set.add(edu)
+                tgt_neighbours.append(edu)
+        self._push_links(target, start)
 
     def _attach_best(self):
         '''
@@ -113,58 +210,67 @@ class LocallyGreedyState(object):
         highest probability link between any two neighbours.
         Remove the source EDU from future consideration.
 
-        :rtype: None
+        :rtype: (int, int) or None
         '''
-        highest = 0.0
-        to_remove = None
-        attachment = None
-        new_span = None
-
-        for source in self._edus:
-            for target in self._neighbours[source]:
-                if (source.id, target.id) in self._prob_dist:
-                    label, prob = self._prob_dist[(source.id, target.id)]
-                    if prob > highest:
-                        highest = prob
-                        to_remove = source
-                        new_span = target
-                        attachment = (source.id, target.id, label)
-
-        if to_remove is not None:
-            self._remove_edu(to_remove, new_span)
-            return attachment
-        else:  # stop if nothing to attach, but this is wrong
-            # print("warning: no attachment found", file=sys.stderr)
-            # print(edus)
-            # print(edus_id)
-            # print([neighbours[x] for x in edus])
-            # sys.exit(0)
-            self._edus = []
-            return None
+        while self._heap:
+            _, source, _, target = heapq.heappop(self._heap)
+            # links from EDUs that have since been removed are
+            # dropped lazily
+            if self._alive[source]:
+                self._remove_edu(source, target)
+                return (source, target)
+        # stop if nothing to attach, but this is wrong
+        return None
 
     def decode(self):
         '''
         Run the decoder
 
-        :rtype [(EDU, EDU, string)]
+        :rtype [(int, int)]
         '''
         attachments = []
-        while len(self._edus) > 1:
-            print(len(self._edus), end=' ', file=sys.stderr)
+        while self._num_alive > 1:
+            if self._verbose:
+                print(self._num_alive, end=' ', file=sys.stderr)
             attach = self._attach_best()
-            if attach is not None:
-                attachments.append(attach)
-        print("", file=sys.stderr)
+            if attach is None:
+                break
+            attachments.append(attach)
+        if self._verbose:
+            print("", file=sys.stderr)
         return attachments
 
 
-# pylint: disable=unused-argument
 class LocallyGreedy(Decoder):
     '''
     The locally greedy decoder
+
+    :param verbose: print progress information to stderr
+    :type verbose: bool
     '''
+    def __init__(self, verbose=False):
+        self._verbose = verbose
+
     def decode(self, dpack):
-        cands = simple_candidates(dpack)
-        prediction = LocallyGreedyState(cands).decode()
-        return convert_prediction(dpack, prediction)
-# pylint: enable=unused-argument
+        if dpack.graph is None:
+            raise ValueError("Tried to extract weights from an "
+                             "unweighted datapack")
+        pairings, rows, src_idx, tgt_idx = edu_pairing_indices(dpack)
+        table = pairings.table
+        # renumber the EDUs in span order
+        order = np.lexsort((table.end[rows], table.start[rows]))
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        src_pos = rank[src_idx]
+        tgt_pos = rank[tgt_idx]
+
+        probs = np.zeros((len(rows), len(rows)))
+        probs[src_pos, tgt_pos] = dpack.graph.attach
+        neighbours = [sorted(x) for x in
+                      _neighbour_sets(table.start[rows][order].tolist(),
+                                      table.end[rows][order].tolist())]
+        state = LocallyGreedyState(neighbours, probs, verbose=self._verbose)
+        chosen = np.zeros(probs.shape, dtype=np.bool_)
+        for source, target in state.decode():
+            chosen[source, target] = True
+        return prediction_from_edges(dpack, chosen, src_pos, tgt_pos)
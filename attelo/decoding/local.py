@@ -1,10 +1,17 @@
 """
 Local decoders make decisions for each edge independently.
+
+These work directly on the datapack graph arrays, so they can
+decode a stack of several documents (eg. a whole test fold) in a
+single call.
 """
 
+import numpy as np
+
 from .interface import Decoder
-from .util import (convert_prediction,
-                   simple_candidates)
+from .util import (document_edu_indices,
+                   first_in_groups,
+                   prediction_from_mask)
 
 
 class AsManyDecoder(Decoder):
@@ -16,17 +23,27 @@ class AsManyDecoder(Decoder):
     """
 
     def decode(self, dpack):
-        """Return the set of top N edges
+        """Return the set of top N edges (for each document)
         """
-        cands = simple_candidates(dpack)
-        # number of real EDUs
-        nb_edus = len(dpack.edus)
-        # sort candidates by their scores (in reverse order)
-        sorted_cands = sorted(cands, key=lambda c: c[2], reverse=True)
+        pairings, rows, docs, _, tgt_idx = document_edu_indices(dpack)
+        pair_docs = docs[tgt_idx]
+        # sort candidates by document, then by their scores
+        # (in reverse order)
+        order = np.lexsort((np.arange(len(dpack)),
+                            -dpack.graph.attach,
+                            pair_docs))
+        sorted_docs = pair_docs[order]
+        doc_start = np.searchsorted(sorted_docs, sorted_docs)
+        # number of real EDUs in each document (not the fake root)
+        uniq_docs = np.unique(docs)
+        real = ~pairings.table.is_root[rows]
+        nb_edus = np.bincount(np.searchsorted(uniq_docs, docs[real]),
+                              minlength=len(uniq_docs))
+        doc_size = nb_edus[np.searchsorted(uniq_docs, sorted_docs)]
         # take the top N candidates, where N is the number of real EDUs
-        predicted = [(src.id, tgt.id, lbl)
-                     for src, tgt, _, lbl in sorted_cands[:nb_edus]]
-        return convert_prediction(dpack, predicted)
+        chosen = np.zeros(len(dpack), dtype=np.bool_)
+        chosen[order] = np.arange(len(order)) - doc_start < doc_size
+        return prediction_from_mask(dpack, chosen)
 
 
 class BestIncomingDecoder(Decoder):
@@ -41,17 +58,7 @@ class BestIncomingDecoder(Decoder):
     def decode(self, dpack):
         """Return the best incoming edge for each EDU
         """
-        # best incoming edge for each EDU
-        inc_edges = {}
-        for cand in simple_candidates(dpack):
-            src, tgt, score, lbl = cand
-            if tgt.id in inc_edges:
-                cur_best = inc_edges[tgt.id][2]
-                if score > cur_best:
-                    inc_edges[tgt.id] = cand
-            else:
-                inc_edges[tgt.id] = cand
-
-        predicted = [(src.id, tgt.id, lbl)
-                     for src, tgt, score, lbl in inc_edges.values()]
-        return convert_prediction(dpack, predicted)
+        _, _, _, _, tgt_idx = document_edu_indices(dpack)
+        chosen = np.zeros(len(dpack), dtype=np.bool_)
+        chosen[first_in_groups(tgt_idx, dpack.graph.attach)] = True
+        return prediction_from_mask(dpack, chosen)
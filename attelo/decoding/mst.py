@@ -5,19 +5,17 @@ Created on Jun 27, 2012
 '''
 
 from __future__ import print_function
-from collections import defaultdict
 
-from depparse.graph import Digraph
+import numpy as np
 # pylint: disable=no-name-in-module
 from scipy.special import logit
 # pylint: enable=no-name-in-module
 
-from ..edu import FAKE_ROOT_ID
 from ..util import ArgparserEnum
 from .interface import Decoder
 from .util import (DecoderException,
-                   convert_prediction,
-                   simple_candidates)
+                   edu_pairing_indices,
+                   prediction_from_edges)
 
 # pylint: disable=too-few-public-methods
 
@@ -25,60 +23,248 @@ from .util import (DecoderException,
 MAX_SCORE = 1e90
 MIN_SCORE = -MAX_SCORE
 
+# score for pairs of EDUs that are not candidate edges
+NO_EDGE = -np.inf
+
 
 def _cap_score(score):
     '''
-    the depparse package's MST implementation uses a hardcoded minimum score of
-    `-1e100`.
-    Feeding it lower weights crashes the algorithm
-    We set minimum and maximum scores to avoid this
-    Unless we have more than 1e10 nodes, combined scores can't reach the limit
-
-    :type score: float
-    :rtype: float
+    Keep scores within [MIN_SCORE, MAX_SCORE], so that even
+    edges with a zero probability (logit -inf) remain distinct
+    from missing edges (:py:data:`NO_EDGE`), and combined scores
+    do not overflow. Unless we have more than 1e10 nodes,
+    combined scores can't reach the limit
+
+    :type score: float or array(float)
+    :rtype: float or array(float)
     '''
-    return min(MAX_SCORE, max(MIN_SCORE, score))
+    return np.clip(score, MIN_SCORE, MAX_SCORE)
 
 
-def _leftmost_edu(edus):
-    """ Returns the default root node for MST/MSDAG algorithm
+def _best_incoming(scores, node):
+    '''
+    Best source for the given node (-1 if it has no incoming
+    edges at all)
+    '''
+    src = int(np.argmax(scores[:, node]))
+    return src if scores[src, node] > NO_EDGE else -1
 
-        Currently, the EDU in first position.
 
-        The Chu-Liu-Edmonds algorithm used for MST/MSDAG requires a
-        root node (with no incoming edges). We ensure there is one.
-    """
-    return sorted(edus, key=lambda e: e.span)[0]
+def _find_cycles(incoming):
+    '''
+    All cycles in the graph formed by following best incoming
+    edges (each node has at most one incoming edge, so these
+    are disjoint)
 
+    :rtype: [[int]]
+    '''
+    cycles = []
+    # 0: unvisited, 1: visited on the current walk, 2: done
+    state = np.zeros(len(incoming), dtype=np.int8)
+    for start in range(len(incoming)):
+        walk = []
+        node = start
+        while node >= 0 and state[node] == 0:
+            state[node] = 1
+            walk.append(node)
+            node = incoming[node]
+        if node >= 0 and state[node] == 1:
+            cycles.append(walk[walk.index(node):])
+        state[walk] = 2
+    return cycles
+
+
+def _cycle_through(incoming, node):
+    '''
+    The cycle going through the given node if there is one,
+    else None
+
+    :rtype: [int] or None
+    '''
+    cycle = [node]
+    seen = set(cycle)
+    cur = incoming[node]
+    while cur >= 0 and cur not in seen:
+        cycle.append(cur)
+        seen.add(cur)
+        cur = incoming[cur]
+    return cycle if cur == node else None
 
-def _msdag(graph):
-    """ Returns a subgraph of graph (a Digraph) corresponding to its
-        Maximum Spanning Directed Acyclic Graph
+
+def chu_liu_edmonds(scores):
+    '''
+    Maximum spanning arborescence of a dense directed graph
+    (Chu-Liu-Edmonds, with Tarjan's dense O(n^2) contraction
+    scheme)
+
+    Nodes without any incoming edge are roots; there is normally
+    only one (edges into the designated root should have been
+    removed beforehand), but if there are several, we return a
+    maximum spanning forest. Likewise, if a cycle of nodes has no
+    incoming edge from outside, it is broken at its weakest edge.
+
+    Parameters
+    ----------
+    scores: 2D array(float)
+        `scores[i, j]` is the score of the edge from node `i` to
+        node `j` (:py:data:`NO_EDGE` if there is no such edge)
+
+    Returns
+    -------
+    heads: array(int)
+        source of the incoming edge for each node in the tree
+        (-1 for roots)
+    '''
+    num_nodes = scores.shape[0]
+    if num_nodes == 0:
+        return np.zeros(0, dtype=np.int64)
+    # contracting a cycle creates a new node, so there can be at
+    # most 2n - 1 of them
+    size = 2 * num_nodes
+    wts = np.empty((size, size))
+    wts.fill(NO_EDGE)
+    wts[:num_nodes, :num_nodes] = scores
+    np.fill_diagonal(wts, NO_EDGE)
+    # the original edge each (contracted) edge stands for
+    orig_src = np.zeros((size, size), dtype=np.int64)
+    orig_tgt = np.zeros((size, size), dtype=np.int64)
+    orig_src[:num_nodes, :num_nodes] = np.arange(num_nodes)[:, None]
+    orig_tgt[:num_nodes, :num_nodes] = np.arange(num_nodes)[None, :]
+
+    incoming = np.empty(size, dtype=np.int64)
+    incoming.fill(-1)
+    for node in range(num_nodes):
+        incoming[node] = _best_incoming(wts, node)
+    parent = np.empty(size, dtype=np.int64)
+    parent.fill(-1)
+    contractions = []
+    pending = _find_cycles(incoming[:num_nodes])
+    num_alive = num_nodes
+    while pending:
+        cycle = np.array(pending.pop(), dtype=np.int64)
+        new = num_alive
+        num_alive += 1
+        cycle_wts = wts[incoming[cycle], cycle]
+        cycle_edges = (orig_src[incoming[cycle], cycle],
+                       orig_tgt[incoming[cycle], cycle])
+        # (nodes from `num_alive` onwards do not exist yet)
+        rng = np.arange(num_alive)
+        # edges into the cycle: we gain their score, but lose the
+        # score of the cycle edge they replace
+        in_wts = wts[:num_alive, cycle] - cycle_wts
+        best = np.argmax(in_wts, axis=1)
+        wts[:num_alive, new] = in_wts[rng, best]
+        orig_src[:num_alive, new] = orig_src[rng, cycle[best]]
+        orig_tgt[:num_alive, new] = orig_tgt[rng, cycle[best]]
+        # edges out of the cycle
+        best = np.argmax(wts[cycle, :num_alive], axis=0)
+        wts[new, :num_alive] = wts[cycle[best], rng]
+        orig_src[new, :num_alive] = orig_src[cycle[best], rng]
+        orig_tgt[new, :num_alive] = orig_tgt[cycle[best], rng]
+        # retire the cycle nodes
+        wts[cycle, :num_alive] = NO_EDGE
+        wts[:num_alive, cycle] = NO_EDGE
+        wts[new, new] = NO_EDGE
+        parent[cycle] = new
+        contractions.append((new, cycle, cycle_wts, cycle_edges))
+        # nodes that were attached to the cycle now hang off the
+        # new node (and have no better option)
+        incoming[:num_alive][np.in1d(incoming[:num_alive], cycle)] = new
+        incoming[cycle] = -1
+        incoming[new] = _best_incoming(wts[:num_alive], new)
+        new_cycle = _cycle_through(incoming, new)
+        if new_cycle is not None:
+            pending.append(new_cycle)
+
+    # expand the contracted nodes back out, most recent first
+    heads = np.empty(num_nodes, dtype=np.int64)
+    heads.fill(-1)
+    entry = {}  # node -> original edge into it
+    for node in range(num_alive):
+        if parent[node] < 0 and incoming[node] >= 0:
+            entry[node] = (orig_src[incoming[node], node],
+                           orig_tgt[incoming[node], node])
+    for new, cycle, cycle_wts, cycle_edges in reversed(contractions):
+        if new in entry:
+            src, tgt = entry.pop(new)
+            # which cycle node does the outside edge go into?
+            broken = tgt
+            while parent[broken] != new:
+                broken = parent[broken]
+            broken = int(np.flatnonzero(cycle == broken)[0])
+        else:
+            src = tgt = None
+            broken = int(np.argmin(cycle_wts))
+        for i, node in enumerate(cycle.tolist()):
+            if i != broken:
+                entry[node] = (cycle_edges[0][i], cycle_edges[1][i])
+            elif src is not None:
+                entry[node] = (src, tgt)
+    for src, tgt in entry.values():
+        heads[tgt] = src
+    return heads
+
+
+# bit masks for each position within a byte (same order as np.packbits)
+_BITS = (1 << (7 - np.arange(8))).astype(np.uint8)
+
+
+class _Reachability(object):
+    """ Reachability between the nodes of a growing DAG, kept as a
+        bitset for each node (bit `v` in the row for `u` is set if
+        there is a path from `u` to `v`). Checking for a path is
+        constant time; adding an edge costs a vectorised OR over
+        the rows of the nodes upstream of it
+    """
+    def __init__(self, num_nodes):
+        self._bits = np.zeros((num_nodes, (num_nodes + 7) // 8),
+                              dtype=np.uint8)
+        nodes = np.arange(num_nodes)
+        self._bits[nodes, nodes >> 3] = _BITS[nodes & 7]
+
+    def reaches(self, src, tgt):
+        "True if there is a path from `src` to `tgt`"
+        return bool(self._bits[src, tgt >> 3] & _BITS[tgt & 7])
+
+    def add_edge(self, src, tgt):
+        "Record an edge from `src` to `tgt`"
+        if self.reaches(src, tgt):
+            return
+        # everything that reaches src now reaches what tgt reaches
+        upstream = (self._bits[:, src >> 3] & _BITS[src & 7]) != 0
+        self._bits[upstream] |= self._bits[tgt]
+
+
+def msdag(scores):
+    """ Returns the edges of the Maximum Spanning Directed Acyclic
+        Graph of a dense directed graph (see
+        :py:func:`chu_liu_edmonds` for the input format)
 
         Algorithm is semi-greedy-MSDAG as described in Schluter_:
         .. _Schluter (2014): http://aclweb.org/anthology/W14-2412
-    """
-    tree = graph.mst()
-    # Sort edges in orginal graph by decreasing score
-    edges = sorted(graph.iteredges(), key=lambda p: -graph.get_score(*p))
 
-    for src, tgt in edges:
+        :rtype: 2D array(bool)
+    """
+    heads = chu_liu_edmonds(scores)
+    chosen = np.zeros(scores.shape, dtype=np.bool_)
+    tree_tgts = np.flatnonzero(heads >= 0)
+    chosen[heads[tree_tgts], tree_tgts] = True
+    reach = _Reachability(len(heads))
+    for src, tgt in zip(heads[tree_tgts].tolist(), tree_tgts.tolist()):
+        reach.add_edge(src, tgt)
+
+    # Edges in orginal graph by decreasing score
+    srcs, tgts = np.nonzero(scores > NO_EDGE)
+    order = np.argsort(-scores[srcs, tgts], kind='mergesort')
+    for src, tgt in zip(srcs[order].tolist(), tgts[order].tolist()):
         # Already in graph ?
-        if tgt in tree.successors[src]:
+        if chosen[src, tgt]:
             continue
-        # Add the edge, revert if cycle is created
-        tree.successors[src].append(tgt)
-        if tree.find_cycle():
-            tree.successors[src].remove(tgt)
-
-    # Update score and label functions
-    new_map = lambda f: dict(((s, t), f(s, t)) for s, t in tree.iteredges())
-    nscores = new_map(graph.get_score)
-    nlabels = new_map(graph.get_label)
-
-    return Digraph(tree.successors,
-                   lambda s, t: nscores[s, t],
-                   lambda s, t: nlabels[s, t])
+        # Add the edge unless it would create a cycle
+        if not reach.reaches(tgt, src):
+            chosen[src, tgt] = True
+            reach.add_edge(src, tgt)
+    return chosen
 
 
 class MstRootStrategy(ArgparserEnum):
@@ -97,60 +283,53 @@ class MstDecoder(Decoder):
         self._use_prob = use_prob
         self._root_strategy = root_strategy
 
-    def _graph(self, instances):
-        """ Builds a directed graph for instances
-
-            instances are quadruplets of the form:
-                edu_source, edu_target, probability_of_attachment, relation
+    def _score_matrix(self, dpack):
+        """ Builds a dense score matrix for the EDUs in a datapack,
+            with (for each pairing) the EDU numbers of its source
+            and target
 
-            :rtype Digraph
+            :rtype (2D array(float), array(int), array(int))
         """
-
+        if dpack.graph is None:
+            raise ValueError("Tried to extract weights from an "
+                             "unweighted datapack")
+        pairings, rows, src_idx, tgt_idx = edu_pairing_indices(dpack)
+        table = pairings.table
         if self._root_strategy == MstRootStrategy.leftmost:
-            root_id = _leftmost_edu(set(e for s, t, _, _ in instances
-                                        for e in (s, t))).id
+            # The Chu-Liu-Edmonds algorithm used for MST/MSDAG
+            # requires a root node (with no incoming edges). We
+            # ensure there is one: the EDU in first position
+            root = np.lexsort((table.end[rows], table.start[rows]))[:1]
         elif self._root_strategy == MstRootStrategy.fake_root:
-            root_id = FAKE_ROOT_ID
+            root = np.flatnonzero(table.is_root[rows])
         else:
             raise DecoderException('Unknown root finding strategy: ' +
                                    str(self._root_strategy))
 
-        targets = defaultdict(list)
-        labels = dict()
-        scores = dict()
-
-        for source, target, prob, rel in instances:
-            src, tgt = source.id, target.id
-
-            # Ignore all edges directed to the root
-            if tgt == root_id:
-                continue
-
-            if self._use_prob:
-                scores[src, tgt] = _cap_score(logit(prob))
-            else:
-                scores[src, tgt] = prob
-            labels[src, tgt] = rel
-            targets[src].append(tgt)
-
-        return Digraph(targets,
-                       lambda s, t: scores[s, t],
-                       lambda s, t: labels[s, t])
+        if self._use_prob:
+            pair_scores = _cap_score(logit(dpack.graph.attach))
+        else:
+            pair_scores = dpack.graph.attach
+        scores = np.empty((len(rows), len(rows)))
+        scores.fill(NO_EDGE)
+        scores[src_idx, tgt_idx] = pair_scores
+        # Ignore all edges directed to the root
+        scores[:, root] = NO_EDGE
+        return scores, src_idx, tgt_idx
 
     def decode(self, dpack):
-        graph = self._graph(simple_candidates(dpack))
-        subgraph = graph.mst()
-        predictions = [(src, tgt, subgraph.get_label(src, tgt))
-                       for src, tgt in subgraph.iteredges()]
-        return convert_prediction(dpack, predictions)
+        scores, src_idx, tgt_idx = self._score_matrix(dpack)
+        heads = chu_liu_edmonds(scores)
+        chosen = np.zeros(scores.shape, dtype=np.bool_)
+        tgts = np.flatnonzero(heads >= 0)
+        chosen[heads[tgts], tgts] = True
+        return prediction_from_edges(dpack, chosen, src_idx, tgt_idx)
 
 
 class MsdagDecoder(MstDecoder):
     """ Attach according to MSDAG (subgraph of original)"""
 
     def decode(self, dpack):
-        graph = self._graph(simple_candidates(dpack))
-        subgraph = _msdag(graph)
-        predictions = [(src, tgt, subgraph.get_label(src, tgt))
-                       for src, tgt in subgraph.iteredges()]
-        return convert_prediction(dpack, predictions)
+        scores, src_idx, tgt_idx = self._score_matrix(dpack)
+        chosen = msdag(scores)
+        return prediction_from_edges(dpack, chosen, src_idx, tgt_idx)
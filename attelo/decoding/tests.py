@@ -9,10 +9,14 @@ import numpy as np
 from scipy.sparse import csr_matrix
 
 from ..table import (DataPack, Graph)
-from ..edu import EDU
-from . import astar, greedy, mst
+from ..edu import (EDU, FAKE_ROOT)
+from . import astar, baseline, greedy, local, mst
 from .astar import (AstarArgs, Heuristic, RfcConstraint)
-from .util import (prediction_to_triples, simple_candidates)
+from .util import (convert_prediction,
+                   prediction_from_links,
+                   prediction_to_links,
+                   prediction_to_triples,
+                   simple_candidates)
 
 # pylint: disable=too-few-public-methods
 # default values for perceptron learner
@@ -122,6 +126,39 @@ class AstarTest(DecoderTest):
         decoder = astar.AstarDecoder(astar_args)
         return decoder.decode(self.dpack)
 
+    def test_beam_search(self):
+        'beam search with the precomputed best-incoming heuristic'
+        def decode(beam):
+            'decode with the given beam size'
+            astar_args = astar.AstarArgs(heuristics=Heuristic.best,
+                                         rfc=RfcConstraint.simple,
+                                         beam=beam,
+                                         use_prob=True)
+            decoder = astar.AstarDecoder(astar_args)
+            return sorted(prediction_to_triples(decoder.decode(self.dpack)))
+        exact = decode(None)
+        self.assertEqual(len(exact), len(self.edus) - 1)
+        # a beam as wide as the search space finds the best solution
+        self.assertEqual(decode(100), exact)
+        self.assertEqual(len(decode(1)), len(self.edus) - 1)
+
+    def test_nbest(self):
+        'n-best A* decoding'
+        astar_args = astar.AstarArgs(heuristics=Heuristic.best,
+                                     rfc=RfcConstraint.simple,
+                                     beam=None,
+                                     use_prob=True)
+        decoder = astar.AstarDecoder(astar_args)
+        nbest = decoder.decode_nbest(self.dpack, 3)
+        self.assertEqual(len(nbest), 3)
+        costs = [c for _, c in nbest]
+        self.assertEqual(costs, sorted(costs))
+        solutions = [sorted(prediction_to_triples(p)) for p, _ in nbest]
+        self.assertEqual(solutions[0],
+                         sorted(prediction_to_triples(
+                             decoder.decode(self.dpack))))
+        self.assertEqual(len(set(tuple(x) for x in solutions)), 3)
+
     # FAILS: it's something to do with the initial state not having
     # any to do links..., would need to check with PM about this
     # def test_h_average(self):
@@ -136,6 +173,122 @@ class LocallyGreedyTest(DecoderTest):
         decoder = greedy.LocallyGreedy()
         decoder.decode(self.dpack)
 
+    def test_neighbours(self):
+        'neighbours are strictly adjacent or embedded EDUs'
+        edus = [mk_fake_edu(0, 3), mk_fake_edu(1, 2), mk_fake_edu(4, 6),
+                mk_fake_edu(7, 9), mk_fake_edu(8, 8), mk_fake_edu(10, 12),
+                mk_fake_edu(12, 14), mk_fake_edu(13, 15)]
+        expected = {}
+        for one in edus:
+            expected[one] = [two for two in edus if two != one and
+                             (greedy.are_strictly_adjacent(one, two, edus) or
+                              greedy.is_embedded(one, two) or
+                              greedy.is_embedded(two, one))]
+        self.assertEqual(greedy.get_neighbours(edus), expected)
+
+
+class PredictionTest(DecoderTest):
+    """ Tests for converting between predictions and links """
+
+    def test_links(self):
+        'array and string links give the same predictions'
+        triples = [('x0', 'x1', 'elaboration'),
+                   ('x2', 'x3', 'narration'),
+                   ('x3', 'x0', 'narration')]  # (not a pairing)
+        dpack = convert_prediction(self.dpack, triples)
+        self.assertEqual(dpack.graph.prediction.tolist(),
+                         [2, 1, 1, 1, 1, 3])
+        self.assertEqual(prediction_to_triples(dpack), triples[:2])
+        links = prediction_to_links(dpack)
+        self.assertEqual([x.tolist() for x in links],
+                         [[0, 2], [1, 3], [2, 3]])
+        self.assertEqual(prediction_from_links(dpack, *links)
+                         .graph.prediction.tolist(),
+                         dpack.graph.prediction.tolist())
+
+
+class LocalTest(DecoderTest):
+    """ Tests for local and baseline decoders """
+
+    def _stacked(self):
+        'the test datapack, stacked with a copy in another document'
+        edus = {e.id: EDU('y' + e.id, e.text, e.start, e.end,
+                          'y', e.subgrouping)
+                for e in self.edus}
+        other = DataPack(labels=self.dpack.labels,
+                         edus=[edus[e.id] for e in self.edus],
+                         pairings=[(edus[e1.id], edus[e2.id])
+                                   for e1, e2 in self.pairings],
+                         data=self.dpack.data,
+                         target=self.dpack.target,
+                         graph=Graph(prediction=self.graph.prediction,
+                                     attach=self.graph.attach[::-1],
+                                     label=self.graph.label),
+                         vocab=None)
+        return [self.dpack, other]
+
+    def test_local(self):
+        'check the decisions of the local decoders'
+        decoders = [(local.BestIncomingDecoder(), [0, 2, 3]),
+                    (local.AsManyDecoder(), [0, 1, 2, 3]),
+                    (baseline.LocalBaseline(0.3), [0, 1, 2]),
+                    (baseline.LastBaseline(), [0, 1, 5])]
+        for decoder, expected in decoders:
+            prediction = decoder.decode(self.dpack).graph.prediction
+            self.assertEqual(np.flatnonzero(prediction != 1).tolist(),
+                             expected)
+
+    def test_stacked(self):
+        'decoding stacked documents is the same as one at a time'
+        dpacks = self._stacked()
+        stacked = DataPack.vstack(dpacks)
+        for decoder in [local.BestIncomingDecoder(),
+                        local.AsManyDecoder(),
+                        baseline.LocalBaseline(0.3),
+                        baseline.LastBaseline()]:
+            expected = np.concatenate([decoder.decode(d).graph.prediction
+                                       for d in dpacks])
+            self.assertEqual(decoder.decode(stacked).graph.prediction.tolist(),
+                             expected.tolist())
+
+    def test_as_many_fake_root(self):
+        'the fake root does not count as an EDU to attach'
+        root = lambda e: FAKE_ROOT if e is self.edus[0] else e
+        dpacks = []
+        for attach in [self.graph.attach, self.graph.attach[::-1]]:
+            dpack = DataPack(labels=self.dpack.labels,
+                             edus=self.edus[1:],
+                             pairings=[(root(e1), root(e2))
+                                       for e1, e2 in self.pairings],
+                             data=self.dpack.data,
+                             target=self.dpack.target,
+                             graph=self.graph._replace(attach=attach),
+                             vocab=None)
+            if dpacks:
+                # same document under different EDU ids
+                edus = {e.id: EDU('y' + e.id, e.text, e.start, e.end,
+                                  'y', e.subgrouping)
+                        for e in self.edus[1:]}
+                dpack = DataPack(labels=dpack.labels,
+                                 edus=[edus[e.id] for e in dpack.edus],
+                                 pairings=[(edus.get(e1.id, e1),
+                                            edus[e2.id])
+                                           for e1, e2 in dpack.pairings],
+                                 data=dpack.data,
+                                 target=dpack.target,
+                                 graph=dpack.graph,
+                                 vocab=None)
+            dpacks.append(dpack)
+        decoder = local.AsManyDecoder()
+        prediction = decoder.decode(dpacks[0]).graph.prediction
+        self.assertEqual(np.flatnonzero(prediction != 1).tolist(),
+                         [0, 1, 2])
+        expected = np.concatenate([decoder.decode(d).graph.prediction
+                                   for d in dpacks])
+        stacked = decoder.decode(DataPack.vstack(dpacks)).graph.prediction
+        self.assertEqual(stacked.tolist(), expected.tolist())
+        self.assertEqual(np.count_nonzero(stacked != 1), 6)
+
 
 class MstTest(DecoderTest):
     """ Tests for MST and MSDAG decoders """
@@ -152,6 +305,32 @@ class MstTest(DecoderTest):
         # Is it a tree ? (One edge less than number of vertices)
         self.assertEqual(len(edges), len(self.edus) - 1)
 
+    def test_chu_liu_edmonds(self):
+        'MST with a cycle to contract'
+        no_edge = mst.NO_EDGE
+        # best incoming edges for 1 and 2 form a cycle; the best
+        # way to break it is to enter it at 1 from the root
+        scores = np.array([[no_edge, 5, 4, 1],
+                           [no_edge, no_edge, 10, 2],
+                           [no_edge, 9, no_edge, 3],
+                           [no_edge, 1, 1, no_edge]])
+        heads = mst.chu_liu_edmonds(scores)
+        self.assertEqual(heads.tolist(), [-1, 0, 1, 2])
+
+    def test_msdag_reachability(self):
+        'MSDAG keeps every edge that does not close a cycle'
+        no_edge = mst.NO_EDGE
+        scores = np.array([[no_edge, 5, 4, 1],
+                           [no_edge, no_edge, 10, 2],
+                           [no_edge, 9, no_edge, 3],
+                           [no_edge, 1, 1, no_edge]])
+        chosen = mst.msdag(scores)
+        # MST (0->1->2->3) plus 0->2, 0->3 and 1->3; the edges
+        # back into 1 and 2 would all close cycles
+        self.assertEqual(np.argwhere(chosen).tolist(),
+                         [[0, 1], [0, 2], [0, 3],
+                          [1, 2], [1, 3], [2, 3]])
+
     def test_msdag(self):
         'check MSDAG decoder'
         decoder = mst.MsdagDecoder(mst.MstRootStrategy.fake_root)
@@ -4,7 +4,7 @@ Utility classes functions shared by decoders
 
 import numpy as np
 
-from attelo.table import (Graph, UNRELATED)
+from attelo.table import (Graph, Pairings, UNRELATED)
 
 
 class DecoderException(Exception):
@@ -45,9 +45,170 @@ def get_prob_map(instances):
             for e1, e2, prob, rel in instances}
 
 
+def edu_pairing_indices(dpack):
+    """
+    Number the EDUs used in the pairings of a datapack from 0 to
+    n-1 (in the order of their table rows), so that pairings can
+    be represented by a pair of EDU numbers, for example as cells
+    in an n by n matrix
+
+    Returns
+    -------
+    pairings: Pairings
+        columnar version of the datapack pairings
+
+    rows: array(int)
+        table row for each EDU number
+
+    src_idx: array(int)
+        EDU number of the source of each pairing
+
+    tgt_idx: array(int)
+        EDU number of the target of each pairing
+    """
+    pairings = Pairings.from_list(dpack.pairings)
+    rows, src_idx, tgt_idx = pairings.edu_numbers()
+    return pairings, rows, src_idx, tgt_idx
+
+
+def document_edu_indices(dpack):
+    """
+    Like :py:func:`edu_pairing_indices`, but for datapacks that may
+    be stacked from several documents (groupings): EDUs are numbered
+    separately for each document a pairing belongs to (the grouping
+    of its target), so that EDUs which appear in several documents
+    (ie. the fake root) are counted once for each. EDUs are numbered
+    by document, and then in order of their table rows.
+
+    Returns
+    -------
+    pairings: Pairings
+        columnar version of the datapack pairings
+
+    rows: array(int)
+        table row for each EDU number
+
+    docs: array(int)
+        document (grouping code, see
+        :py:attr:`attelo.table.EduTable.grouping`) for each EDU
+        number
+
+    src_idx: array(int)
+        EDU number of the source of each pairing
+
+    tgt_idx: array(int)
+        EDU number of the target of each pairing
+    """
+    pairings = Pairings.from_list(dpack.pairings)
+    table = pairings.table
+    num_rows = len(table)
+    # (grouping codes start at -1 for None)
+    pair_docs = table.grouping[pairings.targets] + 1
+    keys, inverse = np.unique(np.concatenate([
+        pair_docs * num_rows + pairings.sources,
+        pair_docs * num_rows + pairings.targets]), return_inverse=True)
+    return (pairings, keys % num_rows, keys // num_rows - 1,
+            inverse[:len(pairings)], inverse[len(pairings):])
+
+
+def prediction_from_mask(dpack, chosen):
+    """Populate a datapack prediction array, giving each pairing
+    we select its best label
+
+    Parameters
+    ----------
+    chosen: array(bool)
+        True for each pairing that we predict to be attached
+
+    Returns
+    -------
+    dpack: DataPack
+        A copy of the original DataPack with predictions
+        set
+    """
+    best_lbls = np.ravel(np.argmax(dpack.graph.label, axis=1))
+    prediction = np.where(chosen, best_lbls, dpack.label_number(UNRELATED))
+    graph = Graph(prediction=prediction.astype(np.int16),
+                  attach=dpack.graph.attach,
+                  label=dpack.graph.label)
+    return dpack.set_graph(graph)
+
+
+def prediction_from_links(dpack, src_idx, tgt_idx, lbl_idx):
+    """Populate a datapack prediction array from arrays of
+    predicted links between EDU numbers (see
+    :py:func:`edu_pairing_indices`). Pairings which are not
+    predicted are marked as unrelated; links which do not
+    correspond to any pairing are ignored
+
+    Parameters
+    ----------
+    src_idx: array(int)
+        EDU number of the source of each link
+
+    tgt_idx: array(int)
+        EDU number of the target of each link
+
+    lbl_idx: array(int)
+        label number for each link
+
+    Returns
+    -------
+    dpack: DataPack
+        A copy of the original DataPack with predictions
+        set
+    """
+    _, rows, pair_src, pair_tgt = edu_pairing_indices(dpack)
+    num_edus = len(rows)
+    pair_keys = pair_src * num_edus + pair_tgt
+    prediction = np.empty(len(pair_keys), dtype=np.dtype(np.int16))
+    prediction.fill(dpack.label_number(UNRELATED))
+    if len(src_idx):
+        link_keys = (np.asarray(src_idx, dtype=np.int64) * num_edus +
+                     np.asarray(tgt_idx, dtype=np.int64))
+        # (stable sort: a repeated link takes its last label)
+        order = np.argsort(link_keys, kind='mergesort')[::-1]
+        link_keys, first = np.unique(link_keys[order], return_index=True)
+        link_lbls = np.asarray(lbl_idx)[order][first]
+        pos = np.minimum(np.searchsorted(link_keys, pair_keys),
+                         len(link_keys) - 1)
+        found = link_keys[pos] == pair_keys
+        prediction[found] = link_lbls[pos[found]]
+    graph = Graph(prediction=prediction,
+                  attach=dpack.graph.attach,
+                  label=dpack.graph.label)
+    return dpack.set_graph(graph)
+
+
+def prediction_to_links(dpack):
+    """
+    The predicted links (omitting unrelated pairings) in a
+    weighted datapack, as arrays (see
+    :py:func:`prediction_from_links`)
+
+    Returns
+    -------
+    src_idx: array(int)
+        EDU number of the source of each link
+
+    tgt_idx: array(int)
+        EDU number of the target of each link
+
+    lbl_idx: array(int)
+        label number for each link
+    """
+    if dpack.graph is None:
+        raise ValueError("Not a weighted datapack")
+    _, _, src_idx, tgt_idx = edu_pairing_indices(dpack)
+    prediction = np.asarray(dpack.graph.prediction, dtype=np.int64)
+    linked = prediction != dpack.label_number(UNRELATED)
+    return src_idx[linked], tgt_idx[linked], prediction[linked]
+
+
 def convert_prediction(dpack, triples):
     """Populate a datapack prediction array from a list
-    of triples
+    of triples (see :py:func:`prediction_from_links` for
+    the array equivalent)
 
     Parameters
     ----------
@@ -61,22 +222,68 @@ def convert_prediction(dpack, triples):
         A copy of the original DataPack with predictions
         set
     """
-    link_map = {(id1, id2): lab for id1, id2, lab in triples}
+    pairings, rows, _, _ = edu_pairing_indices(dpack)
+    edus = pairings.table.edus
+    edu_nums = {edus[r].id: i for i, r in enumerate(rows.tolist())}
+    triples = [(edu_nums[id1], edu_nums[id2], lab)
+               for id1, id2, lab in triples
+               if id1 in edu_nums and id2 in edu_nums]
+    return prediction_from_links(
+        dpack,
+        np.fromiter((x[0] for x in triples), dtype=np.int64),
+        np.fromiter((x[1] for x in triples), dtype=np.int64),
+        dpack.label_numbers(x[2] for x in triples))
 
-    def get_lbl(pair):
-        'from edu pair to label number'
-        edu1, edu2 = pair
-        key = edu1.id, edu2.id
-        lbl = link_map.get(key, UNRELATED)
-        return dpack.label_number(lbl)
-    prediction = np.fromiter((get_lbl(pair) for pair in dpack.pairings),
-                             dtype=np.dtype(np.int16))
-    graph = Graph(prediction=prediction,
+
+def prediction_from_edges(dpack, chosen, src_idx, tgt_idx):
+    """Populate a datapack prediction array from a matrix of
+    selected edges between EDU numbers (see
+    :py:func:`edu_pairing_indices`), giving each selected pairing
+    its best label
+
+    Parameters
+    ----------
+    chosen: 2D array(bool)
+        `chosen[i, j]` is True if we predict an edge from EDU
+        number `i` to EDU number `j`
+
+    src_idx: array(int)
+        EDU number of the source of each pairing
+
+    tgt_idx: array(int)
+        EDU number of the target of each pairing
+
+    Returns
+    -------
+    dpack: DataPack
+        A copy of the original DataPack with predictions
+        set
+    """
+    best_lbls = np.ravel(np.argmax(dpack.graph.label, axis=1))
+    # a repeated pairing takes the label of its last occurrence
+    lbl_matrix = np.zeros(chosen.shape, dtype=best_lbls.dtype)
+    lbl_matrix[src_idx, tgt_idx] = best_lbls
+    prediction = np.where(chosen[src_idx, tgt_idx],
+                          lbl_matrix[src_idx, tgt_idx],
+                          dpack.label_number(UNRELATED))
+    graph = Graph(prediction=prediction.astype(np.int16),
                   attach=dpack.graph.attach,
                   label=dpack.graph.label)
     return dpack.set_graph(graph)
 
 
+def first_in_groups(groups, scores):
+    """For each distinct value in `groups`, the index of the item
+    with the highest score (the first one in case of ties)
+
+    :rtype: array(int)
+    """
+    order = np.lexsort((np.arange(len(groups)), -scores, groups))
+    is_first = np.ones(len(order), dtype=np.bool_)
+    is_first[1:] = groups[order][1:] != groups[order][:-1]
+    return order[is_first]
+
+
 def simple_candidates(dpack):
     '''
     Translate the links into a list of (EDU, EDU, float, string)
@@ -102,11 +309,16 @@ def prediction_to_triples(dpack):
 
         List of EDU id, EDU id, label triples
         omitting the unrelated triples
+        (see :py:func:`prediction_to_links` for the array
+        equivalent)
     """
     if dpack.graph is None:
         raise ValueError("Not a weighted datapack")
-    unrelated = dpack.label_number(UNRELATED)
-    return [(edu1.id, edu2.id, dpack.get_label(lbl))
-            for (edu1, edu2), lbl in
-            zip(dpack.pairings, dpack.graph.prediction)
-            if lbl != unrelated]
+    pairings = Pairings.from_list(dpack.pairings)
+    prediction = np.asarray(dpack.graph.prediction, dtype=np.int64)
+    linked = np.flatnonzero(prediction != dpack.label_number(UNRELATED))
+    edus = pairings.table.edus
+    return [(edus[r1].id, edus[r2].id, dpack.get_label(lbl))
+            for r1, r2, lbl in zip(pairings.sources[linked].tolist(),
+                                   pairings.targets[linked].tolist(),
+                                   prediction[linked].tolist())]
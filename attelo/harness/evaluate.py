@@ -14,18 +14,26 @@ just implement variants on these functions instead.
 from __future__ import print_function
 from os import path as fp
 import glob
+import itertools
 import os
 import sys
 
+from joblib import cpu_count
+
+from attelo.fold import (select_testing)
 from attelo.io import (load_multipack,
                        load_fold_dict)
 from attelo.harness.util import (call, force_symlink, timestamp)
 
 from .config import (ClusterStage, DataConfig)
-from .parse import (decode_on_the_fly,
-                    delayed_decode,
-                    learn,
-                    post_decode)
+from .parse import (decode,
+                    decode_chunk,
+                    fitted_parser,
+                    group_by_learner,
+                    learn_shared,
+                    post_decode,
+                    _say_if_decoded)
+from .schedule import (Job, Result, run_jobs)
 from .report import (mk_fold_report,
                      mk_global_report,
                      mk_test_report)
@@ -178,19 +186,161 @@ def prepare_dirs(runcfg, data_dir):
 
 def do_fold(hconf, dconf, fold):
     """
-    Run all learner/decoder combos within this fold
+    Run all learner/decoder combos within this fold, one job at
+    a time in this process (see :py:func:`do_folds`)
+    """
+    do_folds(hconf, dconf, [fold], n_jobs=1)
+
+
+# state inherited by the worker processes of :py:func:`do_folds`
+# (so that we don't have to send them the data for every job)
+_EVALUATION = {}
+
+# (worker) the fold and fitted parser that each evaluation config
+# was last decoded with in this process
+_FITTED = {}
+
+
+def _learn_job(fold, eidxes):
+    """
+    (worker) fit the parsers for a group of evaluation configs
+    sharing the same learners (given by their indices) on the
+    training data for this fold, saving their models in the cache
+
+    :rtype: dict(string, object) (the fitted learner models)
+    """
+    hconf = _EVALUATION['hconf']
+    econfs = [hconf.evaluations[i] for i in eidxes]
+    return learn_shared(hconf, econfs, _EVALUATION['dconf'], fold)
+
+
+def _decode_job(fold, eidx, models, groupings):
+    """
+    (worker) decode some of the test documents for a fold with
+    the parser for the `eidx`-th evaluation config, given the
+    learner models fitted for it
+
+    We only send the learner models along with the jobs (not the
+    parsers), and each process builds the parser from them the
+    first time it needs it
+    """
+    hconf = _EVALUATION['hconf']
+    dconf = _EVALUATION['dconf']
+    if _FITTED.get(eidx, (None, None))[0] != fold:
+        econf = hconf.evaluations[eidx]
+        _FITTED[eidx] = (fold, fitted_parser(hconf, econf, dconf, fold,
+                                             models))
+    return decode_chunk(_FITTED[eidx][1], dconf.pack, groupings)
+
+
+def _reassemble_job(hconf, dconf, econf, fold, *chunks):
+    """
+    write the decoded test documents out for this config and fold
+    """
+    predictions = dict(itertools.chain.from_iterable(chunks))
+    post_decode(hconf, dconf, econf, fold, predictions)
+
+
+def _report_job(hconf, dconf, fold, *_):
+    """
+    report on a fold once all of its configs are decoded
+
+    (we are still running the other jobs in the pool, so the
+    report is scored in this process)
+    """
+    mk_fold_report(hconf, dconf, fold, n_jobs=1)
+
+
+def _shares_models(hconf, econf1, econf2, fold):
     """
-    fold_dir = hconf.fold_dir_path(fold)
-    print(_fold_banner(hconf, fold), file=sys.stderr)
-    if not fp.exists(fold_dir):
-        os.makedirs(fold_dir)
+    True if the two configs would write the same model files
+    (despite having different learner fingerprints)
+    """
+    paths1 = hconf.model_paths(econf1.learner, fold)
+    paths2 = hconf.model_paths(econf2.learner, fold)
+    return bool(set(paths1.values()) & set(paths2.values()))
+
 
-    # learn/decode for all models
-    decoder_jobs = decode_on_the_fly(hconf, dconf, fold)
-    hconf.parallel(decoder_jobs)
-    for econf in hconf.evaluations:
-        post_decode(hconf, dconf, econf, fold)
-    mk_fold_report(hconf, dconf, fold)
+def fold_jobs(hconf, dconf, fold, num_chunks=1):
+    """
+    Learning, decoding, reassembly and report jobs (see
+    :py:func:`attelo.harness.schedule.run_jobs`) for all
+    learner/decoder combos within this fold
+
+    Each distinct learner (see
+    :py:func:`attelo.harness.parse.learner_fingerprint`) is fitted
+    by a single job, whose fitted models are handed to all the
+    combos that use it. Decoding for each combo is split into
+    `num_chunks` jobs which can start as soon as its learner is
+    fitted (each worker builds the parser from the models once).
+    Learners that write to the same model files are run one
+    after the other (the later ones pick the models up from
+    the cache)
+
+    :rtype: [Job]
+    """
+    testing = sorted(select_testing(dconf.pack, dconf.folds, fold))
+    num_chunks = max(1, min(num_chunks, len(testing)))
+    chunks = [testing[i::num_chunks] for i in range(num_chunks)]
+    jobs = []
+    reassembly_keys = []
+    learn_keys = []
+    econfs = [e for e in hconf.evaluations
+              if not _say_if_decoded(hconf, e, fold, stage='learning')]
+    eidxes = {e.key: i for i, e in enumerate(hconf.evaluations)}
+    for group in group_by_learner(econfs, fold):
+        leader = group[0]
+        learn_key = ('learn', fold, leader.learner.key)
+        deps = [k for k, other in learn_keys
+                if _shares_models(hconf, leader, other, fold)]
+        learn_keys.append((learn_key, leader))
+        jobs.append(Job.mk(learn_key, _learn_job,
+                           (fold, [eidxes[e.key] for e in group]),
+                           deps=deps, priority=1))
+        for econf in group:
+            decode_keys = []
+            for i, chunk in enumerate(chunks):
+                decode_key = ('decode', fold, econf.key, i)
+                decode_keys.append(decode_key)
+                jobs.append(Job.mk(decode_key, _decode_job,
+                                   (fold, eidxes[econf.key],
+                                    Result(learn_key), chunk)))
+            reassembly_key = ('reassemble', fold, econf.key)
+            reassembly_keys.append(reassembly_key)
+            jobs.append(Job.mk(reassembly_key, _reassemble_job,
+                               (hconf, dconf, econf, fold) +
+                               tuple(Result(k) for k in decode_keys),
+                               local=True))
+    jobs.append(Job.mk(('report', fold), _report_job,
+                       (hconf, dconf, fold),
+                       deps=reassembly_keys, local=True))
+    return jobs
+
+
+def do_folds(hconf, dconf, folds, n_jobs=None):
+    """
+    Run all learner/decoder combos within these folds, learning
+    and decoding in parallel (up to `n_jobs` at a time, by default
+    the runtime config's)
+    """
+    if n_jobs is None:
+        n_jobs = hconf.runcfg.n_jobs
+    if n_jobs < 0:
+        n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+    jobs = []
+    for fold in folds:
+        fold_dir = hconf.fold_dir_path(fold)
+        print(_fold_banner(hconf, fold), file=sys.stderr)
+        if not fp.exists(fold_dir):
+            os.makedirs(fold_dir)
+        jobs.extend(fold_jobs(hconf, dconf, fold, num_chunks=n_jobs))
+    _EVALUATION['hconf'] = hconf
+    _EVALUATION['dconf'] = dconf
+    try:
+        run_jobs(jobs, n_jobs=n_jobs)
+    finally:
+        _EVALUATION.clear()
+        _FITTED.clear()
 
 
 def do_global_decode(hconf, dconf):
@@ -199,19 +349,20 @@ def do_global_decode(hconf, dconf):
     """
     econf = hconf.test_evaluation
     if econf is not None:
-        decoder_jobs = delayed_decode(hconf, dconf, econf, None)
-        hconf.parallel(decoder_jobs)
-        post_decode(hconf, dconf, econf, None)
+        predictions = decode(hconf, dconf, econf, None)
+        post_decode(hconf, dconf, econf, None, predictions)
 
 
 def _load_harness_multipack(hconf, test_data=False):
     """
     Load the multipack for our current configuration.
 
-    Load the stripped features file if we don't actually need to
-    use the features (this would only make sense on the cluster
-    where evaluation is broken up into separate stages that we
-    can fire on different nodes)
+    If we don't actually need to use the features (this would only
+    make sense on the cluster where evaluation is broken up into
+    separate stages that we can fire on different nodes, the start
+    and end stages only needing to make folds and reports), we load
+    the multipack in targets-only mode, from the stripped features
+    file if there is one.
 
     Parameters
     ----------
@@ -221,9 +372,10 @@ def _load_harness_multipack(hconf, test_data=False):
     -------
     mpack: Multipack
     """
+    targets_only = hconf.runcfg.stage in [ClusterStage.end,
+                                          ClusterStage.start]
     stripped_paths = hconf.mpack_paths(test_data, stripped=True)
-    if (hconf.runcfg.stage in [ClusterStage.end, ClusterStage.start] and
-            fp.exists(stripped_paths[2])):
+    if targets_only and fp.exists(stripped_paths[2]):
         paths = stripped_paths
     else:
         paths = hconf.mpack_paths(test_data, stripped=False)
@@ -231,7 +383,9 @@ def _load_harness_multipack(hconf, test_data=False):
                           paths[1],
                           paths[2],
                           paths[3],
-                          verbose=True)
+                          verbose=True,
+                          cache_dir=hconf.mpack_cache_dir_path(),
+                          targets_only=targets_only)
 
 
 def _init_corpus(hconf):
@@ -278,12 +432,11 @@ def evaluate_corpus(hconf):
     if hconf.runcfg.stage in [None, ClusterStage.main]:
         foldset = hconf.runcfg.folds if hconf.runcfg.folds is not None\
             else frozenset(dconf.folds.values())
-        for fold in foldset:
-            do_fold(hconf, dconf, fold)
+        do_folds(hconf, dconf, sorted(foldset))
 
     if hconf.runcfg.stage in [None, ClusterStage.combined_models]:
-        for econf in hconf.evaluations:
-            learn(hconf, econf, dconf, None)
+        for econfs in group_by_learner(hconf.evaluations, None):
+            learn_shared(hconf, econfs, dconf, None)
         if hconf.test_evaluation is not None:
             test_pack = _load_harness_multipack(hconf, test_data=True)
             test_dconf = DataConfig(pack=test_pack, folds=None)
@@ -235,6 +235,19 @@ class Harness(with_metaclass(ABCMeta, object)):
             raise HarnessException('Harness not yet loaded')
         return fp.join(self.scratch_dir, 'combined')
 
+    def mpack_cache_dir_path(self):
+        """Return path to directory where compiled versions of the
+        input multipacks are kept, so that we only parse the inputs
+        once (see :py:func:`attelo.io.load_multipack`)
+
+        Returns
+        -------
+        filepath
+        """
+        if not self._loaded:
+            raise HarnessException('Harness not yet loaded')
+        return fp.join(self.scratch_dir, 'mpack-cache')
+
     @staticmethod
     def _fold_dir_basename(fold):
         "Relative directory for working within a given fold"
@@ -4,13 +4,16 @@ Control over attelo parsers as might be needed for a test harness
 
 from __future__ import print_function
 from os import path as fp
+import copy
+import multiprocessing
 import os
 import sys
 
-from joblib import (delayed)
+from joblib import (cpu_count, delayed)
+import numpy as np
 
-from ..io import (write_predictions_output)
-from attelo.decoding.util import (prediction_to_triples)
+from ..io import (write_document_predictions,
+                  write_prediction_labels)
 from attelo.fold import (select_training,
                          select_testing)
 from attelo.harness.util import (makedirs)
@@ -42,9 +45,15 @@ def concatenate_outputs(mpack, output_path):
 
     Concatenate temporary per-group outputs into a single
     combined output
+
+    Parameters
+    ----------
+    mpack: Multipack or iterable(string)
+        the groupings to collect (only the keys are used if
+        this is a multipack)
     """
     tmpfiles = [_tmp_output_filename(output_path, d)
-                for d in sorted(mpack.keys())]
+                for d in sorted(mpack)]
     with open(output_path, 'wb') as file_out:
         for tfile in tmpfiles:
             with open(tfile, 'rb') as file_in:
@@ -63,30 +72,176 @@ def _parse_group(dpack, parser, output_path):
     '''
     dpack = parser.transform(dpack)
     # we trust the parser to select what it thinks is its best prediction
-    prediction = prediction_to_triples(dpack)
-    write_predictions_output(dpack, prediction, output_path)
+    write_prediction_labels(dpack, dpack.graph.prediction, output_path)
 
 
 def jobs(mpack, parser, output_path):
     """
-    Return a list of delayed decoding jobs for the various
-    documents in this group
+    Return delayed decoding jobs for the various documents in
+    this group
+
+    The jobs are generated lazily, so if `mpack` is a stream of
+    `(grouping, DataPack)` pairs (see
+    :py:func:`attelo.io.iter_multipack`) rather than a multipack,
+    we only need to hold the documents that are actually being
+    decoded in memory
+
+    Each job writes its output to a temporary file, to be
+    collected with :py:func:`concatenate_outputs`; see
+    :py:func:`decode` for decoding without temporary files
+
+    Parameters
+    ----------
+    mpack: Multipack or iterable((string, DataPack))
+
+    :rtype iterator(delayed)
     """
-    res = []
-    tmpfiles = [_tmp_output_filename(output_path, d)
-                for d in mpack.keys()]
-    for tmpfile in tmpfiles:
-        if fp.exists(tmpfile):
-            os.remove(tmpfile)
-    for onedoc, dpack in mpack.items():
+    items = mpack.items() if isinstance(mpack, dict) else mpack
+    for onedoc, dpack in items:
         tmp_output_path = _tmp_output_filename(output_path, onedoc)
-        res.append(delayed(_parse_group)(dpack, parser, tmp_output_path))
-    return res
+        if fp.exists(tmp_output_path):
+            os.remove(tmp_output_path)
+        yield delayed(_parse_group)(dpack, parser, tmp_output_path)
 
 
-def learn(hconf, econf, dconf, fold):
+# the parser (and documents) that decoding worker processes work
+# with; they inherit these when the pool is forked, so the fitted
+# parser is never pickled and is "loaded" once per worker
+_DECODING = {}
+
+
+def _decode_one(item):
     """
-    Run the learners for the given configuration
+    (worker) decode a single document, given either as a key into
+    the shared multipack or as a `(grouping, DataPack)` pair
+
+    :rtype: (string, array(int))
+    """
+    if isinstance(item, tuple):
+        onedoc, dpack = item
+    else:
+        onedoc, dpack = item, _DECODING['mpack'][item]
+    dpack = _DECODING['parser'].transform(dpack)
+    # we trust the parser to select what it thinks is its best prediction
+    return onedoc, np.asarray(dpack.graph.prediction, dtype=np.int16)
+
+
+def decode_chunk(parser, mpack, groupings):
+    """
+    Decode some of the documents in a multipack with a fitted
+    parser (in this process)
+
+    :rtype: [(string, array(int))]
+    """
+    results = []
+    for onedoc in groupings:
+        dpack = parser.transform(mpack[onedoc])
+        results.append((onedoc,
+                        np.asarray(dpack.graph.prediction, dtype=np.int16)))
+    return results
+
+
+def decode_documents(parser, mpack, n_jobs=-1, chunksize=None):
+    """
+    Decode documents with a fitted parser, in a pool of worker
+    processes that each inherit the parser (and the multipack,
+    if it is one) when they are forked. Workers are sent
+    documents (or just their grouping names if they already have
+    the multipack) in chunks, and only send back the predictions
+
+    Parameters
+    ----------
+    mpack: Multipack or iterable((string, DataPack))
+        documents to decode (if this is a stream, see
+        :py:func:`attelo.io.iter_multipack`, the documents are
+        read as the workers need them)
+
+    n_jobs: int
+        number of worker processes (-1 for as many as CPUs, -2
+        for one fewer, etc; 0 or 1 to decode in this process)
+
+    chunksize: int or None
+        number of documents to send to a worker at a time
+        (default: enough to give each worker around 4 chunks)
+
+    Returns
+    -------
+    predictions: iterator((string, array(int)))
+        grouping and prediction array (label number for each
+        pairing) for each document, in the order they are given
+    """
+    if isinstance(mpack, dict):
+        items = list(mpack)
+        num_items = len(items)
+    else:
+        items = mpack
+        num_items = None
+    if n_jobs < 0:
+        n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+    if num_items is not None:
+        n_jobs = min(n_jobs, num_items)
+    if chunksize is None:
+        chunksize = max(1, (num_items or 0) // (4 * max(n_jobs, 1)))
+
+    _DECODING['parser'] = parser
+    _DECODING['mpack'] = mpack if num_items is not None else None
+    try:
+        if n_jobs <= 1:
+            for item in items:
+                yield _decode_one(item)
+        else:
+            pool = multiprocessing.Pool(n_jobs)
+            try:
+                for result in pool.imap(_decode_one, items, chunksize):
+                    yield result
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+    finally:
+        _DECODING.clear()
+
+
+def learner_fingerprint(econf, fold):
+    """
+    What the models learned for this config on the training data
+    for this fold depend on: evaluation configs with the same
+    fingerprint (eg. the same learners with different decoders)
+    can share the same fitted models
+    """
+    return (econf.learner.key, fold)
+
+
+def group_by_learner(econfs, fold):
+    """
+    Group evaluation configs that share the same learner
+    fingerprint (in order of first appearance)
+
+    :rtype: [[EvaluationConfig]]
+    """
+    groups = {}
+    order = []
+    for econf in econfs:
+        fingerprint = learner_fingerprint(econf, fold)
+        if fingerprint not in groups:
+            groups[fingerprint] = []
+            order.append(fingerprint)
+        groups[fingerprint].append(econf)
+    return [groups[f] for f in order]
+
+
+def learn_shared(hconf, econfs, dconf, fold):
+    """
+    Run the learners for a group of configurations sharing the
+    same learner fingerprint (see :py:func:`group_by_learner`):
+    the first parser learns the models (saving them in the model
+    cache), and the rest are handed its fitted models directly
+    (see :py:meth:`attelo.parser.Parser.fitted_models`)
+
+    :rtype: dict(string, object) (the fitted models, keyed as in
+            the model cache)
     """
     if fold is None:
         subpacks = dconf.pack
@@ -97,11 +252,62 @@ def learn(hconf, econf, dconf, fold):
 
     if not os.path.exists(parent_dir):
         os.makedirs(parent_dir)
-    cache = hconf.model_paths(econf.learner, fold)
-    print('learning ', econf.key, '...', file=sys.stderr)
     dpacks = subpacks.values()
     targets = [d.target for d in dpacks]
-    econf.parser.payload.fit(dpacks, targets, cache=cache)
+    leader = econfs[0]
+    print('learning ', leader.key, '...', file=sys.stderr)
+    cache = hconf.model_paths(leader.learner, fold)
+    leader.parser.payload.fit(dpacks, targets, cache=cache)
+    models = leader.parser.payload.fitted_models()
+    for econf in econfs[1:]:
+        print('reusing models from', leader.key, 'for', econf.key,
+              file=sys.stderr)
+        econf.parser.payload.fit(dpacks, targets,
+                                 cache=_with_models(cache, models))
+    return models
+
+
+def learn(hconf, econf, dconf, fold):
+    """
+    Run the learners for the given configuration
+    """
+    learn_shared(hconf, [econf], dconf, fold)
+
+
+def _with_models(cache, models):
+    """
+    Parser cache in which the given fitted models take the place
+    of the corresponding model files
+    """
+    cache = dict(cache or {})
+    cache.update(models)
+    return cache
+
+
+def fitted_parser(hconf, econf, dconf, fold, models):
+    """
+    Fresh copy of the parser for the given configuration, given
+    the fitted models that :py:func:`learn_shared` returned for
+    its learner
+
+    This is for processes (eg. decoding workers) that did not do
+    the learning themselves: they just use the models rather than
+    learning anything. The copy means that refitting the original
+    parser (eg. for another fold) does not affect it.
+
+    :rtype: Parser
+    """
+    if fold is None:
+        subpacks = dconf.pack
+    else:
+        subpacks = select_training(dconf.pack, dconf.folds, fold)
+    dpacks = subpacks.values()
+    targets = [d.target for d in dpacks]
+    parser = copy.deepcopy(econf.parser.payload)
+    parser.fit(dpacks, targets,
+               cache=_with_models(hconf.model_paths(econf.learner, fold),
+                                  models))
+    return parser
 
 
 def delayed_decode(hconf, dconf, econf, fold):
@@ -126,6 +332,28 @@ def delayed_decode(hconf, dconf, econf, fold):
     return jobs(subpack, parser, output_path)
 
 
+def decode(hconf, dconf, econf, fold):
+    """
+    Decode the test documents for this model/decoder combo for the
+    given fold (see :py:func:`decode_documents`)
+
+    :rtype: dict(string, array(int)) or None (if already decoded)
+    """
+    if fold is None and hconf.test_evaluation is None:
+        return None
+    if _say_if_decoded(hconf, econf, fold, stage='decoding'):
+        return None
+
+    if fold is None:
+        subpack = dconf.pack
+    else:
+        subpack = select_testing(dconf.pack, dconf.folds, fold)
+
+    parser = econf.parser.payload
+    return dict(decode_documents(parser, subpack,
+                                 n_jobs=hconf.runcfg.n_jobs))
+
+
 def decode_on_the_fly(hconf, dconf, fold):
     """
     Learn each parser, returning decoder jobs as each is learned.
@@ -153,9 +381,16 @@ def _say_if_decoded(hconf, econf, fold, stage='decoding'):
         return False
 
 
-def post_decode(hconf, dconf, econf, fold):
+def post_decode(hconf, dconf, econf, fold, predictions=None):
     """
     Join together output files from this model/decoder combo
+
+    Parameters
+    ----------
+    predictions: dict(string, array(int)) or None
+        predictions for each document (see :py:func:`decode`);
+        if None, we collect the temporary per-document output
+        files written by :py:func:`delayed_decode` jobs
     """
     if _say_if_decoded(hconf, econf, fold, stage='reassembly'):
         return
@@ -165,5 +400,11 @@ def post_decode(hconf, dconf, econf, fold):
         subpack = dconf.pack
     else:
         subpack = select_testing(dconf.pack, dconf.folds, fold)
-    concatenate_outputs(subpack,
-                        hconf.decode_output_path(econf, fold))
+    output_path = hconf.decode_output_path(econf, fold)
+    if predictions is None:
+        concatenate_outputs(subpack, output_path)
+        return
+    makedirs(fp.dirname(output_path))
+    write_document_predictions(((subpack[d], predictions[d])
+                                for d in sorted(subpack)),
+                               output_path)
@@ -16,6 +16,8 @@ import itertools as itr
 import shutil
 import sys
 
+import numpy as np
+
 from attelo.io import (load_model,
                        load_predictions)
 from attelo.fold import (select_testing)
@@ -27,14 +29,11 @@ from attelo.report import (EdgeReport,
                            CombinedReport,
                            show_confusion_matrix,
                            show_discriminating_features)
-from attelo.score import (empty_confusion_matrix,
-                          build_confusion_matrix,
+from attelo.score import (align_predictions,
                           discriminating_features,
-                          score_edges,
-                          score_edges_by_label,
-                          score_edus,
-                          select_in_pack)
+                          score_predictions)
 from attelo.table import (DataPack,
+                          FeaturePlaceholder,
                           idxes_fakeroot,
                           idxes_inter,
                           idxes_intra)
@@ -42,6 +41,7 @@ from attelo.util import (Team)
 
 from .util import makedirs
 from .graph import (mk_graphs, mk_test_graphs)
+from .schedule import (Job, Result, run_jobs)
 
 
 class ReportPack(namedtuple('ReportPack',
@@ -188,9 +188,66 @@ class Slice(namedtuple('Slice',
     pass
 
 
-# pylint: disable=too-many-locals
-# it's a bit hard to write this sort score accumulation code
-# local help
+class _FileSlice(namedtuple('_FileSlice',
+                            ['fold',
+                             'configuration',
+                             'predictions_path',
+                             'enable_details'])):
+    """
+    Like a :py:class:`Slice`, but pointing to the predictions file
+    rather than holding its contents (the harness reports read and
+    score each file in its own job)
+    """
+    pass
+
+
+def _report_pack(results, labels, num_edges):
+    """
+    Combine per-slice scores into a report
+
+    Parameters
+    ----------
+    results: iterable((configuration, Scores, bool))
+        scores for each slice (and whether details are enabled),
+        in the order they should be accumulated
+
+    labels: [string]
+        labels for the confusion matrices
+
+    num_edges: int
+    """
+    edge_count = defaultdict(list)
+    edge_lab_count = defaultdict(lambda: defaultdict(list))
+    edu_reports = defaultdict(EduReport)
+    llen = len(labels)
+    confusion = defaultdict(lambda: np.zeros((llen, llen), dtype=np.int32))
+    for key, scores, enable_details in results:
+        edge_count[key].append(scores.edges)
+        edu_reports[key].add(scores.edus)
+        confusion[key] += scores.confusion
+        if enable_details:
+            for label, lab_count in scores.edges_by_label:
+                edge_lab_count[key][label].append(lab_count)
+
+    edge_report = CombinedReport(EdgeReport,
+                                 {k: EdgeReport(v)
+                                  for k, v in edge_count.items()})
+    # combine
+    edge_by_label_report = {}
+    for key, counts in edge_lab_count.items():
+        report = CombinedReport(LabelReport,
+                                {(label,): LabelReport(vs)
+                                 for label, vs in counts.items()})
+        edge_by_label_report[key] = report
+
+    return ReportPack(edge=edge_report,
+                      edge_by_label=edge_by_label_report or None,
+                      edu=CombinedReport(EduReport, edu_reports),
+                      confusion=confusion,
+                      confusion_labels=labels,
+                      num_edges=num_edges)
+
+
 def full_report(mpack, fold_dict, slices,
                 adjust_pack=None):
     """
@@ -212,62 +269,94 @@ def full_report(mpack, fold_dict, slices,
     """
     if not mpack:
         raise ValueError("Can't report with empty multipack")
-    edge_count = defaultdict(list)
-    edge_lab_count = defaultdict(lambda: defaultdict(list))
-    edu_reports = defaultdict(EduReport)
+    adjust_pack = adjust_pack or (lambda x: x)
+    num_edges = {}
+    packs = {}
+
+    def score_slices():
+        'scores for each slice (predictions outside the pack are ignored)'
+        for slc in slices:
+            if slc.fold not in packs:
+                f_mpack = mpack if slc.fold is None else\
+                    select_testing(mpack, fold_dict, slc.fold)
+                packs.clear()
+                packs[slc.fold] = DataPack.vstack([adjust_pack(x) for x in
+                                                   f_mpack.values()])
+                num_edges[slc.fold] = len(packs[slc.fold])
+            scores = score_predictions(packs[slc.fold], slc.predictions,
+                                       by_label=slc.enable_details)
+            yield slc.configuration, scores, slc.enable_details
+
     dpack0 = mpack.values()[0]
-    confusion = defaultdict(lambda: empty_confusion_matrix(dpack0))
+    results = list(score_slices())
+    return _report_pack(results, dpack0.labels, sum(num_edges.values()))
 
-    fold = None
-    is_first_slice = True
 
-    # avoid slicing the predictions if we can help it (slow)
-    adjust_pack = adjust_pack or (lambda x: x)
-    adjust_predictions = select_in_pack if adjust_pack else (lambda _, x: x)
+# the report partitions (besides the whole datapack), and how to pick
+# them out of a single document
+_PARTITIONS = [('intra', idxes_intra),
+               ('inter', idxes_inter),
+               ('froot', idxes_fakeroot)]
 
-    num_edges = {}
-    for slc in slices:
-        if is_first_slice and slc.fold is None:
-            fpack = DataPack.vstack([adjust_pack(x)
-                                     for x in mpack.values()])
-            is_first_slice = False
-            num_edges[None] = len(fpack)
-        elif is_first_slice or slc.fold != fold:
-            f_mpack = select_testing(mpack, fold_dict, slc.fold)
-            fpack = DataPack.vstack([adjust_pack(x)
-                                     for x in f_mpack.values()])
-            fold = slc.fold
-            num_edges[fold] = len(fpack)
-            is_first_slice = False
-        key = slc.configuration
-        # accumulate scores
-        predictions = adjust_predictions(fpack, slc.predictions)
-        edge_count[key].append(score_edges(fpack, predictions))
-        edu_reports[key].add(score_edus(fpack, predictions))
-        confusion[key] += build_confusion_matrix(fpack, predictions)
-        if slc.enable_details:
-            details = score_edges_by_label(fpack, predictions)
-            for label, lab_count in details:
-                edge_lab_count[key][label].append(lab_count)
 
-    edge_report = CombinedReport(EdgeReport,
-                                 {k: EdgeReport(v)
-                                  for k, v in edge_count.items()})
-    # combine
-    edge_by_label_report = {}
-    for key, counts in edge_lab_count.items():
-        report = CombinedReport(LabelReport,
-                                {(label,): LabelReport(vs)
-                                 for label, vs in counts.items()})
-        edge_by_label_report[key] = report
+def _scoring_pack(dpack):
+    """
+    Copy of a datapack with just what we need for scoring
+    (no features or graph)
+    """
+    fields = dpack._asdict()
+    fields['data'] = FeaturePlaceholder(dpack.data.shape)
+    fields['graph'] = None
+    return DataPack(**fields)
 
-    return ReportPack(edge=edge_report,
-                      edge_by_label=edge_by_label_report or None,
-                      edu=CombinedReport(EduReport, edu_reports),
-                      confusion=confusion,
-                      confusion_labels=dpack0.labels,
-                      num_edges=sum(num_edges.values()))
-# pylint: enable=too-many-locals
+
+def _partition_packs(mpack):
+    """
+    Stack the documents of a multipack (in sorted order) into a
+    single datapack for scoring, and pick out each partition of it
+
+    The partition indices are computed once per document
+
+    :rtype: dict(string, (DataPack, array(int) or None))
+    """
+    dpacks = [_scoring_pack(mpack[k]) for k in sorted(mpack)]
+    idxes = {header: [] for header, _ in _PARTITIONS}
+    offset = 0
+    for dpack in dpacks:
+        for header, get_idxes in _PARTITIONS:
+            idxes[header].append(np.asarray(get_idxes(dpack),
+                                            dtype=np.int64) + offset)
+        offset += len(dpack)
+    fpack = DataPack.vstack(dpacks)
+    parts = {'whole': (fpack, None)}
+    for header, _ in _PARTITIONS:
+        p_idxes = np.concatenate(idxes[header]).astype(np.int64)
+        parts[header] = (fpack.selected(p_idxes), p_idxes)
+    return parts
+
+
+# what the report worker processes need (by fold); they inherit it
+# when the pool is forked
+_REPORTING = {}
+
+
+def _align_job(fold, path):
+    """
+    (worker) read a predictions file (once), lining it up with the
+    pairings of the fold
+    """
+    fpack, _ = _REPORTING[fold]['whole']
+    return align_predictions(fpack, load_predictions(path))
+
+
+def _score_job(fold, partition, prediction, enable_details):
+    """
+    (worker) score the predictions for a fold on a partition
+    """
+    dpack, idxes = _REPORTING[fold][partition]
+    if idxes is not None:
+        prediction = prediction[idxes]
+    return score_predictions(dpack, prediction, by_label=enable_details)
 
 
 def _report_key(econf):
@@ -292,16 +381,16 @@ def _report_key(econf):
 def _fold_report_slices(hconf, fold):
     """
     Report slices for a given fold
+
+    :rtype: iterable(_FileSlice)
     """
-    print('Scoring fold {}...'.format(fold),
-          file=sys.stderr)
     dkeys = [econf.key for econf in hconf.detailed_evaluations]
     for econf in hconf.evaluations:
-        p_path = hconf.decode_output_path(econf, fold)
-        yield Slice(fold=fold,
-                    configuration=_report_key(econf),
-                    predictions=load_predictions(p_path),
-                    enable_details=econf.key in dkeys)
+        yield _FileSlice(fold=fold,
+                         configuration=_report_key(econf),
+                         predictions_path=hconf.decode_output_path(econf,
+                                                                   fold),
+                         enable_details=econf.key in dkeys)
 
 
 def _model_info_path(hconf, rconf, test_data, fold=None, grain=None):
@@ -404,43 +493,84 @@ def _copy_version_files(hconf, test_data):
         shutil.copy(cpath, provenance_dir)
 
 
-def _mk_report(hconf, dconf, slices, fold, test_data=False):
+def _score_report_slices(dconf, slices, n_jobs):
+    """
+    Score a set of report slices on the whole pack and on each
+    partition, as independent (configuration, fold, partition) jobs
+
+    :type slices: iterable(_FileSlice)
+
+    :rtype: dict(string, ReportPack)
+    """
+    slices = list(slices)
+    folds = []
+    for slc in slices:
+        if slc.fold not in folds:
+            folds.append(slc.fold)
+    for fold in folds:
+        print('Scoring fold {}...'.format(fold), file=sys.stderr)
+        f_mpack = dconf.pack if fold is None else\
+            select_testing(dconf.pack, dconf.folds, fold)
+        _REPORTING[fold] = _partition_packs(f_mpack)
+
+    partitions = ['whole'] + [h for h, _ in _PARTITIONS]
+    jobs = []
+    for i, slc in enumerate(slices):
+        align_key = ('align', i)
+        jobs.append(Job.mk(align_key, _align_job,
+                           (slc.fold, slc.predictions_path)))
+        for partition in partitions:
+            jobs.append(Job.mk(('score', i, partition), _score_job,
+                               (slc.fold, partition, Result(align_key),
+                                slc.enable_details)))
+    try:
+        results = run_jobs(jobs, n_jobs=n_jobs)
+        labels = dconf.pack.values()[0].labels
+        rpacks = {}
+        for partition in partitions:
+            num_edges = sum(len(_REPORTING[f][partition][0]) for f in folds)
+            rpacks[partition] =\
+                _report_pack(((slc.configuration,
+                               results[('score', i, partition)],
+                               slc.enable_details)
+                              for i, slc in enumerate(slices)),
+                             labels, num_edges)
+    finally:
+        _REPORTING.clear()
+    return rpacks
+
+
+def _mk_report(hconf, dconf, slices, fold, test_data=False, n_jobs=None):
     """helper for report generation
 
     :type fold: int or None
+
+    :param n_jobs: how many scoring jobs to run in parallel (default:
+                   from the runtime config)
     """
-    # we could just use slices = list(slices) here but we have a
-    # bit of awkward lazy IO where it says 'scoring fold N...'
-    # the idea being that we should only really see this when it's
-    # actually scoring that fold. Hoop-jumping induced by the fact
-    # that we are now generating multiple reports on the same slices
-    slices_ = itr.tee(slices, 4)
-    rpack = full_report(dconf.pack, dconf.folds, slices_[0])
+    if n_jobs is None:
+        n_jobs = hconf.runcfg.n_jobs
+    rpacks = _score_report_slices(dconf, slices, n_jobs)
     rdir = hconf.report_dir_path(test_data, fold)
-    rpack.dump(rdir, header='whole')
-
-    partitions = [(1, 'intra', lambda d: d.selected(idxes_intra(d))),
-                  (2, 'inter', lambda d: d.selected(idxes_inter(d))),
-                  (3, 'froot', lambda d: d.selected(idxes_fakeroot(d)))]
-    for i, header, adjust_pack in partitions:
-        rpack = full_report(dconf.pack, dconf.folds, slices_[i],
-                            adjust_pack=adjust_pack)
-        rpack.append(rdir, header=header)
+    rpacks['whole'].dump(rdir, header='whole')
+    for header, _ in _PARTITIONS:
+        rpacks[header].append(rdir, header=header)
 
     for rconf in set(e.learner for e in hconf.evaluations):
         _mk_model_summary(hconf, dconf, rconf, test_data, fold)
 
 
-def mk_fold_report(hconf, dconf, fold):
+def mk_fold_report(hconf, dconf, fold, n_jobs=None):
     "Generate reports for the given fold"
     slices = _fold_report_slices(hconf, fold)
-    _mk_report(hconf, dconf, slices, fold)
+    _mk_report(hconf, dconf, slices, fold, n_jobs=n_jobs)
 
 
 def mk_global_report(hconf, dconf):
     "Generate reports for all folds"
     slices = itr.chain.from_iterable(_fold_report_slices(hconf, f)
-                                     for f in frozenset(dconf.folds.values()))
+                                     for f in sorted(frozenset(
+                                         dconf.folds.values())))
     _mk_report(hconf, dconf, slices, None)
     _copy_version_files(hconf, False)
 
@@ -464,10 +594,10 @@ def mk_test_report(hconf, dconf):
         return
 
     p_path = hconf.decode_output_path(econf, None)
-    slices = [Slice(fold=None,
-                    configuration=_report_key(econf),
-                    predictions=load_predictions(p_path),
-                    enable_details=True)]
+    slices = [_FileSlice(fold=None,
+                         configuration=_report_key(econf),
+                         predictions_path=p_path,
+                         enable_details=True)]
     _mk_report(hconf, dconf, slices, None,
                test_data=True)
     _copy_version_files(hconf, True)
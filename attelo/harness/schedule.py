@@ -0,0 +1,235 @@
+'''
+Running a graph of interdependent jobs (for example, learning,
+decoding, reassembly and reporting for each fold and configuration)
+on a pool of worker processes, starting each job as soon as the
+jobs it depends on are done
+'''
+
+from __future__ import print_function
+from collections import namedtuple
+import heapq
+import multiprocessing
+import traceback
+
+from joblib import cpu_count
+from six.moves import queue
+
+# pylint: disable=too-few-public-methods
+
+
+class Result(namedtuple('Result', ['key'])):
+    '''
+    Placeholder for the result of another job, to be used in
+    the arguments of a job that depends on it
+    '''
+    pass
+
+
+class Job(namedtuple('Job', ['key', 'func', 'args', 'deps',
+                             'local', 'priority'])):
+    '''
+    A job in a graph of jobs
+
+    Parameters
+    ----------
+    key: hashable
+        unique name for the job
+
+    func: function
+        what to run (must be picklable, ie. a module level function,
+        unless `local` is set)
+
+    args: tuple
+        arguments to the function; any :py:class:`Result` among
+        them is replaced by the result of the corresponding job
+
+    deps: [hashable]
+        keys of the jobs that must be done before this one
+        (including those whose results we use)
+
+    local: bool
+        run the job in this process (eg. for quick jobs that need
+        to write to files in some order) rather than in a worker
+
+    priority: int
+        among the jobs that are ready to run, those with the
+        lowest priority go first (then those that were ready
+        first, or that came first in the list of jobs)
+    '''
+    @classmethod
+    def mk(cls, key, func, args, deps=None, local=False, priority=0):
+        '''
+        Job with default settings (no dependencies other than the
+        results we use, run in a worker process)
+        '''
+        deps = list(deps or [])
+        deps.extend(x.key for x in args
+                    if isinstance(x, Result) and x.key not in deps)
+        return cls(key=key, func=func, args=tuple(args), deps=deps,
+                   local=local, priority=priority)
+
+
+class JobException(Exception):
+    '''
+    A job failed in a worker process
+    '''
+    pass
+
+
+def _run_remote(key, func, args):
+    '''
+    (worker) run a job, returning its key and result, or the
+    traceback if it fails (so that we always hear back from the
+    job)
+    '''
+    try:
+        return key, True, func(*args)
+    # pylint: disable=broad-except
+    except Exception:
+        return key, False, traceback.format_exc()
+    # pylint: enable=broad-except
+
+
+def _resolve(args, results):
+    '''
+    Replace result placeholders in job arguments
+    '''
+    return tuple(results[x.key] if isinstance(x, Result) else x
+                 for x in args)
+
+
+def _check_remote(pending, workers):
+    '''
+    Look for remote jobs that we will never hear back from through
+    the pool callback (which is only called on success): the job
+    arguments or result could not be pickled, or a worker process
+    died (eg. killed for running out of memory) along with
+    whatever it was running
+
+    :param pending: asynchronous result for each remote job in flight
+    :type pending: dict(key, AsyncResult)
+
+    :param workers: the pool's worker processes
+    '''
+    for key, async_result in pending.items():
+        if async_result.ready() and not async_result.successful():
+            try:
+                async_result.get()
+            # pylint: disable=broad-except
+            except Exception:
+                raise JobException('Job {} failed:\n{}'
+                                   ''.format(key, traceback.format_exc()))
+            # pylint: enable=broad-except
+    dead = [w for w in workers if w.exitcode is not None]
+    if dead and pending:
+        raise JobException('A worker process died (exit code {}) while '
+                           'running some of these jobs: {}'
+                           ''.format(dead[0].exitcode,
+                                     sorted(pending)))
+
+
+def run_jobs(jobs, n_jobs=-1):
+    '''
+    Run a graph of jobs, each as soon as the ones it depends on
+    are done, with up to `n_jobs` jobs running at a time in worker
+    processes (-1 for as many as CPUs, -2 for one fewer, etc; 0 or
+    1 to run them one at a time in this process)
+
+    The worker processes are forked when this is called, so they
+    inherit anything that the jobs may need to refer to (eg. the
+    data) from module-level variables set beforehand
+
+    We raise :py:class:`JobException` if any job fails, including
+    if its arguments or result cannot be pickled, or if the worker
+    process running it dies
+
+    :rtype: dict(key, object) (job results)
+    '''
+    jobs = list(jobs)
+    order = [job.key for job in jobs]
+    jobs = {job.key: job for job in jobs}
+    waiting_on = {}
+    children = {key: [] for key in jobs}
+    for job in jobs.values():
+        missing = [d for d in job.deps if d not in jobs]
+        if missing:
+            raise ValueError('Job {} depends on unknown jobs {}'
+                             ''.format(job.key, missing))
+        waiting_on[job.key] = len(job.deps)
+        for dep in job.deps:
+            children[dep].append(job.key)
+    if n_jobs < 0:
+        n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+
+    ready = []
+    counter = [0]
+
+    def make_ready(key):
+        'queue a job whose dependencies are done'
+        heapq.heappush(ready, (jobs[key].priority, counter[0], key))
+        counter[0] += 1
+
+    for key in order:
+        if not waiting_on[key]:
+            make_ready(key)
+
+    results = {}
+    done = queue.Queue()
+    pool = multiprocessing.Pool(n_jobs) if n_jobs > 1 else None
+    # the pool replaces any worker that dies, so hold on to the
+    # originals to find out if one did
+    # pylint: disable=protected-access
+    workers = list(pool._pool) if pool is not None else []
+    # pylint: enable=protected-access
+    pending = {}
+    in_flight = 0
+    try:
+        while ready or in_flight:
+            # start everything we can (one job at a time if we are
+            # running them here, so that the jobs it makes ready can
+            # go first if they have priority)
+            limit = n_jobs if pool is not None else 1
+            while ready and (in_flight < limit or
+                             (pool is not None and jobs[ready[0][2]].local)):
+                _, _, key = heapq.heappop(ready)
+                job = jobs[key]
+                args = _resolve(job.args, results)
+                if pool is None or job.local:
+                    done.put((key, True, job.func(*args)))
+                else:
+                    pending[key] = pool.apply_async(_run_remote,
+                                                    (key, job.func, args),
+                                                    callback=done.put)
+                in_flight += 1
+            # wait for something to finish
+            # (with a timeout so that we can still be interrupted,
+            # and check for jobs that will never report back)
+            while True:
+                try:
+                    key, success, result = done.get(timeout=1)
+                    break
+                except queue.Empty:
+                    _check_remote(pending, workers)
+            pending.pop(key, None)
+            in_flight -= 1
+            if not success:
+                raise JobException('Job {} failed:\n{}'.format(key, result))
+            results[key] = result
+            for child in children[key]:
+                waiting_on[child] -= 1
+                if not waiting_on[child]:
+                    make_ready(child)
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+    if len(results) != len(jobs):
+        raise ValueError('Some jobs could not be run (cyclic '
+                         'dependencies?): ' +
+                         str(sorted(set(jobs) - set(results))))
+    return results
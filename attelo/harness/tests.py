@@ -2,9 +2,36 @@
 attelo.harness tests
 """
 
+from os import path as fp
+import os
+import signal
 import unittest
 
+from attelo.decoding.mst import (MstDecoder, MstRootStrategy)
+from attelo.io import load_multipack
 from .example import TinyHarness
+from .parse import (decode_documents, group_by_learner)
+from .schedule import (Job, JobException, Result, run_jobs)
+
+
+def _add(*args):
+    'sum of job results'
+    return sum(args)
+
+
+def _fail():
+    'failing job'
+    raise ValueError('oops')
+
+
+def _unpicklable():
+    'job whose result cannot be sent back from a worker'
+    return lambda x: x
+
+
+def _die():
+    'job that kills its worker (as if it ran out of memory)'
+    os.kill(os.getpid(), signal.SIGKILL)
 
 
 # pylint: disable=too-few-public-methods
@@ -18,3 +45,70 @@ class HarnessTest(unittest.TestCase):
         """Check that the harness does not crash on example data
         """
         TinyHarness().run()
+
+    def test_group_by_learner(self):
+        """Configs that only differ in their decoders share a learner
+        """
+        econfs = TinyHarness.evaluations.fget(TinyHarness)
+        self.assertEqual(group_by_learner(econfs, 0), [econfs])
+        self.assertEqual(group_by_learner(econfs[::-1], None),
+                         [econfs[::-1]])
+
+    def test_decode_documents(self):
+        """Decoding in worker processes gives the same predictions
+        as decoding in this one
+        """
+        paths = [fp.join('doc', 'example-corpus', 'tiny' + sfx) for sfx in
+                 ['.edus', '.pairings', '.features.sparse',
+                  '.features.sparse.vocab']]
+        mpack = load_multipack(*paths)
+        parser = MstDecoder(MstRootStrategy.leftmost)
+        expected = dict(decode_documents(parser, mpack, n_jobs=0))
+        self.assertEqual(sorted(expected), sorted(mpack))
+        for stream in [mpack, iter(sorted(mpack.items()))]:
+            got = list(decode_documents(parser, stream, n_jobs=2,
+                                        chunksize=2))
+            self.assertEqual(len(got), len(expected))
+            for onedoc, prediction in got:
+                self.assertEqual(prediction.tolist(),
+                                 expected[onedoc].tolist())
+
+    def test_run_jobs(self):
+        """Jobs see the results of the jobs they depend on,
+        whether or not they run in worker processes
+        """
+        order = []
+
+        def note(key, *args):
+            'local job that remembers when it was run'
+            order.append(key)
+            return sum(args)
+
+        jobs = [Job.mk('a', _add, (1, 2)),
+                Job.mk('b', _add, (Result('a'), 3)),
+                Job.mk('c', _add, (Result('a'), Result('b'))),
+                Job.mk('d', note, ('d', Result('c')), local=True),
+                Job.mk('e', note, ('e',), deps=['d'], local=True)]
+        for n_jobs in [1, 2]:
+            del order[:]
+            results = run_jobs(jobs, n_jobs=n_jobs)
+            self.assertEqual(results, {'a': 3, 'b': 6, 'c': 9,
+                                       'd': 9, 'e': 0})
+            self.assertEqual(order, ['d', 'e'])
+        # one at a time: jobs made ready go first if they have priority
+        del order[:]
+        run_jobs([Job.mk('x1', note, ('x1',), priority=1),
+                  Job.mk('x2', note, ('x2',), priority=1),
+                  Job.mk('y', note, ('y',), deps=['x1'])], n_jobs=1)
+        self.assertEqual(order, ['x1', 'y', 'x2'])
+        self.assertRaises(JobException, run_jobs,
+                          [Job.mk('f', _fail, ())], n_jobs=2)
+        # jobs that would otherwise never report back
+        self.assertRaises(JobException, run_jobs,
+                          [Job.mk('f', _unpicklable, ())], n_jobs=2)
+        self.assertRaises(JobException, run_jobs,
+                          [Job.mk('f', _add, (lambda: 1,))], n_jobs=2)
+        self.assertRaises(JobException, run_jobs,
+                          [Job.mk('f', _die, ())], n_jobs=2)
+        self.assertRaises(ValueError, run_jobs,
+                          [Job.mk('g', _add, (), deps=['h'])])
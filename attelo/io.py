@@ -3,20 +3,31 @@ Saving and loading data or models
 """
 
 from __future__ import print_function
+from collections import OrderedDict
 from itertools import chain
+from os import path as fp
 import codecs
 import copy
 import csv
+import gzip
+import hashlib
 import json
+import os
+import shutil
 import sys
+import tempfile
 import time
 import traceback
 
+from six import BytesIO
 import joblib
+import numpy as np
+import scipy.sparse
 from sklearn.datasets import load_svmlight_file
 
 from .edu import (EDU, FAKE_ROOT_ID, FAKE_ROOT)
 from .table import (DataPack, DataPackException,
+                    EduTable, EduView, FeaturePlaceholder, Pairings,
                     UNKNOWN, UNRELATED,
                     get_label_string, groupings)
 from .util import truncate
@@ -108,6 +119,47 @@ class Torpor(object):
 # ---------------------------------------------------------------------
 
 
+def _read_edu(edu_file, row):
+    """
+    Interpret a single row of an EDU file
+
+    :rtype: EDU
+    """
+    expected_len = 6
+    if len(row) != expected_len:
+        oops = ('This row in the EDU file {efile} has {num} '
+                'elements instead of the expected {expected}: '
+                '{row}')
+        raise IoException(oops.format(efile=edu_file,
+                                      num=len(row),
+                                      expected=expected_len,
+                                      row=row))
+    [global_id, txt, grouping, subgrouping, start_str, end_str] = row
+    start = int(start_str)
+    end = int(end_str)
+    return EDU(global_id,
+               txt.decode('utf-8'),
+               start,
+               end,
+               grouping,
+               subgrouping)
+
+
+def _read_pair(pairings_file, row):
+    """
+    Interpret a single row of a pairings file
+
+    :rtype: (string, string)
+    """
+    if len(row) < 2 or len(row) > 3:
+        oops = ('This row in the pairings file {efile} has '
+                '{num} elements instead of the expected 2 or 3')
+        raise IoException(oops.format(efile=pairings_file,
+                                      num=len(row),
+                                      row=row))
+    return tuple(row[:2])
+
+
 def load_edus(edu_file):
     """
     Read EDUs (see :doc:`../input`)
@@ -116,30 +168,9 @@ def load_edus(edu_file):
 
     .. _format: https://github.com/kowey/attelo/doc/inputs.rst
     """
-    def read_edu(row):
-        'interpret a single row'
-        expected_len = 6
-        if len(row) != expected_len:
-            oops = ('This row in the EDU file {efile} has {num} '
-                    'elements instead of the expected {expected}: '
-                    '{row}')
-            raise IoException(oops.format(efile=edu_file,
-                                          num=len(row),
-                                          expected=expected_len,
-                                          row=row))
-        [global_id, txt, grouping, subgrouping, start_str, end_str] = row
-        start = int(start_str)
-        end = int(end_str)
-        return EDU(global_id,
-                   txt.decode('utf-8'),
-                   start,
-                   end,
-                   grouping,
-                   subgrouping)
-
     with open(edu_file, 'rb') as instream:
         reader = csv.reader(instream, dialect=csv.excel_tab)
-        return [read_edu(r) for r in reader if r]
+        return [_read_edu(edu_file, r) for r in reader if r]
 
 
 def load_pairings(edu_file):
@@ -151,19 +182,9 @@ def load_pairings(edu_file):
 
     .. _format: https://github.com/kowey/attelo/doc/inputs.rst
     """
-    def read_pair(row):
-        'interpret a single row'
-        if len(row) < 2 or len(row) > 3:
-            oops = ('This row in the pairings file {efile} has '
-                    '{num} elements instead of the expected 2 or 3')
-            raise IoException(oops.format(efile=edu_file,
-                                          num=len(row),
-                                          row=row))
-        return tuple(row[:2])
-
     with open(edu_file, 'rb') as instream:
         reader = csv.reader(instream, dialect=csv.excel_tab)
-        return [read_pair(r) for r in reader if r]
+        return [_read_pair(edu_file, r) for r in reader if r]
 
 
 def load_labels(feature_file):
@@ -189,7 +210,7 @@ def _process_edu_links(edus, pairings):
     :py:method:load_pairings: to a sequence of edus and pairings
     respectively
 
-    :rtype: ([EDU], [(EDU,EDU)])
+    :rtype: (EduView, Pairings)
     """
     edumap = {e.id: e for e in edus}
     enames = frozenset(chain.from_iterable(pairings))
@@ -207,19 +228,151 @@ def _process_edu_links(edus, pairings):
         raise DataPackException(oops.format(truncate(', '.join(naughty),
                                                      1000)))
 
-    pairings2 = [(edumap[e1], edumap[e2]) for e1, e2 in pairings]
-    return edus2, pairings2
+    rows = {e.id: i for i, e in enumerate(edus2)}
+    table = EduTable(edus2)
+    pairings2 = Pairings(table,
+                         [rows[e1] for e1, _ in pairings],
+                         [rows[e2] for _, e2 in pairings])
+    return EduView(table), pairings2
 
 
-def load_multipack(edu_file, pairings_file, feature_file, vocab_file,
-                   verbose=False):
+def _svmlight_chunk_bounds(feature_file, num_chunks):
     """
-    Read EDUs and features for edu pairs.
+    Split a file into (at most) the given number of byte ranges,
+    each starting at the beginning of a line
 
-    Perform some basic sanity checks, raising
-    :py:class:`IoException` if they should fail
+    :rtype [(int, int)]
+    """
+    size = os.path.getsize(feature_file)
+    bounds = [0]
+    with open(feature_file, 'rb') as stream:
+        for i in range(1, num_chunks):
+            stream.seek(max(size * i // num_chunks, bounds[-1]))
+            if stream.tell() > 0:
+                # move to the start of the next line (unless we
+                # happen to be at the start of one already)
+                stream.seek(-1, os.SEEK_CUR)
+                stream.readline()
+            if stream.tell() > bounds[-1]:
+                bounds.append(stream.tell())
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:])
+            if end > start]
+
+
+def _load_svmlight_chunk(feature_file, start, end, n_features):
+    """
+    Parse the lines from the given byte range of an svmlight
+    file, with raw (zero-based) indices
 
-    :rtype: :py:class:`Multipack` or None
+    :rtype (array(float), array(int), array(int), array(float))
+    """
+    with open(feature_file, 'rb') as stream:
+        stream.seek(start)
+        chunk = stream.read(end - start)
+    # pylint: disable=unbalanced-tuple-unpacking
+    data, targets = load_svmlight_file(BytesIO(chunk),
+                                       n_features=n_features,
+                                       zero_based=True)
+    # pylint: enable=unbalanced-tuple-unpacking
+    return data.data, data.indices, data.indptr, targets
+
+
+def load_svmlight_chunked(feature_file, n_features, n_jobs=1,
+                          min_chunk_size=1 << 20):
+    """
+    Parallel version of `load_svmlight_file(feature_file,
+    n_features=n_features)`: split the feature file into byte
+    ranges at line boundaries, parse them in a pool of processes,
+    and stitch the results back together.
+
+    The result is identical to what we would get from parsing the
+    file in one go (including the automatic detection of zero vs
+    one-based feature indices)
+
+    Splitting the file has a cost of its own (on a single core it
+    is a bit slower than parsing in one go), so this is opt-in:
+    by default we just parse the file in the current process.
+    Ask for more jobs only if you have the cores for them.
+
+    Parameters
+    ----------
+    n_jobs: int
+        number of processes (-1 for one per core, 0 or 1 to
+        just parse the file in the current process)
+    min_chunk_size: int
+        don't bother splitting the file into chunks smaller
+        than this (in bytes)
+
+    :rtype (csr_matrix, array(float))
+    """
+    if n_jobs < 0:
+        n_jobs = max(joblib.cpu_count() + 1 + n_jobs, 1)
+    size = os.path.getsize(feature_file)
+    num_chunks = min(max(n_jobs, 1), max(size // max(min_chunk_size, 1), 1))
+    if num_chunks <= 1:
+        return load_svmlight_file(feature_file, n_features=n_features)
+
+    bounds = _svmlight_chunk_bounds(feature_file, num_chunks)
+    # parse with one extra column so that we can accept one-based
+    # indices now and decide what to do with them later
+    chunks = joblib.Parallel(n_jobs=len(bounds))(
+        joblib.delayed(_load_svmlight_chunk)(feature_file, start, end,
+                                             n_features + 1)
+        for start, end in bounds)
+
+    data = np.concatenate([c[0] for c in chunks])
+    indices = np.concatenate([c[1] for c in chunks])
+    offsets = np.cumsum([0] + [len(c[0]) for c in chunks])
+    indptr = np.concatenate([chunks[0][2][:1]] +
+                            [c[2][1:] + o for c, o in zip(chunks, offsets)])
+    targets = np.concatenate([c[3] for c in chunks])
+    # same rule as load_svmlight_file(zero_based='auto')
+    if len(indices) and indices.min() > 0:
+        indices -= 1
+    if len(indices) and indices.max() >= n_features:
+        raise ValueError('n_features was set to {}, but input file '
+                         'contains {} features'.format(n_features,
+                                                       indices.max() + 1))
+    matrix = scipy.sparse.csr_matrix((data, indices, indptr),
+                                     shape=(len(targets), n_features))
+    return matrix, targets
+
+
+def _svmlight_target(line):
+    """
+    Target value of an svmlight line (None for blank and
+    comment-only lines)
+    """
+    fields = line.split(b'#', 1)[0].split(None, 1)
+    return float(fields[0]) if fields else None
+
+
+def load_svmlight_targets(feature_file):
+    """
+    Read only the target column of an svmlight file, without
+    parsing (or keeping) any of its features
+
+    :rtype: array(float)
+    """
+    with open(feature_file, 'rb') as stream:
+        try:
+            targets = [_svmlight_target(line) for line in stream]
+        except ValueError as oops:
+            raise IoException('Could not read targets from {}: {}'
+                              ''.format(feature_file, oops))
+    return np.array([t for t in targets if t is not None],
+                    dtype=np.float64)
+
+
+def _load_multipack_sources(edu_file, pairings_file, feature_file, vocab_file,
+                            verbose=False, n_jobs=1, targets_only=False):
+    """
+    Read EDUs and features for edu pairs from the original
+    (text) input files, returning a single datapack for the
+    whole corpus
+
+    :rtype: :py:class:`DataPack`
     """
     vocab = load_vocab(vocab_file)
 
@@ -227,19 +380,273 @@ def load_multipack(edu_file, pairings_file, feature_file, vocab_file,
         edus, pairings = _process_edu_links(load_edus(edu_file),
                                             load_pairings(pairings_file))
 
-    with Torpor("Reading features", quiet=not verbose):
-        labels = [UNKNOWN] + load_labels(feature_file)
-        # pylint: disable=unbalanced-tuple-unpacking
-        data, targets = load_svmlight_file(feature_file,
-                                           n_features=len(vocab))
-        # pylint: enable=unbalanced-tuple-unpacking
+    if targets_only:
+        with Torpor("Reading targets", quiet=not verbose):
+            labels = [UNKNOWN] + load_labels(feature_file)
+            targets = load_svmlight_targets(feature_file)
+            data = FeaturePlaceholder((len(targets), len(vocab)))
+    else:
+        with Torpor("Reading features", quiet=not verbose):
+            labels = [UNKNOWN] + load_labels(feature_file)
+            # pylint: disable=unbalanced-tuple-unpacking
+            data, targets = load_svmlight_chunked(feature_file,
+                                                  n_features=len(vocab),
+                                                  n_jobs=n_jobs)
+            # pylint: enable=unbalanced-tuple-unpacking
 
     with Torpor("Build data packs", quiet=not verbose):
         dpack = DataPack.load(edus, pairings, data, targets,
                               labels, vocab)
+    return dpack
+
+
+def load_multipack(edu_file, pairings_file, feature_file, vocab_file,
+                   verbose=False, cache_dir=None, n_jobs=1,
+                   targets_only=False):
+    """
+    Read EDUs and features for edu pairs.
+
+    Perform some basic sanity checks, raising
+    :py:class:`IoException` if they should fail
 
-    return {k: dpack.selected(idxs) for
-            k, idxs in groupings(pairings).items()}
+    If you supply a `cache_dir`, we compile the inputs into a binary
+    cache in that directory the first time we see them (see
+    :py:func:`save_mpack_cache`), and on later calls read the cache
+    back instead of parsing the inputs again. The arrays we read
+    back from the cache (features, targets, pairings) are read-only
+    memory maps, so copy them first if you need to modify them.
+
+    If the rows for a grouping are contiguous (as they would be if
+    the pairings file is sorted by document), its datapack is a
+    view on the corpus-wide data (see :py:meth:`DataPack.sliced`)
+
+    If you ask for more than one job, large feature files are
+    parsed in `n_jobs` processes (see
+    :py:func:`load_svmlight_chunked`)
+
+    If `targets_only` is True, we skip the features altogether
+    and the datapacks get a :py:class:`FeaturePlaceholder` for
+    their `data`. This is all you need for scoring and reporting.
+    We still read from the cache if there is one, but do not
+    create it (that would mean parsing the features after all).
+
+    :rtype: :py:class:`Multipack` or None
+    """
+    sources = (edu_file, pairings_file, feature_file, vocab_file)
+    dpack = None
+    if cache_dir is not None:
+        dpack = load_mpack_cache(cache_dir, sources, verbose=verbose,
+                                 targets_only=targets_only)
+    if dpack is None and targets_only:
+        dpack = _load_multipack_sources(*sources, verbose=verbose,
+                                        targets_only=True)
+    elif dpack is None:
+        dpack = _load_multipack_sources(*sources, verbose=verbose,
+                                        n_jobs=n_jobs)
+        if cache_dir is not None and\
+                save_mpack_cache(cache_dir, sources, dpack, verbose=verbose):
+            # read it back so that the first and later cached runs
+            # return exactly the same thing
+            dpack = load_mpack_cache(cache_dir, sources, verbose=verbose)
+
+    mpack = {}
+    for key, idxs in groupings(dpack.pairings).items():
+        if len(idxs) and idxs[-1] - idxs[0] + 1 == len(idxs):
+            # contiguous rows (the usual case if the inputs are sorted
+            # by document): no need to copy anything
+            mpack[key] = dpack.sliced(idxs[0], idxs[-1] + 1)
+        else:
+            mpack[key] = dpack.selected(idxs)
+    return mpack
+
+
+class _EduStream(object):
+    """
+    Reads an EDU file (sorted by grouping) on demand, keeping
+    only the EDUs for groupings we have not finished with
+
+    Groupings that the pairings never mention are dropped as soon
+    as the pairings have moved past them (we finish with a grouping
+    that comes later in the EDU file), so we only ever hold on to
+    the EDUs between the current grouping and the next one
+    """
+    def __init__(self, edu_file, stream):
+        self._edu_file = edu_file
+        self._reader = (_read_edu(edu_file, r) for r in
+                        csv.reader(stream, dialect=csv.excel_tab) if r)
+        self._known = {}
+        # in the order we read them from the EDU file
+        self._groups = OrderedDict()
+        self._finished = set()
+
+    def lookup(self, edu_id):
+        """
+        Return the EDU with the given id, reading ahead as much as
+        we need to find it (raises IoException if it's not there)
+        """
+        while edu_id not in self._known:
+            try:
+                edu = next(self._reader)
+            except StopIteration:
+                oops = ('The pairings file mentions the EDU {edu}, but we '
+                        'could not find it in the EDU file {efile} '
+                        '(either it is missing, or the inputs are not '
+                        'sorted by grouping)')
+                raise IoException(oops.format(edu=edu_id,
+                                              efile=self._edu_file))
+            if edu.grouping in self._finished:
+                continue
+            self._known[edu.id] = edu
+            self._groups.setdefault(edu.grouping, []).append(edu)
+        return self._known[edu_id]
+
+    def _forget(self, grouping):
+        """
+        Mark a grouping as finished, dropping its EDUs and
+        returning them
+        """
+        self._finished.add(grouping)
+        edus = self._groups.pop(grouping, [])
+        for edu in edus:
+            del self._known[edu.id]
+        return edus
+
+    def pop_group(self, grouping):
+        """
+        Return all EDUs we have read for the given grouping and
+        forget about them, along with any groupings that came
+        before it in the EDU file (the pairings being sorted in the
+        same order, we will not need those either)
+        """
+        if grouping in self._groups:
+            for stale in list(self._groups):
+                if stale == grouping:
+                    break
+                self._forget(stale)
+        return self._forget(grouping)
+
+    def is_finished(self, grouping):
+        "True if we have already popped this grouping"
+        return grouping in self._finished
+
+
+def _pairing_grouping(edus, pair):
+    """
+    Grouping for an (id, id) pair (see :py:func:`attelo.table.groupings`)
+    """
+    grps = [edus.lookup(x).grouping for x in pair if x != FAKE_ROOT_ID]
+    if not grps:
+        return None
+    if len(grps) == 2 and grps[0] != grps[1]:
+        oops = ('Grouping mismatch: {edu1} is in group {grp1}, '
+                'but {edu2} is in {grp2}')
+        raise DataPackException(oops.format(edu1=pair[0],
+                                            edu2=pair[1],
+                                            grp1=grps[0],
+                                            grp2=grps[1]))
+    return grps[0]
+
+
+def _feature_lines(stream):
+    """
+    Non-comment lines from an svmlight file
+    """
+    for line in stream:
+        if line.strip() and not line.startswith('#'):
+            yield line
+
+
+def iter_multipack(edu_file, pairings_file, feature_file, vocab_file,
+                   targets_only=False):
+    """
+    Streaming version of :py:func:`load_multipack`: read the
+    EDU, pairings and features files in lockstep, yielding
+    a `(grouping, DataPack)` pair for each grouping as soon as
+    we have read all of its pairings.
+
+    This only keeps one grouping in memory at a time, but it
+    assumes that the inputs are sorted by grouping (each
+    grouping's rows are contiguous, in the same order in the EDU
+    and pairings files). We raise :py:class:`IoException` if
+    they are not. It also assumes one-based feature indices,
+    as used in the vocabulary files
+
+    If `targets_only` is True, we do not parse the features (see
+    :py:func:`load_multipack`)
+
+    :rtype: iterator((string, DataPack))
+    """
+    vocab = load_vocab(vocab_file)
+    labels = [UNKNOWN] + load_labels(feature_file)
+
+    def read_data(lines):
+        'feature matrix and targets for a single grouping'
+        if targets_only:
+            targets = np.array([_svmlight_target(x) for x in lines],
+                               dtype=np.float64)
+            return FeaturePlaceholder((len(lines), len(vocab))), targets
+        else:
+            return load_svmlight_file(BytesIO(b''.join(lines)),
+                                      n_features=len(vocab),
+                                      zero_based=False)
+
+    def mk_pack(edus, pairs, lines):
+        'datapack for a single grouping'
+        edus, pairings = _process_edu_links(edus, pairs)
+        try:
+            # pylint: disable=unbalanced-tuple-unpacking
+            data, targets = read_data(lines)
+            # pylint: enable=unbalanced-tuple-unpacking
+        except ValueError as oops:
+            raise IoException('Could not read features from {}: {}'
+                              ''.format(feature_file, oops))
+        dpack = DataPack.load(edus, pairings, data, targets,
+                              labels, vocab)
+        # only keep EDUs that are actually used in the pairings
+        # (as load_multipack would do)
+        return dpack.sliced(0, len(dpack))
+
+    with open(edu_file, 'rb') as edu_stream,\
+            open(pairings_file, 'rb') as pair_stream,\
+            open(feature_file, 'rb') as feature_stream:
+        edus = _EduStream(edu_file, edu_stream)
+        lines = _feature_lines(feature_stream)
+        current = None
+        pairs = []
+        group_lines = []
+        for row in csv.reader(pair_stream, dialect=csv.excel_tab):
+            if not row:
+                continue
+            pair = _read_pair(pairings_file, row)
+            grouping = _pairing_grouping(edus, pair)
+            if pairs and grouping != current:
+                yield current, mk_pack(edus.pop_group(current),
+                                       pairs, group_lines)
+                pairs = []
+                group_lines = []
+            if edus.is_finished(grouping):
+                oops = ('The pairings file {pfile} is not sorted by '
+                        'grouping: we see pairs from {grp} again after '
+                        'pairs from another grouping')
+                raise IoException(oops.format(pfile=pairings_file,
+                                              grp=grouping))
+            try:
+                group_lines.append(next(lines))
+            except StopIteration:
+                oops = ('The features file {ffile} has fewer instances '
+                        'than there are pairs in {pfile}')
+                raise IoException(oops.format(ffile=feature_file,
+                                              pfile=pairings_file))
+            current = grouping
+            pairs.append(pair)
+        if pairs:
+            yield current, mk_pack(edus.pop_group(current),
+                                   pairs, group_lines)
+        if next(lines, None) is not None:
+            oops = ('The features file {ffile} has more instances '
+                    'than there are pairs in {pfile}')
+            raise IoException(oops.format(ffile=feature_file,
+                                          pfile=pairings_file))
 
 
 def load_vocab(filename):
@@ -250,6 +657,178 @@ def load_vocab(filename):
             features.append(line.split('\t')[0])
     return features
 
+
+# ---------------------------------------------------------------------
+# compiled multipack cache
+# ---------------------------------------------------------------------
+
+MPACK_CACHE_VERSION = 1
+"bump this whenever the layout of the multipack cache changes"
+
+_MPACK_CACHE_ARRAYS = ['data', 'indices', 'indptr', 'target',
+                       'edu_start', 'edu_end',
+                       'pair_src', 'pair_tgt']
+_MPACK_CACHE_FEATURES = ['data', 'indices', 'indptr']
+
+
+def mpack_cache_path(cache_dir, feature_file):
+    """
+    Path to the directory (within the cache directory) holding the
+    compiled version of a multipack whose features live in the
+    given file
+    """
+    abs_path = fp.abspath(feature_file)
+    return fp.join(cache_dir,
+                   '{}-{}'.format(fp.basename(abs_path),
+                                  hashlib.sha1(abs_path.encode('utf-8')).hexdigest()[:12]))
+
+
+def _mpack_cache_stamps(sources):
+    """
+    Fingerprint for the multipack input files (absolute path, size,
+    modification time). Any change in these invalidates the cache
+    """
+    stamps = []
+    for path in sources:
+        stat = os.stat(path)
+        stamps.append([fp.abspath(path), stat.st_size, stat.st_mtime])
+    return stamps
+
+
+def save_mpack_cache(cache_dir, sources, dpack, verbose=False):
+    """
+    Compile a (stacked) datapack into a directory of numpy arrays
+    (and a json file for the strings) within the given cache
+    directory (created if need be). The arrays can later be
+    memory-mapped by :py:func:`load_mpack_cache`
+
+    Failing to write the cache is not fatal (we just carry on
+    without one)
+
+    :param sources: edus, pairings, features, and vocab paths
+    :rtype: bool (True if the cache was written)
+    """
+    mpack_dir = mpack_cache_path(cache_dir, sources[2])
+    edus = list(dpack.edus)
+    has_fake_root = bool(edus) and edus[0].id == FAKE_ROOT_ID
+    edu_index = {e.id: i for i, e in enumerate(edus)}
+    arrays = {'data': dpack.data.data,
+              'indices': dpack.data.indices,
+              'indptr': dpack.data.indptr,
+              'target': dpack.target,
+              'edu_start': np.array([int(e.start) for e in edus],
+                                    dtype=np.int64),
+              'edu_end': np.array([int(e.end) for e in edus],
+                                  dtype=np.int64),
+              'pair_src': np.array([edu_index[e1.id]
+                                    for e1, _ in dpack.pairings],
+                                   dtype=np.int64),
+              'pair_tgt': np.array([edu_index[e2.id]
+                                    for _, e2 in dpack.pairings],
+                                   dtype=np.int64)}
+    manifest = {'version': MPACK_CACHE_VERSION,
+                'sources': _mpack_cache_stamps(sources),
+                'shape': list(dpack.data.shape),
+                'has_fake_root': has_fake_root}
+    strings = {'labels': dpack.labels,
+               'vocab': dpack.vocab,
+               'edu_id': [e.id for e in edus],
+               'edu_text': [e.text for e in edus],
+               'edu_grouping': [e.grouping for e in edus],
+               'edu_subgrouping': [e.subgrouping for e in edus]}
+    with Torpor("Writing multipack cache", quiet=not verbose):
+        tmp_dir = None
+        try:
+            if not fp.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_dir = tempfile.mkdtemp(dir=cache_dir,
+                                       prefix='.' + fp.basename(mpack_dir))
+            for key in _MPACK_CACHE_ARRAYS:
+                np.save(fp.join(tmp_dir, key + '.npy'), arrays[key])
+            with codecs.open(fp.join(tmp_dir, 'strings.json'),
+                             'w', 'utf-8') as stream:
+                json.dump(strings, stream)
+            # the manifest goes in last: no manifest, no cache
+            with open(fp.join(tmp_dir, 'manifest.json'), 'w') as stream:
+                json.dump(manifest, stream)
+            if fp.exists(mpack_dir):
+                shutil.rmtree(mpack_dir)
+            os.rename(tmp_dir, mpack_dir)
+        except (IOError, OSError) as err:
+            print('Could not write multipack cache {}: {}'.format(mpack_dir,
+                                                                  err),
+                  file=sys.stderr)
+            if tmp_dir is not None and fp.exists(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+    return True
+
+
+def load_mpack_cache(cache_dir, sources, verbose=False, targets_only=False):
+    """
+    Read back a compiled multipack (see :py:func:`save_mpack_cache`)
+    as a single datapack, memory-mapping its arrays (read-only).
+
+    If `targets_only` is True, leave the feature matrix out (see
+    :py:func:`load_multipack`)
+
+    :param sources: edus, pairings, features, and vocab paths
+    :rtype: :py:class:`DataPack` or None (if the cache is missing
+            or out of date)
+    """
+    mpack_dir = mpack_cache_path(cache_dir, sources[2])
+    manifest_path = fp.join(mpack_dir, 'manifest.json')
+    if not fp.exists(manifest_path):
+        return None
+    with open(manifest_path) as stream:
+        manifest = json.load(stream)
+    if (manifest.get('version') != MPACK_CACHE_VERSION or
+            manifest.get('sources') != _mpack_cache_stamps(sources)):
+        return None
+
+    try:
+        arrays = {k: np.load(fp.join(mpack_dir, k + '.npy'), mmap_mode='r')
+                  for k in _MPACK_CACHE_ARRAYS
+                  if not (targets_only and k in _MPACK_CACHE_FEATURES)}
+        with codecs.open(fp.join(mpack_dir, 'strings.json'),
+                         'r', 'utf-8') as stream:
+            strings = json.load(stream)
+    except (IOError, ValueError) as err:
+        print('Ignoring damaged multipack cache {}: {}'.format(mpack_dir,
+                                                               err),
+              file=sys.stderr)
+        return None
+
+    with Torpor("Reading multipack cache", quiet=not verbose):
+        edus = [EDU(*row) for row in zip(strings['edu_id'],
+                                         strings['edu_text'],
+                                         arrays['edu_start'].tolist(),
+                                         arrays['edu_end'].tolist(),
+                                         strings['edu_grouping'],
+                                         strings['edu_subgrouping'])]
+        if manifest['has_fake_root']:
+            edus[0] = FAKE_ROOT
+        table = EduTable(edus)
+        pairings = Pairings(table,
+                            arrays['pair_src'],
+                            arrays['pair_tgt'])
+        if targets_only:
+            data = FeaturePlaceholder(manifest['shape'])
+        else:
+            data = scipy.sparse.csr_matrix((arrays['data'],
+                                            arrays['indices'],
+                                            arrays['indptr']),
+                                           shape=tuple(manifest['shape']),
+                                           copy=False)
+        dpack = DataPack(edus=EduView(table),
+                         pairings=pairings,
+                         data=data,
+                         target=arrays['target'],
+                         labels=strings['labels'],
+                         vocab=strings['vocab'],
+                         graph=None)
+    return dpack
+
 # ---------------------------------------------------------------------
 # predictions
 # ---------------------------------------------------------------------
@@ -260,6 +839,15 @@ def write_predictions_output(dpack, predicted, filename):
     Write predictions to an output file whose format
     is documented in :doc:`../output`
     """
+    with open(filename, 'wb') as fout:
+        append_predictions_output(dpack, predicted, fout)
+
+
+def append_predictions_output(dpack, predicted, stream):
+    """
+    Write predictions to an already open (binary) output stream,
+    in the format used by :py:func:`write_predictions_output`
+    """
     links = {}
     for edu1, edu2, label in predicted:
         links[(edu1, edu2)] = label
@@ -273,11 +861,118 @@ def write_predictions_output(dpack, predicted, filename):
                links.get((edu1_id, edu2_id), UNRELATED)]
         return [x.encode('utf-8') for x in row]
 
+    writer = csv.writer(stream, dialect=csv.excel_tab)
+    # by convention the zeroth edu is the root node
+    for edu1, edu2 in dpack.pairings:
+        writer.writerow(mk_row(edu1, edu2))
+
+
+def write_prediction_labels(dpack, prediction, filename):
+    """
+    Write predictions given as a label number for each pairing
+    (eg. the `prediction` array of a weighted datapack, or its
+    `target`) to an output file, in the same format as
+    :py:func:`write_predictions_output`
+    """
     with open(filename, 'wb') as fout:
-        writer = csv.writer(fout, dialect=csv.excel_tab)
-        # by convention the zeroth edu is the root node
-        for edu1, edu2 in dpack.pairings:
-            writer.writerow(mk_row(edu1, edu2))
+        append_prediction_labels(dpack, prediction, fout)
+
+
+def _prediction_label_columns(dpack, prediction):
+    """
+    Predictions given as a label number for each pairing, as
+    columns of numbers (source and target EDU, label) into the
+    lists of EDU ids and labels involved
+
+    :rtype: ([string], [string], array(int), array(int), array(int))
+    """
+    pairings = Pairings.from_list(dpack.pairings)
+    rows, inverse = np.unique(np.concatenate([pairings.sources,
+                                              pairings.targets]),
+                              return_inverse=True)
+    edus = pairings.table.edus
+    ids = [edus[r].id for r in rows.tolist()]
+    num_pairs = len(pairings.sources)
+    return (ids, list(dpack.labels),
+            inverse[:num_pairs], inverse[num_pairs:],
+            np.asarray(prediction, dtype=np.int64))
+
+
+def append_prediction_labels(dpack, prediction, stream):
+    """
+    Write predictions given as a label number for each pairing
+    to an already open (binary) output stream (see
+    :py:func:`write_prediction_labels`)
+
+    The EDU ids and labels are only turned into strings here,
+    once each
+    """
+    ids, labels, src, tgt, lbl = _prediction_label_columns(dpack,
+                                                           prediction)
+    ids = [x.encode('utf-8') for x in ids]
+    labels = [l.encode('utf-8') for l in labels]
+    writer = csv.writer(stream, dialect=csv.excel_tab)
+    writer.writerows([ids[i], ids[j], labels[l]] for i, j, l in
+                     zip(src.tolist(), tgt.tolist(), lbl.tolist()))
+
+
+_OUTPUT_BUFSIZE = 1 << 20
+
+
+def _write_binary_predictions(docs, filename):
+    """
+    Write predictions for a sequence of documents to a numpy
+    archive (see :py:func:`write_document_predictions`)
+    """
+    ids = []
+    label_index = {}
+    columns = []
+    for dpack, prediction in docs:
+        d_ids, d_labels, src, tgt, lbl = \
+            _prediction_label_columns(dpack, prediction)
+        d_lbl = np.array([label_index.setdefault(l, len(label_index))
+                          for l in d_labels], dtype=np.int64)
+        offset = len(ids)
+        ids.extend(d_ids)
+        columns.append((src + offset, tgt + offset, d_lbl[lbl]))
+    labels = sorted(label_index, key=label_index.get)
+    if columns:
+        src, tgt, lbl = [np.concatenate(c) for c in zip(*columns)]
+    else:
+        src, tgt, lbl = [np.zeros(0, dtype=np.int64)] * 3
+    with open(filename, 'wb') as stream:
+        np.savez_compressed(stream,
+                            ids=np.array(ids, dtype=np.unicode_),
+                            labels=np.array(labels, dtype=np.unicode_),
+                            src=src, tgt=tgt, lbl=lbl)
+
+
+def write_document_predictions(docs, filename):
+    """
+    Write the predictions for a sequence of documents (pairs of
+    datapack and label number for each pairing, eg. as returned
+    by a decoder) to a single output file, in the given order
+
+    The format depends on the file extension: a numpy archive
+    if it ends with `.npz` (much quicker to read back), gzipped
+    if it ends with `.gz`, and otherwise the usual tab-delimited
+    format (see :doc:`../output`). In all cases, it can be read
+    back with :py:func:`load_predictions`
+
+    Parameters
+    ----------
+    docs: iterable((DataPack, array(int)))
+    """
+    if filename.endswith('.npz'):
+        _write_binary_predictions(docs, filename)
+        return
+    elif filename.endswith('.gz'):
+        stream = gzip.open(filename, 'wb')
+    else:
+        stream = open(filename, 'wb', _OUTPUT_BUFSIZE)
+    with stream:
+        for dpack, prediction in docs:
+            append_prediction_labels(dpack, prediction, stream)
 
 
 def load_predictions(edu_file):
@@ -285,6 +980,9 @@ def load_predictions(edu_file):
     Read back predictions (see :doc:`../output`), returning a list
     of triples: parent id, child id, relation label (or 'UNRELATED')
 
+    The file may also be gzipped or a numpy archive (see
+    :py:func:`write_document_predictions`)
+
     :rtype: [(string, string, string)]
     """
     def mk_pair(row):
@@ -300,7 +998,18 @@ def load_predictions(edu_file):
                                           row=row))
         return tuple(x.decode('utf-8') for x in row)
 
-    with open(edu_file, 'rb') as instream:
+    if edu_file.endswith('.npz'):
+        with np.load(edu_file) as archive:
+            ids = archive['ids']
+            labels = archive['labels']
+            return list(zip(ids[archive['src']].tolist(),
+                            ids[archive['tgt']].tolist(),
+                            labels[archive['lbl']].tolist()))
+    elif edu_file.endswith('.gz'):
+        instream = gzip.open(edu_file, 'rb')
+    else:
+        instream = open(edu_file, 'rb')
+    with instream:
         reader = csv.reader(instream, dialect=csv.excel_tab)
         return [mk_pair(r) for r in reader if r]
 
@@ -315,9 +1024,7 @@ def load_gold_predictions(pairings_file, feature_file, verbose=False):
     pairings = load_pairings(pairings_file)
     with Torpor("Reading features", quiet=not verbose):
         labels = load_labels(feature_file)
-        # pylint: disable=unbalanced-tuple-unpacking
-        _, targets = load_svmlight_file(feature_file)
-        # pylint: enable=unbalanced-tuple-unpacking
+        targets = load_svmlight_targets(feature_file)
     return [(x1, x2, get_label_string(labels, t))
             for ((x1, x2), t) in zip(pairings, targets)]
 
@@ -4,18 +4,20 @@ for the possibility of structured prediction.
 """
 
 from __future__ import print_function
+from collections import namedtuple
+from multiprocessing.sharedctypes import RawArray
+import multiprocessing
 import sys
 import time
-from collections import defaultdict, namedtuple
-from numpy.linalg import norm
+
+from joblib import cpu_count
 from numpy import dot, zeros, sign
 from scipy.sparse import csr_matrix
 from scipy.special import expit  # aka the logistic function
 import numpy as np
 
-from attelo.decoding.util import (prediction_to_triples)
-from attelo.metrics.tree import tree_loss
-from attelo.table import (Graph, UNKNOWN)
+from attelo.table import (DataPack, Graph, Pairings, UNKNOWN, UNRELATED)
+from attelo.util import (mk_rng)
 
 # pylint: disable=too-few-public-methods
 # pylint: disable=invalid-name
@@ -57,15 +59,52 @@ class PerceptronArgs(namedtuple('PerceptronArgs',
 # pylint: enable=too-few-public-methods
 
 
+def _canonical_csr(X):
+    """ The feature matrix in CSR format, with no duplicate
+    entries in any row (so that we can use the indices of a row
+    for fancy-indexed updates) """
+    X = csr_matrix(X)
+    if not X.has_canonical_format:
+        X = X.copy()
+        X.sum_duplicates()
+    return X
+
+
 class Perceptron(object):
-    """ Vanilla binary perceptron learner """
-    def __init__(self, pconfig):
+    """ Vanilla binary perceptron learner
+
+    Training only ever touches the weights for the nonzero
+    features of the current instance (walking the CSR `indptr` and
+    `indices` arrays directly), and uses the lazy averaging trick:
+    rather than adding the whole weight vector to a running sum
+    after each instance, we keep an accumulator of updates scaled
+    by the time step they were made at, from which we recover the
+    sum of all weight vectors at the end. So each instance costs
+    O(nnz) rather than O(d).
+
+    :param shuffle: visit the instances in a (seeded) random order
+                    on each iteration
+    :type shuffle: bool
+
+    :param epoch_size: if set, each iteration is a mini-epoch over
+                       a random sample of this many instances
+                       (implies shuffle)
+    :type epoch_size: int or None
+
+    :param rng: random number generator for shuffling (default:
+                hard-seeded, see :py:func:`attelo.util.mk_rng`)
+    :type rng: :py:class:random.Random:
+    """
+    def __init__(self, pconfig, shuffle=False, epoch_size=None, rng=None):
         self.nber_it = pconfig.iterations
         self.avg = pconfig.averaging
         self.use_prob = pconfig.use_prob
         self.weights = None
         self.avg_weights = None
         self.can_predict_proba = False
+        self.shuffle = shuffle or epoch_size is not None
+        self.epoch_size = epoch_size
+        self.rng = rng if rng is not None else mk_rng()
         return
     
     def fit(self, X, Y): # X contains all EDU pairs for corpus
@@ -91,44 +130,71 @@ class Perceptron(object):
         self.avg_weights = zeros(dim, 'd')
         return
 
+    def _epoch_order(self, num_items):
+        """ order in which to visit the instances in an iteration """
+        if not self.shuffle:
+            return xrange(num_items)
+        size = num_items if self.epoch_size is None else\
+            min(self.epoch_size, num_items)
+        return self.rng.sample(xrange(num_items), size)
+
     def learn(self, X, Y):
         start_time = time.time()
         print("-"*100, file=sys.stderr)
         print("Training...", file=sys.stderr)
+        X = _canonical_csr(X)
+        Y = np.asarray(Y, dtype='d')
+        indptr = X.indptr
+        indices = X.indices
+        values = X.data
+        sq_norms = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+        W = self.weights
+        # lazy averaging: the sum of weight vectors after steps 1..T
+        # is (T+1) W - U, where U accumulates each update times the
+        # step it was made at
+        U = zeros(len(W), 'd')
+        step = 0
         nber_it = self.nber_it
         for n in xrange(nber_it):
             print("it. %3s \t" % n, file=sys.stderr)
             loss = 0.0
             t0 = time.time()
             inst_ct = 0
-            for i in xrange(X.shape[0]):
-                X_i = X[i]
-                Y_i = Y[i]
+            for i in self._epoch_order(X.shape[0]):
                 inst_ct += 1
-                sys.stderr.write("%s" %"\b"*len(str(inst_ct))+str(inst_ct))
-                Y_hat, score = self._classify(X_i, self.weights)
-                loss += self.update(Y_hat, Y_i, X_i, score)
+                step += 1
+                idx = indices[indptr[i]:indptr[i+1]]
+                X_i = values[indptr[i]:indptr[i+1]]
+                Y_i = Y[i]
+                score = float(dot(W[idx], X_i))
+                coef, inst_loss = self.update(sign(score), Y_i, score,
+                                              sq_norms[i])
+                loss += inst_loss
+                if coef != 0:
+                    W[idx] += coef * X_i
+                    U[idx] += (step * coef) * X_i
             if inst_ct > 0:
                 loss = loss / float(inst_ct)
             t1 = time.time()
             print("\tavg loss = %-7s" % round(loss, 6), file=sys.stderr)
             print("\ttime = %-4s" % round(t1-t0, 3), file=sys.stderr)
-        elapsed_time = t1-start_time
+        self.weights = W
+        if self.avg:
+            self.avg_weights = self.avg_weights + (step + 1) * W - U
+        elapsed_time = time.time()-start_time
         print("done in %s sec." % round(elapsed_time, 3), file=sys.stderr)
         return
 
 
-    def update(self, Y_j_hat, Y_j, X_j, score, rate=1.0):
-        """ simple perceptron update rule"""
-        X_j = X_j.toarray()
+    def update(self, Y_j_hat, Y_j, score, sq_norm, rate=1.0):
+        """ simple perceptron update rule
+
+        :returns: the coefficient by which to add the instance
+                  features to the weights, and the loss
+        :rtype: (float, float)
+        """
         error = (Y_j_hat != Y_j)
-        W = self.weights
-        if error:
-            W = W + rate * Y_j * X_j
-            self.weights = W
-        if self.avg:
-            self.avg_weights = self.avg_weights +  W
-        return int(error)
+        return (rate * Y_j if error else 0.0), int(error)
 
 
     def _classify(self, X, W):
@@ -152,13 +218,13 @@ class PassiveAggressive(Perceptron):
     C=inf parameter makes it equivalent to simple PA.
     """
 
-    def __init__(self, pconfig):
-        Perceptron.__init__(self, pconfig)
+    def __init__(self, pconfig, **kwargs):
+        Perceptron.__init__(self, pconfig, **kwargs)
         self.aggressiveness = pconfig.aggressiveness
         return
 
 
-    def update(self, Y_j_hat, Y_j, X_j, score):
+    def update(self, Y_j_hat, Y_j, score, sq_norm):
         r"""PA-II update rule
 
         .. math::
@@ -174,34 +240,39 @@ class PassiveAggressive(Perceptron):
 
            margin =  y (w \cdot x)
         """
-        X_j = X_j.toarray()
-        W = self.weights
         C = self.aggressiveness
         margin = Y_j * score
         loss = 0.0
         if margin < 1.0:
             loss = 1.0-margin
-        norme = norm(X_j)
-        if norme != 0:
-            tau = loss / float(norme**2)
+        tau = 0.0
+        if sq_norm != 0:
+            tau = loss / float(sq_norm)
         tau = min(C, tau)
-        W = W + tau * Y_j * X_j
-        self.weights = W
-        if self.avg:
-            self.avg_weights = self.avg_weights +  W
-        return loss
+        return tau * Y_j, loss
 
 
 
 
 class StructuredPerceptron(Perceptron):
     """ Perceptron classifier (in primal form) for structured
-    problems."""
+    problems.
+
+    :param n_jobs: if more than 1, train with iterative parameter
+                   mixing (McDonald et al. 2010): the training
+                   documents are split into this many shards, each
+                   processed by a worker process on every iteration,
+                   and the shard weights are averaged between
+                   iterations (-1 for as many shards as CPUs,
+                   -2 for one fewer, etc)
+    :type n_jobs: int
+    """
 
 
-    def __init__(self, decoder, pconfig):
+    def __init__(self, decoder, pconfig, n_jobs=1):
         Perceptron.__init__(self, pconfig)
         self.decoder = decoder
+        self.n_jobs = n_jobs
         return
 
     def init_model(self, dim):
@@ -219,86 +290,130 @@ class StructuredPerceptron(Perceptron):
     def predict_score(self, dpack):
         return self.decision_function(dpack.data)
 
+    def _training_docs(self, datapacks):
+        """ everything about the training documents that stays the
+        same from one iteration to the next: the document itself,
+        ready to be decoded (with columnar pairings, which the
+        decoders number the EDUs of only once, and constant unknown
+        label weights and predictions), its feature matrix, and the
+        indices of its gold edges (pairings with a target of +1)
+
+        :rtype: [(DataPack, csr_matrix, array(int))]
+        """
+        docs = []
+        for dpack in datapacks:
+            num_items = len(dpack)
+            # unlabelled
+            unk = dpack.label_number(UNKNOWN)
+            label = np.zeros((num_items, len(dpack.labels)))
+            label[:, unk] = 1.0
+            prediction = np.empty(num_items)
+            prediction[:] = unk
+            graph = Graph(prediction=prediction,
+                          attach=np.zeros(num_items),
+                          label=label)
+            fields = dpack._asdict()
+            fields['pairings'] = Pairings.from_list(dpack.pairings)
+            dpack = DataPack(**fields).set_graph(graph)
+            docs.append((dpack, _canonical_csr(dpack.data),
+                         np.flatnonzero(dpack.target == 1)))
+        return docs
+
+    def _epoch(self, docs, W, U, step):
+        """ a single pass over the given documents, updating the
+        weights `W` and lazy averaging accumulator `U` (see
+        `Perceptron.learn`) in place
+
+        :returns: total loss and the time step we end at
+        :rtype: (float, int)
+        """
+        loss = 0.0
+        inst_ct = 0
+        for dpack, X, ref_idx in docs:
+            inst_ct += 1
+            step += 1
+            sys.stderr.write("%s" %"\b"*len(str(inst_ct))+str(inst_ct))
+            # predict tree based on current weight vector
+            pred_idx = self._classify(dpack, X, W)
+            delta_idx, delta_vals = _phi_difference(X, ref_idx, pred_idx)
+            margin = float(dot(W[delta_idx], delta_vals))
+            coef, doc_loss = self.update(_tree_loss(ref_idx, pred_idx),
+                                         margin,
+                                         float(dot(delta_vals, delta_vals)))
+            loss += doc_loss
+            if coef != 0:
+                W[delta_idx] += coef * delta_vals
+                U[delta_idx] += (step * coef) * delta_vals
+        return loss, step
+
     def learn(self, datapacks):
         start_time = time.time()
         print("-"*100, file=sys.stderr)
         print("Training struct. perc...", file=sys.stderr)
-        for n in range(self.nber_it):
-            print("it. %3s \t" % n, file=sys.stderr)
-            loss = 0.0
-            t0 = time.time()
-            inst_ct = 0
-            for dpack in datapacks:
-                inst_ct += 1
-                sys.stderr.write("%s" %"\b"*len(str(inst_ct))+str(inst_ct))
-                # extract data and target
-                X = dpack.data # each row is EDU pair
-                Y = dpack.target # each row is {-1,+1}
-                # construct ref graph and mapping {edu_pair => index in X}
-                ref_tree = []
-                fv_index_map = {}
-                for i, (edu1, edu2) in enumerate(dpack.pairings):
-                    fv_index_map[edu1.id, edu2.id] = i
-                    if Y[i] == 1:
-                        ref_tree.append((edu1.id, edu2.id, UNKNOWN))
-                # predict tree based on current weight vector
-                pred_tree = self._classify(dpack, X, self.weights)
-                # print doc_id,  predicted_graph
-                loss += self.update(pred_tree, ref_tree, X, fv_index_map)
-            # print(inst_ct,, file=sys.stderr)
-            avg_loss = loss / float(inst_ct)
-            t1 = time.time()
-            print("\tavg loss = %-7s" % round(avg_loss, 6), file=sys.stderr)
-            print("\ttime = %-4s" % round(t1-t0, 3), file=sys.stderr)
-        elapsed_time = t1-start_time
+        docs = self._training_docs(datapacks)
+        n_jobs = self.n_jobs
+        if n_jobs < 0:
+            n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+        n_jobs = min(n_jobs, len(docs))
+        if n_jobs > 1:
+            _IterativeParameterMixing(self, docs, n_jobs).learn()
+        else:
+            W = self.weights
+            # lazy averaging (see Perceptron.learn)
+            U = zeros(len(W), 'd')
+            step = 0
+            for n in range(self.nber_it):
+                print("it. %3s \t" % n, file=sys.stderr)
+                t0 = time.time()
+                loss, step = self._epoch(docs, W, U, step)
+                # print(inst_ct,, file=sys.stderr)
+                avg_loss = loss / float(len(docs))
+                t1 = time.time()
+                print("\tavg loss = %-7s" % round(avg_loss, 6),
+                      file=sys.stderr)
+                print("\ttime = %-4s" % round(t1-t0, 3), file=sys.stderr)
+            self.weights = W
+            if self.avg:
+                self.avg_weights = self.avg_weights + (step + 1) * W - U
+        elapsed_time = time.time()-start_time
         print("done in %s sec." % round(elapsed_time, 3), file=sys.stderr)
         return
 
-    def update(self, pred_tree, ref_tree, X, fv_map, rate=1.0):
-        # rt = [(t[0].span(),t[1].span()) for t in ref_tree]
-        # pt = [(t[0].span(),t[1].span()) for t in pred_tree]
-        # print("REF TREE:", rt)
-        # print("PRED TREE:", pt)
-        # print("INTER:", set(pt) & set(rt))
-        W = self.weights
-        # print("IN W:", W)
-        # error = not( set(pred_tree) == set(ref_tree) )
-        loss = tree_loss( ref_tree, pred_tree )
-        if loss != 0:
-            ref_fv = zeros(len(W), 'd')
-            pred_fv = zeros(len(W), 'd')
-            for ref_arc in ref_tree:
-                id1, id2, _ = ref_arc
-                ref_fv = ref_fv + X[fv_map[id1, id2]].toarray()
-            for pred_arc in pred_tree:
-                id1, id2, _ = pred_arc
-                pred_fv = pred_fv + X[fv_map[id1, id2]].toarray()
-            W = W + rate * (ref_fv - pred_fv)
-        # print("OUT W:", W)
-        self.weights = W
-        if self.avg:
-            self.avg_weights = self.avg_weights + W
-        return loss
+    def update(self, loss, margin, sq_norm, rate=1.0):
+        """ structured perceptron update rule: move towards the
+        reference tree if the predicted one is wrong
+
+        :param loss: tree loss of the predicted tree
+        :param margin: W . (Phi(x,y) - Phi(x,y^))
+        :param sq_norm: ||Phi(x,y) - Phi(x,y^)||^2
+
+        :returns: the coefficient by which to add the feature
+                  difference to the weights, and the loss
+        :rtype: (float, float)
+        """
+        return (rate if loss != 0 else 0.0), loss
 
 
     def _classify(self, dpack, X, W):
-        """ return predicted tree """
+        """ return predicted tree (as indices of the attached
+        pairings) for a training document (see `_training_docs`);
+        only the attachment scores change from one call to the
+        next """
         decoder = self.decoder
-        num_items = len(dpack)
         scores = X.dot(W.T) # TODO: should this be self.decision_function?
-        scores = scores.reshape(num_items) # lose 2nd dimension (shape[1] == 1)
-        # unlabelled
-        unk = dpack.label_number(UNKNOWN)
-        label = np.zeros((num_items, len(dpack.labels)))
-        label[:, unk] = 1.0
-        prediction = np.empty(num_items)
-        prediction[:] = unk
-        dpack = dpack.set_graph(Graph(prediction=prediction,
-                                      attach=scores,
-                                      label=label))
+        # (the graph and datapack were checked in _training_docs)
+        graph = dpack.graph.tweak(attach=scores)
+        dpack = DataPack(edus=dpack.edus,
+                         pairings=dpack.pairings,
+                         data=dpack.data,
+                         target=dpack.target,
+                         labels=dpack.labels,
+                         vocab=dpack.vocab,
+                         graph=graph)
         # print "SCORES:", scores
         graph = decoder.transform(dpack)
-        return prediction_to_triples(graph)
+        return np.flatnonzero(graph.graph.prediction !=
+                              graph.label_number(UNRELATED))
 
 
 
@@ -308,13 +423,13 @@ class StructuredPassiveAggressive(StructuredPerceptron):
     problems."""
 
 
-    def __init__(self, decoder, pconfig):
-        StructuredPerceptron.__init__(self, decoder, pconfig)
+    def __init__(self, decoder, pconfig, n_jobs=1):
+        StructuredPerceptron.__init__(self, decoder, pconfig, n_jobs=n_jobs)
         self.aggressiveness = pconfig.aggressiveness
         return
 
 
-    def update(self, pred_tree, ref_tree, X, fv_map):
+    def update(self, loss, margin, sq_norm, rate=1.0):
         r"""PA-II update rule:
 
         .. math::
@@ -330,35 +445,128 @@ class StructuredPassiveAggressive(StructuredPerceptron):
 
             margin =  w \cdot (\Phi(x,y)-\Phi(x-\hat{y}))
         """
-        W = self.weights
         C = self.aggressiveness
-        # compute Phi(x,y) and Phi(x,y^)
-        ref_fv = zeros(len(W), 'd')
-        pred_fv = zeros(len(W), 'd')
-        for ref_arc in ref_tree:
-            id1, id2, _ = ref_arc
-            ref_fv = ref_fv + X[fv_map[id1, id2]].toarray()
-        for pred_arc in pred_tree:
-            id1, id2, _ = pred_arc
-            pred_fv = pred_fv + X[fv_map[id1, id2]].toarray()
-        # find tau
-        delta_fv = ref_fv-pred_fv
-        margin = float(dot(W, delta_fv.T))
         loss = 0.0
         tau = 0.0
         if margin < 1.0:
             loss = 1.0-margin
-        norme = norm(delta_fv)
-        if norme != 0:
-            tau = loss / float(norme**2)
+        if sq_norm != 0:
+            tau = loss / float(sq_norm)
         tau = min(C, tau)
-        # update
-        W = W + tau * delta_fv
-        self.weights = W
-        if self.avg:
-            self.avg_weights = self.avg_weights + W
+        return tau, loss
+
+
+# the training run that worker processes belong to; they inherit
+# it when the pool is forked (so the learner and documents are
+# never pickled), and the weights go through shared memory
+_IPM_RUN = None
+
+
+def _ipm_shard_epoch(shard):
+    """ (worker process) one pass over a shard of the training
+    documents, starting from the current mixed weights
+
+    :rtype: float (total loss)
+    """
+    return _IPM_RUN.shard_epoch(shard)
+
+
+class _IterativeParameterMixing(object):
+    """ Parallel training of a structured perceptron by iterative
+    parameter mixing: on each iteration, every shard of documents
+    is trained on (in its own process) from the same starting
+    weights, and we then average the weights of each shard
+
+    The starting weights, and the weights and the (lazy) averaging
+    sums of each shard, are kept in shared memory arrays
+    """
+    def __init__(self, learner, docs, num_shards):
+        self.learner = learner
+        self.shards = [docs[i::num_shards] for i in range(num_shards)]
+        dim = len(learner.weights)
+        self.weights = _shared_array((dim,))
+        self.shard_weights = _shared_array((num_shards, dim))
+        self.shard_sums = _shared_array((num_shards, dim))
+
+    def shard_epoch(self, shard):
+        """ train on a shard, writing its resulting weights and
+        (if averaging) the sum of its weights after each document
+        to shared memory """
+        W = self.weights.copy()
+        U = zeros(len(W), 'd')
+        loss, step = self.learner._epoch(self.shards[shard], W, U, 0)
+        self.shard_weights[shard] = W
+        if self.learner.avg:
+            # (see Perceptron.learn; we start from nonzero weights)
+            self.shard_sums[shard] = (step + 1) * W - U - self.weights
         return loss
 
+    def learn(self):
+        """ run the training iterations, and set the learner
+        weights """
+        global _IPM_RUN  # pylint: disable=global-statement
+        learner = self.learner
+        self.weights[:] = learner.weights
+        avg_weights = zeros(len(learner.weights), 'd')
+        _IPM_RUN = self
+        pool = multiprocessing.Pool(len(self.shards))
+        try:
+            for n in range(learner.nber_it):
+                print("it. %3s \t" % n, file=sys.stderr)
+                t0 = time.time()
+                losses = pool.map(_ipm_shard_epoch, range(len(self.shards)))
+                self.weights[:] = self.shard_weights.mean(axis=0)
+                if learner.avg:
+                    avg_weights += self.shard_sums.mean(axis=0)
+                avg_loss = sum(losses) / float(sum(len(x)
+                                                   for x in self.shards))
+                t1 = time.time()
+                print("\tavg loss = %-7s" % round(avg_loss, 6),
+                      file=sys.stderr)
+                print("\ttime = %-4s" % round(t1-t0, 3), file=sys.stderr)
+        finally:
+            pool.close()
+            pool.join()
+            _IPM_RUN = None
+        learner.weights = np.array(self.weights)
+        if learner.avg:
+            learner.avg_weights = learner.avg_weights + avg_weights
+
+
+def _shared_array(shape):
+    """ a zero-filled array of doubles in shared memory (visible
+    to, and writable by, forked worker processes) """
+    size = int(np.prod(shape))
+    return np.frombuffer(RawArray('d', size), dtype='d').reshape(shape)
+
+
+def _tree_loss(ref_idx, pred_idx):
+    """ :py:func:`attelo.metrics.tree.tree_loss` on trees given as
+    arrays of pairing indices """
+    if not len(ref_idx):
+        return 0.0 if not len(pred_idx) else 1.0
+    common = np.intersect1d(ref_idx, pred_idx)
+    return 1.0 - len(common) / float(len(ref_idx))
+
+
+def _phi_difference(X, ref_idx, pred_idx):
+    """ Phi(x,y) - Phi(x,y^), ie. the sum of the feature vectors of
+    the reference edges minus that of the predicted ones, as a
+    single sparse row sum
+
+    :returns: the nonzero features and their values
+    :rtype: (array(int), array(float))
+    """
+    rows = np.concatenate([ref_idx, pred_idx])
+    coefs = np.concatenate([np.ones(len(ref_idx)),
+                            -np.ones(len(pred_idx))])
+    select = csr_matrix((coefs, (np.zeros(len(rows), dtype=np.int64), rows)),
+                        shape=(1, X.shape[0]))
+    delta = select.dot(X)
+    delta.sum_duplicates()
+    delta.eliminate_zeros()
+    return delta.indices, delta.data
+
 
 def _score(w_vect, feat_vect, use_prob=False):
     score = dot(w_vect, feat_vect)
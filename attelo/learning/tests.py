@@ -0,0 +1,119 @@
+"""
+attelo.learning tests
+"""
+
+from __future__ import print_function
+import unittest
+
+import numpy as np
+import scipy.sparse
+
+from ..decoding.local import BestIncomingDecoder
+from ..decoding.tests import DecoderTest
+from ..table import DataPack
+from .perceptron import (PassiveAggressive,
+                         Perceptron,
+                         PerceptronArgs,
+                         StructuredPerceptron,
+                         _IterativeParameterMixing,
+                         _phi_difference)
+
+
+class PerceptronTest(unittest.TestCase):
+    """
+    Binary perceptron learners
+    """
+    X = scipy.sparse.csr_matrix(np.array([[1, 0, 2, 0],
+                                          [0, 1, 0, 0],
+                                          [1, 1, 0, 1],
+                                          [0, 0, 3, 1],
+                                          [2, 0, 0, 0]]))
+    Y = np.array([1, -1, -1, 1, 1])
+
+    def _dense_weights(self, learner):
+        """
+        The weights (and their sum after each instance) that we
+        would get by training the obvious way, on dense vectors
+        """
+        X = self.X.toarray()
+        W = np.zeros(X.shape[1])
+        W_sum = np.zeros(X.shape[1])
+        for _ in range(learner.nber_it):
+            for X_i, Y_i in zip(X, self.Y):
+                score = np.dot(W, X_i)
+                coef, _ = learner.update(np.sign(score), Y_i, score,
+                                         np.dot(X_i, X_i))
+                W = W + coef * X_i
+                W_sum = W_sum + W
+        return W, W_sum
+
+    def test_lazy_averaging(self):
+        'sparse training with lazy averaging == naive dense training'
+        args = PerceptronArgs(iterations=3,
+                              averaging=True,
+                              use_prob=False,
+                              aggressiveness=0.5)
+        for learner in [Perceptron(args), PassiveAggressive(args)]:
+            learner.fit(self.X, self.Y)
+            W, W_sum = self._dense_weights(learner)
+            np.testing.assert_allclose(learner.weights, W)
+            np.testing.assert_allclose(learner.avg_weights, W_sum)
+
+    def test_mini_epochs(self):
+        'mini-epochs visit a sample of the instances'
+        args = PerceptronArgs(iterations=2,
+                              averaging=False,
+                              use_prob=False,
+                              aggressiveness=np.inf)
+        learner = Perceptron(args, epoch_size=3)
+        order = list(learner._epoch_order(5))
+        self.assertEqual(len(order), 3)
+        self.assertEqual(len(set(order)), 3)
+        learner.fit(self.X, self.Y)
+
+
+class StructuredPerceptronTest(unittest.TestCase):
+    """
+    Structured perceptron learners
+    """
+    X = PerceptronTest.X
+
+    def test_phi_difference(self):
+        'sparse feature difference between reference and prediction'
+        ref_idx = np.array([0, 3])
+        pred_idx = np.array([0, 2, 4])
+        idx, vals = _phi_difference(self.X, ref_idx, pred_idx)
+        expected = (self.X[ref_idx].sum(axis=0) -
+                    self.X[pred_idx].sum(axis=0))
+        got = np.zeros(self.X.shape[1])
+        got[idx] = vals
+        np.testing.assert_allclose(got, np.ravel(expected))
+        self.assertTrue(np.all(vals != 0))
+
+    def test_parameter_mixing(self):
+        'parallel training by iterative parameter mixing'
+        fields = DecoderTest.dpack._asdict()
+        fields['target'] = np.array([1, -1, 1, -1, -1, 1])
+        dpacks = [DataPack(**fields)] * 3
+        args = PerceptronArgs(iterations=3,
+                              averaging=True,
+                              use_prob=False,
+                              aggressiveness=np.inf)
+        serial = StructuredPerceptron(BestIncomingDecoder(), args)
+        serial.fit(dpacks, None)
+        # with a single shard, this is just the serial algorithm
+        mixed = StructuredPerceptron(BestIncomingDecoder(), args)
+        mixed.init_model(dpacks[0].data.shape[1])
+        _IterativeParameterMixing(mixed,
+                                  mixed._training_docs(dpacks),
+                                  1).learn()
+        np.testing.assert_allclose(mixed.weights, serial.weights)
+        np.testing.assert_allclose(mixed.avg_weights, serial.avg_weights)
+        # with one document per shard (and worker process), each
+        # shard ends up with the same weights
+        parallel = StructuredPerceptron(BestIncomingDecoder(), args,
+                                        n_jobs=3)
+        parallel.fit(dpacks, None)
+        single = StructuredPerceptron(BestIncomingDecoder(), args)
+        single.fit(dpacks[:1], None)
+        np.testing.assert_allclose(parallel.weights, single.weights)
@@ -86,7 +86,7 @@ class State(with_metaclass(ABCMeta, object)):
         raise NotImplementedError
 
 
-class Search(with_metaclass(ABCMeta, object)):
+class BaseSearch(with_metaclass(ABCMeta, object)):
     """abstract class for search
     each state to be explored must have methods
 
@@ -94,8 +94,10 @@ class Search(with_metaclass(ABCMeta, object)):
     * :py:meth:`is_solution` - is the state a valid solution
     * :py:meth:`cost` - cost of the state so far (must be additive)
 
-    default is astar search (search the minimum cost from init state to a
-    solution
+    This holds what every search shares (heuristic, shared data,
+    seen states); how the states waiting to be explored are queued
+    is up to the subclass, see :py:class:`Search` and
+    :py:class:`BeamSearch`
 
     :param heuristic: heuristics guiding the search (applies to state-specific
                       data(), see :py:class:`State`)
@@ -103,24 +105,19 @@ class Search(with_metaclass(ABCMeta, object)):
     :param shared: other data shared by all nodes (eg. for heuristic
                    computation)
 
-    :param queue_size: limited beam-size to store states. (commented out,
-                       pending tests)
+    :param queue_size: limit on the number of states waiting to be
+                       explored (if the search has one)
     """
     def __init__(self,
                  heuristic=lambda x: 0.,
                  shared=None,
                  queue_size=None):
-        self._todo = []
         self._seen = {}
         self._h_func = heuristic
         self._shared = shared
         self._queue_size = queue_size
         self.iterations = 0
 
-    def reset_queue(self):
-        "Clear out the search queue"
-        self._todo = []
-
     def reset_seen(self):
         "Mark every state as not yet seen"
         self._seen = {}
@@ -134,6 +131,52 @@ class Search(with_metaclass(ABCMeta, object)):
         "Build a new state from the given data"
         raise NotImplementedError
 
+    def is_already_seen(self, state):
+        """
+        Return `True` if the given search state has already been seen
+        """
+        return hash(state) in self._seen
+
+    def add_seen(self, state):
+        """
+        Mark a state as seen
+        """
+        self._seen[hash(state)] = state
+
+    @abstractmethod
+    def launch(self, init_state,
+               verbose=False,
+               norepeat=False):
+        """launch search from initital state value, returning
+        a generator over the solutions found
+
+        :param: norepeat: there's no need for an "already seen states"
+                          datastructure
+        """
+        raise NotImplementedError
+
+
+class Search(BaseSearch):
+    """
+    astar search (search the minimum cost from init state to a
+    solution), the states to explore being kept in a priority queue
+
+    :param queue_size: limited beam-size to store states. (commented out,
+                       pending tests)
+    """
+    def __init__(self,
+                 heuristic=lambda x: 0.,
+                 shared=None,
+                 queue_size=None):
+        super(Search, self).__init__(heuristic=heuristic,
+                                     shared=shared,
+                                     queue_size=queue_size)
+        self._todo = []
+
+    def reset_queue(self):
+        "Clear out the search queue"
+        self._todo = []
+
     def add_queue(self, items, ancestor_cost):
         """
         Add a set of succesors to the search queue
@@ -161,18 +204,6 @@ class Search(with_metaclass(ABCMeta, object)):
         """
         return self._todo == []
 
-    def is_already_seen(self, state):
-        """
-        Return `True` if the given search state has already been seen
-        """
-        return hash(state) in self._seen
-
-    def add_seen(self, state):
-        """
-        Mark a state as seen
-        """
-        self._seen[hash(state)] = state
-
     def launch(self, init_state,
                verbose=False,
                norepeat=False):
@@ -222,10 +253,50 @@ class Search(with_metaclass(ABCMeta, object)):
         raise StopIteration
 
 
-class BeamSearch(Search):
+class _Beam(object):
+    """
+    Bounded priority queue: keeps the (at most) `size` best states
+    pushed into it, or all of them if `size` is None. We keep the
+    worst state at the top of a heap, so pushing costs O(log size).
+    Between states that are equally good, the first one pushed wins
+    """
+    def __init__(self, size):
+        self._size = size
+        self._heap = []
+        self._count = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, state):
+        "Add a state to the beam (if it is good enough)"
+        # higher is better (see State.__lt__)
+        item = (-state.total_cost(), state.cost(), -self._count, state)
+        self._count += 1
+        if self._size is None or len(self._heap) < self._size:
+            heapq.heappush(self._heap, item)
+        elif item[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, item)
+
+    def best_first(self):
+        "The states in the beam, best first"
+        return [item[-1] for item in sorted(self._heap, reverse=True)]
+
+
+class BeamSearch(BaseSearch):
     """
     search with heuristics but limited size waiting queue
     (restrict to p-best solutions at each iteration)
+
+    The search proceeds one depth at a time: we expand every state
+    in the current beam, keeping only the `queue_size` best of their
+    successors (by total cost) as the beam for the next depth. So
+    the work done is bounded by the depth of the solutions times the
+    beam size, but (unlike plain A*) the first solution we return is
+    not guaranteed to be the best one.
+
+    Solutions are returned as soon as their beam is reached, best
+    first.
     """
     def __init__(self,
                  heuristic=lambda x: 0.,
@@ -234,16 +305,64 @@ class BeamSearch(Search):
         super(BeamSearch, self).__init__(heuristic=heuristic,
                                          shared=shared,
                                          queue_size=queue_size)
+        self._todo = _Beam(self._queue_size)
 
-    def new_state(self, data):
-        raise NotImplementedError
+    def reset_queue(self):
+        "Start a new (empty) beam"
+        self._todo = _Beam(self._queue_size)
 
     def add_queue(self, items, ancestor_cost):
+        """
+        Add a set of succesors to the beam for the next depth
+
+        :type items [(data, float)]
+        """
         # each item must be a successor and a cost
         for one, cost in items:
             succ = self.new_state(one)
             succ.update_cost(ancestor_cost + cost)
-            heapq.heappush(self._todo, succ)
-        if self._queue_size is not None:
-            new = heapq.nsmallest(self._queue_size, self._todo)
-            self._todo = new
+            self._todo.push(succ)
+
+    def has_empty_queue(self):
+        """
+        Return `True` if the beam is empty
+        """
+        return len(self._todo) == 0
+
+    def launch(self, init_state,
+               verbose=False,
+               norepeat=False):
+        """launch search from initital state value
+
+        :param: norepeat: there's no need for an "already seen states"
+                          datastructure
+        """
+        self.reset_queue()
+        if not norepeat:
+            self.reset_seen()
+        self.add_queue([(init_state, 0)], 0.)
+        self.iterations = 0
+        depth = 0
+
+        while not self.has_empty_queue():
+            beam = self._todo.best_first()
+            self.reset_queue()
+            if verbose:
+                print("depth", depth, "beam=", beam)
+            for state in beam:
+                if not norepeat:
+                    if self.is_already_seen(state):
+                        if verbose:
+                            print('already seen', state)
+                        continue
+                self.iterations += 1
+                if state.is_solution():
+                    yield state
+                else:
+                    if not norepeat:
+                        self.add_seen(state)
+                    self.add_queue(state.next_states(), state.cost())
+            depth += 1
+
+        # if it comes to that,  there is no solution
+        raise StopIteration
@@ -4,9 +4,7 @@ is directed or not depends on the underlying datapack and decoder).
 You could also combine this with the label parser
 """
 
-from os import path as fp
-
-from attelo.io import (load_model, save_model)
+from attelo.io import (save_model)
 from attelo.table import (for_attachment)
 from .interface import (Parser)
 from .pipeline import (Pipeline)
@@ -49,17 +47,21 @@ class AttachClassifierWrapper(Parser):
         mpack : MultiPack
         """
         cache = cache or {}
-        cache_file = cache.get('attach')
-        if cache_file is not None and fp.exists(cache_file):
-            self._learner_attach = load_model(cache_file)
+        model = self.cached_model(cache, 'attach')
+        if model is not None:
+            self._learner_attach = model
             return self
         else:
             dpacks, targets = self.dzip(for_attachment, dpacks, targets)
             self._learner_attach.fit(dpacks, targets)
+            cache_file = cache.get('attach')
             if cache_file is not None:
                 save_model(cache_file, self._learner_attach)
             return self
 
+    def fitted_models(self):
+        return {'attach': self._learner_attach}
+
     def transform(self, dpack):
         attach_pack, _ = for_attachment(dpack, dpack.target)
         weights_a = self._learner_attach.predict_score(attach_pack)
@@ -2,11 +2,15 @@
 Basic interface that all parsers should respect
 """
 
+from os import path as fp
+
 import numpy as np
 
 from abc import ABCMeta, abstractmethod
 from six import with_metaclass
+import six
 
+from attelo.io import load_model
 from attelo.table import (Graph, UNKNOWN, UNRELATED)
 
 # pylint: disable=too-few-public-methods
@@ -141,10 +145,51 @@ class Parser(with_metaclass(ABCMeta, object)):
             cache. The typical cache value is a filepath containing
             a pickle to load or dump; but other objects may sometimes
             be used depending on the parser (eg. other caches if it's
-            a parser that somehow combines other parsers together)
+            a parser that somehow combines other parsers together).
+            Parsers that learn models also accept the already fitted
+            models themselves (see `fitted_models`), in which case
+            they just use them instead of learning anything
         """
         raise NotImplementedError
 
+    def fitted_models(self):
+        """
+        The models this parser has learned (once fitted), keyed
+        the same way as its cache (see `fit`). Fitting a parser
+        with the same cache keys on these
+
+            other.fit(dpacks, targets, cache=parser.fitted_models())
+
+        gives it the same models without learning anything again
+
+        Returns
+        -------
+        models: dict(string, object)
+        """
+        return {}
+
+    @staticmethod
+    def cached_model(cache, key):
+        """
+        Look up a submodel in a parser cache (see `fit`)
+
+        Returns
+        -------
+        model: object or None
+            the model, if the cache has one for this key (fitted,
+            or saved in a file that exists), None if we have
+            to learn it
+        """
+        entry = (cache or {}).get(key)
+        if entry is None:
+            return None
+        elif not isinstance(entry, six.string_types):
+            return entry
+        elif fp.exists(entry):
+            return load_model(entry)
+        else:
+            return None
+
 
     @abstractmethod
     def transform(self, dpack):
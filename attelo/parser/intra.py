@@ -211,6 +211,14 @@ class IntraInterParser(with_metaclass(ABCMeta, Parser)):
                                 cache=caches.inter)
         return self
 
+    def fitted_models(self):
+        models = {}
+        for prefix, parser in [('intra:', self._parsers.intra),
+                               ('inter:', self._parsers.inter)]:
+            for key, model in parser.fitted_models().items():
+                models[prefix + key] = model
+        return models
+
     def transform(self, dpack):
         # intrasentential target links are slightly different
         # in the fakeroot case (this only really matters if we
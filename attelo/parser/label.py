@@ -2,12 +2,10 @@
 Labelling
 """
 
-from os import path as fp
-
 import numpy as np
 
 from .interface import (Parser)
-from attelo.io import (load_model, save_model)
+from attelo.io import (save_model)
 from attelo.table import (UNKNOWN,
                           attached_only,
                           for_labelling)
@@ -47,18 +45,22 @@ class LabelClassifierWrapper(Parser):
         self: object
         """
         cache = cache or {}
-        cache_file = cache.get('label')
-        if cache_file is not None and fp.exists(cache_file):
-            self._learner = load_model(cache_file)
+        model = self.cached_model(cache, 'label')
+        if model is not None:
+            self._learner = model
             return self
         else:
             dpacks, targets = self.dzip(attached_only, dpacks, targets)
             dpacks, targets = self.dzip(for_labelling, dpacks, targets)
             self._learner.fit(dpacks, targets)
+            cache_file = cache.get('label')
             if cache_file is not None:
                 save_model(cache_file, self._learner)
             return self
 
+    def fitted_models(self):
+        return {'label': self._learner}
+
     def transform(self, dpack):
         dpack, _ = for_labelling(dpack, dpack.target)
         return self.multiply(dpack, label=self._learner.predict_score(dpack))
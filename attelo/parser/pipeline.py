@@ -25,6 +25,12 @@ class Pipeline(Parser):
         for parser in self._parsers:
             parser.fit(dpacks, targets, cache=cache)
 
+    def fitted_models(self):
+        models = {}
+        for parser in self._parsers:
+            models.update(parser.fitted_models())
+        return models
+
     def transform(self, dpack):
         for parser in self._parsers:
             dpack = parser.transform(dpack)
@@ -25,7 +25,9 @@ from attelo.decoding.window import (WindowPruner)
 from attelo.edu import EDU, FAKE_ROOT, FAKE_ROOT_ID
 from attelo.learning.local import (SklearnAttachClassifier,
                                    SklearnLabelClassifier)
-from attelo.learning.perceptron import (PerceptronArgs,
+from attelo.learning.perceptron import (PassiveAggressive,
+                                        Perceptron,
+                                        PerceptronArgs,
                                         StructuredPerceptron)
 from attelo.table import (DataPack)
 from attelo.util import (Team)
@@ -100,12 +102,37 @@ class ParserTest(DecoderTest):
                                    decoder=d)
             self._test_parser(parser)
 
+    def test_fitted_models(self):
+        'parsers can be fitted from the models of another'
+        def mk_parser():
+            'joint parser with fresh learners'
+            return JointPipeline(
+                learner_attach=SklearnAttachClassifier(LogisticRegression()),
+                learner_label=SklearnLabelClassifier(LogisticRegression()),
+                decoder=MST_DECODER)
+        parser = mk_parser()
+        parser.fit([self.dpack], [np.array([1, 2, 3, 1, 4, 3])])
+        models = parser.fitted_models()
+        self.assertEqual(sorted(models), ['attach', 'label'])
+        # no training data: we can only use the models we are given
+        other = mk_parser()
+        other.fit([], [], cache=models)
+        expected = parser.transform(self.dpack).graph.prediction
+        got = other.transform(self.dpack).graph.prediction
+        self.assertEqual(got.tolist(), expected.tolist())
+
     def test_postlabel_parser(self):
         learners = LEARNERS +\
             [
                  Team(attach=StructuredPerceptron(MST_DECODER,
                                                   LOCAL_PERC_ARGS),
                       label=SklearnLabelClassifier(LogisticRegression())),
+                 Team(attach=SklearnAttachClassifier(
+                     Perceptron(LOCAL_PERC_ARGS)),
+                      label=SklearnLabelClassifier(LogisticRegression())),
+                 Team(attach=SklearnAttachClassifier(
+                     PassiveAggressive(LOCAL_PERC_ARGS, epoch_size=4)),
+                      label=SklearnLabelClassifier(LogisticRegression())),
             ]
         for l, d in itr.product(learners, DECODERS):
             parser = PostlabelPipeline(learner_attach=l.attach,
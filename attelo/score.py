@@ -2,13 +2,12 @@
 Scoring decoding results
 '''
 
-from collections import (defaultdict, namedtuple)
+from collections import namedtuple
 
-import numpy
-from sklearn.metrics import confusion_matrix
+import numpy as np
 
-from .table import (UNRELATED,
-                    attached_only,
+from .table import (Pairings,
+                    UNRELATED,
                     get_label_string)
 
 # pylint: disable=too-few-public-methods
@@ -73,6 +72,28 @@ class EduCount(namedtuple('EduCount',
                         self.total + other.total)
 
 
+class Scores(namedtuple('Scores',
+                        ['edges',
+                         'edges_by_label',
+                         'edus',
+                         'confusion'])):
+    """
+    All the scores for a set of predictions
+    (see :py:func:`score_predictions`)
+
+    Parameters
+    ----------
+    edges: CountPair
+
+    edges_by_label: [(string, CountPair)] or None
+
+    edus: EduCount
+
+    confusion: array(int)
+    """
+    pass
+
+
 def select_in_pack(dpack, predictions):
     """Given some predictions, return only the ones that are
     in the given datapack.
@@ -89,44 +110,164 @@ def select_in_pack(dpack, predictions):
             if (id1, id2) in pairing_ids]
 
 
+def align_predictions(dpack, predictions):
+    """Given some predictions (triples of EDU ids and label),
+    return the number of the predicted label for each pairing
+    in the datapack (the UNRELATED label for pairings without
+    predictions; predictions outside of the datapack are
+    ignored)
+
+    If the predictions are already an array of label numbers,
+    we assume they are already aligned, and return them as is
+
+    :rtype: array(int)
+    """
+    if isinstance(predictions, np.ndarray):
+        return predictions
+    pred_map = {(id1, id2): rel for id1, id2, rel in predictions}
+    return dpack.label_numbers(pred_map.get((e1.id, e2.id), UNRELATED)
+                               for e1, e2 in dpack.pairings)
+
+
+def _edu_numbers(dpack):
+    """
+    Number the EDUs in a datapack (by id), returning the number
+    for each of the EDUs in `dpack.edus`, for the source and target
+    of each pairing, and how many numbers we used
+
+    Only the EDU table rows that the pairings use are looked at
+    (the table may be shared with the rest of the corpus)
+
+    :rtype: (array(int), array(int), array(int), int)
+    """
+    pairings = Pairings.from_list(dpack.pairings)
+    rows, src_idx, tgt_idx = pairings.edu_numbers()
+    table = pairings.table.edus
+    index = {}
+    row_numbers = np.fromiter((index.setdefault(table[r].id, len(index))
+                               for r in rows.tolist()),
+                              dtype=np.int64, count=len(rows))
+    edus = np.fromiter((index.setdefault(e.id, len(index))
+                        for e in dpack.edus),
+                       dtype=np.int64, count=len(dpack.edus))
+    return (edus, row_numbers[src_idx], row_numbers[tgt_idx],
+            len(index))
+
+
+def score_predictions(dpack, predictions, by_label=True):
+    """Compute all of the scores below (edges, edges by label if
+    `by_label` is True, EDUs, confusion matrix) in one go
+
+    The predictions are lined up with the pairings once, after
+    which everything is counted over arrays of label numbers
+
+    Predictions for pairs that are not in the datapack are ignored:
+    they do not count as predicted edges (this used to be the case
+    for :py:func:`score_edges` unless the predictions were filtered
+    with :py:func:`select_in_pack` first). Score against a datapack
+    with all of the candidate pairings if they should count
+
+    Parameters
+    ----------
+    predictions: [(string, string, string)] or array(int)
+        predicted edges, or predicted label numbers for each
+        pairing (see :py:func:`align_predictions`)
+
+    :rtype: :py:class:`Scores`
+    """
+    pred = np.asarray(align_predictions(dpack, predictions),
+                      dtype=np.int64)
+    gold = np.asarray(dpack.target, dtype=np.int64)
+    num_labels = len(dpack.labels)
+    unrelated = dpack.label_number(UNRELATED)
+    edus, sources, targets, num_edus = _edu_numbers(dpack)
+    g_attach = gold != unrelated
+    p_attach = pred != unrelated
+
+    # undirected: an edge is a pair of EDU numbers in some order
+    # (we count each pair once even if both directions occur)
+    u_edges = (np.minimum(sources, targets) * num_edus +
+               np.maximum(sources, targets))
+    u_gold = np.unique(u_edges[g_attach])
+    u_pred = np.unique(u_edges[p_attach])
+    undirected = Count(tpos_attach=len(np.intersect1d(u_gold, u_pred,
+                                                      assume_unique=True)),
+                       tpos_label=0,
+                       tpos_fpos=len(u_pred),
+                       tpos_fneg=len(u_gold))
+    both = g_attach & p_attach
+    directed = Count(tpos_attach=int(np.count_nonzero(both)),
+                     tpos_label=int(np.count_nonzero(both & (gold == pred))),
+                     tpos_fpos=int(np.count_nonzero(p_attach)),
+                     tpos_fneg=int(np.count_nonzero(g_attach)))
+    edges = CountPair(undirected=undirected, directed=directed)
+
+    edges_by_label = None
+    if by_label:
+        # the same counts, with labelled edges
+        ul_gold = np.unique(u_edges[g_attach] * num_labels + gold[g_attach])
+        ul_pred = np.unique(u_edges[p_attach] * num_labels + pred[p_attach])
+        ul_both = np.intersect1d(ul_gold, ul_pred, assume_unique=True)
+
+        def per_label(values):
+            'how many of each label'
+            return np.bincount(values, minlength=num_labels).tolist()
+
+        u_tpos = per_label(ul_both % num_labels)
+        u_fpos = per_label(ul_pred % num_labels)
+        u_fneg = per_label(ul_gold % num_labels)
+        d_tpos = per_label(gold[both & (gold == pred)])
+        d_fpos = per_label(pred[p_attach])
+        d_fneg = per_label(gold[g_attach])
+        edges_by_label = []
+        for lnum, label in enumerate(dpack.labels):
+            if label == UNRELATED:
+                continue
+            counts = CountPair(undirected=Count(tpos_attach=u_tpos[lnum],
+                                                tpos_label=0,
+                                                tpos_fpos=u_fpos[lnum],
+                                                tpos_fneg=u_fneg[lnum]),
+                               directed=Count(tpos_attach=d_tpos[lnum],
+                                              tpos_label=d_tpos[lnum],
+                                              tpos_fpos=d_fpos[lnum],
+                                              tpos_fneg=d_fneg[lnum]))
+            edges_by_label.append((label, counts))
+
+    # an EDU is wrong if any of the pairings pointing to it are
+    # wrong (attached or not; same label or not)
+    wrong_attach = np.bincount(targets[g_attach != p_attach],
+                               minlength=num_edus)[edus] > 0
+    wrong_label = np.bincount(targets[gold != pred],
+                              minlength=num_edus)[edus] > 0
+    edu_count = EduCount(correct_attach=int(np.count_nonzero(~wrong_attach)),
+                         correct_label=int(np.count_nonzero(~wrong_label)),
+                         total=len(dpack.edus))
+
+    # we want the confusion matrices to have the same shape regardless
+    # of what labels happen to be used in the particular fold
+    known = ((gold >= 0) & (gold < num_labels) &
+             (pred >= 0) & (pred < num_labels))
+    confusion = np.bincount(gold[known] * num_labels + pred[known],
+                            minlength=num_labels * num_labels)
+    confusion = confusion.reshape((num_labels, num_labels))
+
+    return Scores(edges=edges,
+                  edges_by_label=edges_by_label,
+                  edus=edu_count,
+                  confusion=confusion)
+
+
 def score_edges(dpack, predictions):
     """Count correctly predicted edges and labels
     Note that undirected label counts are undefined and
     hardcoded to 0
 
+    Predictions for pairs outside of the datapack are ignored
+    (see :py:func:`score_predictions`)
+
     :rtype: :py:class:`attelo.report.CountPair`
     """
-    att_pack, _ = attached_only(dpack, dpack.target)
-    dict_predicted = {(arg1, arg2): rel for arg1, arg2, rel in predictions
-                      if rel != UNRELATED}
-
-    # undirected
-    u_predicted = set(tuple(sorted((arg1, arg2)))
-                      for arg1, arg2 in dict_predicted)
-    u_gold = set(tuple(sorted((edu1.id, edu2.id)))
-                 for edu1, edu2 in att_pack.pairings)
-    undirected = Count(tpos_attach=len(u_gold & u_predicted),
-                       tpos_label=0,
-                       tpos_fpos=len(u_predicted),
-                       tpos_fneg=len(u_gold))
-
-    # directed
-    tpos_attach = 0
-    tpos_label = 0
-    for edu_pair, ref_label in zip(att_pack.pairings, att_pack.target):
-        edu1, edu2 = edu_pair
-        pred_label = dict_predicted.get((edu1.id, edu2.id))
-        if pred_label is not None:
-            tpos_attach += 1
-            if att_pack.label_number(pred_label) == ref_label:
-                tpos_label += 1
-    directed = Count(tpos_attach=tpos_attach,
-                     tpos_label=tpos_label,
-                     tpos_fpos=len(dict_predicted.keys()),
-                     tpos_fneg=len(att_pack.pairings))
-
-    return CountPair(undirected=undirected,
-                     directed=directed)
+    return score_predictions(dpack, predictions, by_label=False).edges
 
 
 def score_edus(dpack, predictions):
@@ -144,35 +285,7 @@ def score_edus(dpack, predictions):
 
     :rtype: :py:class:`EduCount`
     """
-
-    e_predictions = defaultdict(list)
-    for parent, edu, rel in predictions:
-        if rel == UNRELATED:
-            continue
-        e_predictions[edu].append((parent, dpack.label_number(rel)))
-
-    e_reference = defaultdict(list)
-    unrelated = dpack.label_number(UNRELATED)
-    for edu_pair, ref_label in zip(dpack.pairings, dpack.target):
-        if ref_label == unrelated:
-            continue
-        parent, edu = edu_pair
-        e_reference[edu.id].append((parent.id, int(ref_label)))
-
-    correct_attach = 0
-    correct_label = 0
-    for edu in dpack.edus:
-        pred = sorted(e_predictions.get(edu.id, []))
-        ref = sorted(e_reference.get(edu.id, []))
-        if [x[0] for x in pred] == [x[0] for x in ref]:
-            correct_attach += 1
-        if pred == ref:
-            correct_label += 1
-    assert correct_label <= correct_attach
-
-    return EduCount(correct_attach=correct_attach,
-                    correct_label=correct_label,
-                    total=len(dpack.edus))
+    return score_predictions(dpack, predictions, by_label=False).edus
 
 
 def score_edges_by_label(dpack, predictions):
@@ -184,32 +297,14 @@ def score_edges_by_label(dpack, predictions):
     folds, combining pre-existing scores for each label within
     the fold with its counterpart in the other folds
     """
-    predictions = [(e1, e2, r) for (e1, e2, r) in predictions
-                   if r != UNRELATED]
-
-    for label in dpack.labels:
-        if label == UNRELATED:
-            continue
-        label_num = dpack.label_number(label)
-        # pylint: disable=no-member
-        r_indices = numpy.where(dpack.target == label_num)[0]
-        # pylint: disable=no-member
-        r_dpack = dpack.selected(r_indices)
-        r_predictions = [(e1, e2, r) for (e1, e2, r) in predictions
-                         if r == label]
-        yield label, score_edges(r_dpack, r_predictions)
+    for label, counts in score_predictions(dpack, predictions).edges_by_label:
+        yield label, counts
 
 
 def build_confusion_matrix(dpack, predictions):
     """return a confusion matrix show predictions vs desired labels
     """
-    pred_target = [dpack.label_number(label) for _, _, label in predictions]
-    # we want the confusion matrices to have the same shape regardless
-    # of what labels happen to be used in the particular fold
-    # pylint: disable=no-member
-    labels = numpy.arange(0, len(dpack.labels))
-    # pylint: enable=no-member
-    return confusion_matrix(dpack.target, pred_target, labels)
+    return score_predictions(dpack, predictions, by_label=False).confusion
 
 
 def empty_confusion_matrix(dpack):
@@ -217,9 +312,7 @@ def empty_confusion_matrix(dpack):
     confusion matrix results
     """
     llen = len(dpack.labels)
-    # pylint: disable=no-member
-    return numpy.zeros((llen, llen), dtype=numpy.int32)
-    # pylint: disable=no-member
+    return np.zeros((llen, llen), dtype=np.int32)
 
 
 def discriminating_features(models, labels, vocab, top_n):
@@ -3,7 +3,8 @@ Manipulating data tables (taking slices, etc)
 """
 
 from __future__ import print_function
-from collections import defaultdict, namedtuple
+from collections import namedtuple, OrderedDict
+import numbers
 
 import numpy as np
 import scipy.sparse
@@ -29,6 +30,69 @@ class DataPackException(Exception):
         super(DataPackException, self).__init__(msg)
 
 
+class FeaturePlaceholder(object):
+    '''
+    Stands in for the feature matrix of a datapack that was loaded
+    without its features (see the `targets_only` option of
+    :py:func:`attelo.io.load_multipack`). Scoring and reporting only
+    ever look at pairings and targets, so this saves us from parsing
+    and holding on to the features in the first place.
+
+    It knows its shape and can be sliced, selected from and stacked
+    along with its datapack, but anything else that would need the
+    actual features raises a :py:class:`DataPackException`
+
+    Parameters
+    ----------
+    shape: (int, int)
+        shape of the feature matrix we are standing in for
+    '''
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+
+    def __getitem__(self, indices):
+        num_rows = self.shape[0]
+        if isinstance(indices, slice):
+            num_sel = len(range(*indices.indices(num_rows)))
+        else:
+            indices = np.asarray(indices)
+            if indices.dtype == np.bool_:
+                num_sel = int(np.count_nonzero(indices))
+            else:
+                num_sel = indices.size
+        return FeaturePlaceholder((num_sel, self.shape[1]))
+
+    @classmethod
+    def vstack(cls, blocks):
+        '''
+        Stack placeholders (or anything else with a shape: the
+        result is a placeholder all the same)
+        '''
+        blocks = list(blocks)
+        return cls((sum(b.shape[0] for b in blocks), blocks[0].shape[1]))
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            # keep pickle, copy and friends happy
+            raise AttributeError(name)
+        raise DataPackException('Features were not loaded for this '
+                                'datapack (targets-only mode); cannot '
+                                'access ' + name)
+
+    def __array__(self, *_):
+        raise DataPackException('Features were not loaded for this '
+                                'datapack (targets-only mode)')
+
+    def __getstate__(self):
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __repr__(self):
+        return 'FeaturePlaceholder(shape={})'.format(self.shape)
+
+
 class Graph(namedtuple('Graph',
                        'prediction attach label')):
     '''
@@ -102,6 +166,398 @@ class Graph(namedtuple('Graph',
                               label=label)
 
 
+class EduTable(object):
+    '''
+    Columnar view of a list of EDUs: alongside the EDUs themselves,
+    we keep (lazily computed) arrays of their attributes, so that
+    questions about pairings can be asked in bulk.
+
+    Groupings and subgroupings are represented by integer codes
+    (in order of first appearance); `None` is always coded as -1
+
+    Parameters
+    ----------
+    edus ([EDU])
+        the EDUs in this table (their row number is their index)
+    '''
+    def __init__(self, edus):
+        self.edus = list(edus)
+        self._columns = None
+        self._index = None
+
+    def __len__(self):
+        return len(self.edus)
+
+    @staticmethod
+    def _codes(values):
+        '''
+        Integer code for each value (None is -1), and the list
+        of distinct non-None values
+        '''
+        names = []
+        codemap = {None: -1}
+        codes = np.empty(len(values), dtype=np.int64)
+        for i, val in enumerate(values):
+            code = codemap.get(val)
+            if code is None:
+                code = len(names)
+                codemap[val] = code
+                names.append(val)
+            codes[i] = code
+        return codes, names
+
+    def _get_columns(self):
+        '''
+        Compute the attribute arrays if we have not done so already
+        '''
+        if self._columns is None:
+            grouping, grouping_names =\
+                self._codes([e.grouping for e in self.edus])
+            subgrouping, _ = self._codes([(e.grouping, e.subgrouping)
+                                          if e.subgrouping is not None
+                                          else None
+                                          for e in self.edus])
+            self._columns = {
+                'start': np.fromiter((e.start for e in self.edus),
+                                     dtype=np.int64, count=len(self.edus)),
+                'end': np.fromiter((e.end for e in self.edus),
+                                   dtype=np.int64, count=len(self.edus)),
+                'grouping': grouping,
+                'grouping_names': grouping_names,
+                'subgrouping': subgrouping,
+                'is_root': np.fromiter((e.id == FAKE_ROOT_ID
+                                        for e in self.edus),
+                                       dtype=np.bool_, count=len(self.edus))}
+        return self._columns
+
+    @property
+    def start(self):
+        "EDU start positions (array(int))"
+        return self._get_columns()['start']
+
+    @property
+    def end(self):
+        "EDU end positions (array(int))"
+        return self._get_columns()['end']
+
+    @property
+    def grouping(self):
+        "EDU grouping codes (array(int), see `grouping_names`)"
+        return self._get_columns()['grouping']
+
+    @property
+    def grouping_names(self):
+        "grouping names corresponding to each (non-negative) grouping code"
+        return self._get_columns()['grouping_names']
+
+    @property
+    def subgrouping(self):
+        '''
+        EDU subgrouping codes (array(int)); note that these
+        distinguish between subgroupings of the same name in
+        different groupings
+        '''
+        return self._get_columns()['subgrouping']
+
+    @property
+    def is_root(self):
+        "True for the fake root (array(bool))"
+        return self._get_columns()['is_root']
+
+    def row(self, edu_id):
+        '''
+        Row number for the EDU with the given id (None if there
+        is no such EDU in the table)
+        '''
+        if self._index is None:
+            self._index = {e.id: i for i, e in enumerate(self.edus)}
+        return self._index.get(edu_id)
+
+
+class EduView(object):
+    '''
+    A sequence of EDUs picked out from an :py:class:`EduTable`
+    by row number. This behaves like a list of EDUs, but lets
+    datapacks select subsets of their EDUs without touching
+    the EDUs themselves
+
+    Parameters
+    ----------
+    table (EduTable)
+        the table we point into (typically shared with the
+        datapack's pairings)
+    rows (array(int) or None)
+        row numbers in the table (None for the whole table)
+    '''
+    def __init__(self, table, rows=None):
+        self.table = table
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+        self.rows = rows
+
+    def indices(self):
+        '''
+        Row numbers for each EDU in the view
+        '''
+        if self.rows is None:
+            return np.arange(len(self.table), dtype=np.int64)
+        return self.rows
+
+    def as_list(self):
+        '''
+        The EDUs in this view as a list
+        '''
+        if self.rows is None:
+            return list(self.table.edus)
+        edus = self.table.edus
+        return [edus[i] for i in self.rows.tolist()]
+
+    def __len__(self):
+        if self.rows is None:
+            return len(self.table)
+        return len(self.rows)
+
+    def __iter__(self):
+        if self.rows is None:
+            return iter(self.table.edus)
+        return iter(self.as_list())
+
+    def __getitem__(self, key):
+        if self.rows is None:
+            return self.table.edus[key]
+        elif isinstance(key, numbers.Integral):
+            return self.table.edus[self.rows[key]]
+        else:
+            return [self.table.edus[i] for i in self.rows[key].tolist()]
+
+    def __eq__(self, other):
+        if isinstance(other, (EduView, list, tuple)):
+            return self.as_list() == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        return res if res is NotImplemented else not res
+
+    def __repr__(self):
+        return 'EduView({})'.format(repr(self.as_list()))
+
+
+def _stack_tables(tables):
+    '''
+    Given some EDU tables, return a single table covering all of
+    them, and the row offset for each input table (identical
+    tables are only included once)
+
+    :rtype (EduTable, [int])
+    '''
+    tables = list(tables)
+    first = tables[0]
+    if all(t is first for t in tables):
+        return first, [0] * len(tables)
+    seen = {}
+    edus = []
+    offsets = []
+    for table in tables:
+        if id(table) not in seen:
+            seen[id(table)] = len(edus)
+            edus.extend(table.edus)
+        offsets.append(seen[id(table)])
+    return EduTable(edus), offsets
+
+
+class Pairings(object):
+    '''
+    A sequence of EDU pairs, represented as two arrays of row
+    numbers in an :py:class:`EduTable`
+
+    This behaves like the list of `(EDU, EDU)` tuples it replaces
+    (the tuples are only built if somebody asks for them), but
+    also lets us work on whole columns at a time
+
+    Parameters
+    ----------
+    table (EduTable)
+        the EDUs we point into (may be shared with other
+        pairings, and may contain EDUs that are not used here)
+    sources (array(int))
+        row number of the first EDU of each pair
+    targets (array(int))
+        row number of the second EDU of each pair
+    '''
+    def __init__(self, table, sources, targets):
+        self.table = table
+        self.sources = np.asarray(sources, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int64)
+        self._list = None
+        self._edu_numbers = None
+
+    @classmethod
+    def from_list(cls, pairings, edus=None):
+        '''
+        Build columnar pairings from a list of `(EDU, EDU)` tuples.
+
+        If the list is already columnar, return it as is
+
+        Parameters
+        ----------
+        edus ([EDU] or None)
+            the EDUs to put into the table (EDUs mentioned in the
+            pairings but missing from this list are added to the
+            end of the table)
+        '''
+        if isinstance(pairings, Pairings):
+            return pairings
+        pairings = list(pairings)
+        table = list(edus) if edus is not None else []
+        index = {e.id: i for i, e in enumerate(table)}
+
+        def get_row(edu):
+            'row number for an EDU, adding it if need be'
+            row = index.get(edu.id)
+            if row is None:
+                row = len(table)
+                index[edu.id] = row
+                table.append(edu)
+            return row
+
+        sources = np.fromiter((get_row(e1) for e1, _ in pairings),
+                              dtype=np.int64, count=len(pairings))
+        targets = np.fromiter((get_row(e2) for _, e2 in pairings),
+                              dtype=np.int64, count=len(pairings))
+        return cls(EduTable(table), sources, targets)
+
+    @classmethod
+    def vstack(cls, pairings):
+        '''
+        Concatenate several sequences of pairings (if they do not
+        all share the same table, their tables are concatenated
+        too)
+        '''
+        pairings = [cls.from_list(p) for p in pairings]
+        if not pairings:
+            return cls(EduTable([]), [], [])
+        table, offsets = _stack_tables(p.table for p in pairings)
+        return cls(table,
+                   np.concatenate([p.sources + o
+                                   for p, o in zip(pairings, offsets)]),
+                   np.concatenate([p.targets + o
+                                   for p, o in zip(pairings, offsets)]))
+
+    def selected(self, indices):
+        '''
+        Return only the pairs at the given indices
+        (sharing the same EDU table)
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        return Pairings(self.table,
+                        self.sources[indices],
+                        self.targets[indices])
+
+    def edu_rows(self):
+        '''
+        Sorted table row numbers for all EDUs mentioned in
+        these pairings
+        '''
+        return np.union1d(self.sources, self.targets)
+
+    def edu_numbers(self):
+        '''
+        Number the EDUs mentioned in these pairings from 0 to n-1
+        (in the order of their table rows), returning the table row
+        for each EDU number, and the EDU numbers of the source and
+        target of each pair (built on first request)
+
+        :rtype: (array(int), array(int), array(int))
+        '''
+        if self._edu_numbers is None:
+            rows, inverse = np.unique(np.concatenate([self.sources,
+                                                      self.targets]),
+                                      return_inverse=True)
+            self._edu_numbers = (rows,
+                                 inverse[:len(self.sources)],
+                                 inverse[len(self.sources):])
+        return self._edu_numbers
+
+    def as_list(self):
+        '''
+        The pairings as a list of `(EDU, EDU)` tuples
+        (built on first request)
+        '''
+        if self._list is None:
+            edus = self.table.edus
+            self._list = [(edus[i], edus[j]) for i, j in
+                          zip(self.sources.tolist(), self.targets.tolist())]
+        return self._list
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __iter__(self):
+        return iter(self.as_list())
+
+    def __getitem__(self, key):
+        if isinstance(key, numbers.Integral):
+            edus = self.table.edus
+            return (edus[self.sources[key]], edus[self.targets[key]])
+        elif isinstance(key, slice):
+            return Pairings(self.table,
+                            self.sources[key],
+                            self.targets[key])
+        else:
+            return self.selected(key)
+
+    def __eq__(self, other):
+        if isinstance(other, (Pairings, list, tuple)):
+            return self.as_list() == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        return res if res is NotImplemented else not res
+
+    def __repr__(self):
+        return 'Pairings({})'.format(repr(self.as_list()))
+
+    def __getstate__(self):
+        # no need to ship the tuple view (or EDU numbers) around
+        state = self.__dict__.copy()
+        state['_list'] = None
+        state['_edu_numbers'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_edu_numbers', None)
+
+
+def _csr_rows_view(matrix, start, stop):
+    '''
+    Rows `start` to `stop` (exclusive) of a CSR matrix, sharing
+    its data and indices buffers
+    '''
+    lo_ptr = matrix.indptr[start]
+    hi_ptr = matrix.indptr[stop]
+    view = scipy.sparse.csr_matrix((stop - start, matrix.shape[1]),
+                                   dtype=matrix.dtype)
+    # we set the buffers by hand because the constructor would
+    # "prune" (copy) slices of arrays much bigger than themselves
+    view.data = matrix.data[lo_ptr:hi_ptr]
+    view.indices = matrix.indices[lo_ptr:hi_ptr]
+    view.indptr = matrix.indptr[start:stop + 1] - lo_ptr
+    return view
+
+
+def _vstack_data(blocks):
+    '''
+    Stack feature matrices (if any of them is a placeholder, so is
+    the result)
+    '''
+    if any(isinstance(b, FeaturePlaceholder) for b in blocks):
+        return FeaturePlaceholder.vstack(blocks)
+    return scipy.sparse.vstack(blocks)
+
+
 class DataPack(namedtuple('DataPack',
                           ['edus',
                            'pairings',
@@ -131,10 +587,11 @@ class DataPack(namedtuple('DataPack',
 
     Parameters
     ----------
-    edus (EDU)
+    edus ([EDU] or EduView)
         effectively a set of edus
-    pairings ([(EDU, EDU)])
-        edu pairs
+    pairings ([(EDU, EDU)] or Pairings)
+        edu pairs (either a plain list, or its columnar
+        equivalent)
     data 2D array(float)
         sparse matrix of features, each
         row corresponding to a pairing
@@ -186,9 +643,27 @@ class DataPack(namedtuple('DataPack',
         if not dpacks:
             raise ValueError('need non-empty list of datapacks')
         dzero = dpacks[0]
-        return DataPack(edus=concat_l(d.edus for d in dpacks),
-                        pairings=concat_l(d.pairings for d in dpacks),
-                        data=scipy.sparse.vstack(d.data for d in dpacks),
+        if all(d.is_columnar() for d in dpacks):
+            table, offsets = _stack_tables(d.pairings.table for d in dpacks)
+            edus = EduView(table,
+                           np.concatenate([d.edus.indices() + o for d, o
+                                           in zip(dpacks, offsets)]))
+            pairings = Pairings(table,
+                                np.concatenate([d.pairings.sources + o
+                                                for d, o
+                                                in zip(dpacks, offsets)]),
+                                np.concatenate([d.pairings.targets + o
+                                                for d, o
+                                                in zip(dpacks, offsets)]))
+        elif any(isinstance(d.pairings, Pairings) for d in dpacks):
+            edus = concat_l(d.edus for d in dpacks)
+            pairings = Pairings.vstack(d.pairings for d in dpacks)
+        else:
+            edus = concat_l(d.edus for d in dpacks)
+            pairings = concat_l(d.pairings for d in dpacks)
+        return DataPack(edus=edus,
+                        pairings=pairings,
+                        data=_vstack_data([d.data for d in dpacks]),
                         target=np.concatenate([d.target for d in dpacks]),
                         labels=dzero.labels,
                         vocab=dzero.vocab,
@@ -251,21 +726,45 @@ class DataPack(namedtuple('DataPack',
         self._check_target()
         self._check_table_shape()
 
+    def is_columnar(self):
+        '''
+        True if the pairings are columnar and the EDUs are a view
+        on the same table (see :py:class:`Pairings` and
+        :py:class:`EduView`)
+        '''
+        return (isinstance(self.pairings, Pairings) and
+                isinstance(self.edus, EduView) and
+                self.edus.table is self.pairings.table)
+
     def selected(self, indices):
         '''
         Return only the items in the specified rows
+
+        If the datapack is columnar (see :py:meth:`is_columnar`),
+        this only involves slicing arrays (the EDU table is shared
+        with the result)
         '''
         sel_targets = np.take(self.target, indices)
         if self.labels is None:
             sel_labels = None
         else:
             sel_labels = self.labels
-        sel_pairings = [self.pairings[x] for x in indices]
-        sel_edus_ = set()
-        for edu1, edu2 in sel_pairings:
-            sel_edus_.add(edu1)
-            sel_edus_.add(edu2)
-        sel_edus = [e for e in self.edus if e in sel_edus_]
+        if self.is_columnar():
+            sel_pairings = self.pairings.selected(indices)
+            sel_edus = self._columnar_edus(sel_pairings)
+        elif isinstance(self.pairings, Pairings):
+            sel_pairings = self.pairings.selected(indices)
+            sel_edus_ = frozenset(sel_pairings.edu_rows().tolist())
+            table = sel_pairings.table
+            sel_edus = [e for e in self.edus
+                        if table.row(e.id) in sel_edus_]
+        else:
+            sel_pairings = [self.pairings[x] for x in indices]
+            sel_edus_ = set()
+            for edu1, edu2 in sel_pairings:
+                sel_edus_.add(edu1)
+                sel_edus_.add(edu2)
+            sel_edus = [e for e in self.edus if e in sel_edus_]
         sel_data = self.data[indices]
         if self.graph is None:
             graph = None
@@ -279,6 +778,71 @@ class DataPack(namedtuple('DataPack',
                         vocab=self.vocab,
                         graph=graph)
 
+    def _columnar_edus(self, sel_pairings):
+        '''
+        (columnar datapacks only) View on the subset of our EDUs
+        that are used in the given pairings
+        '''
+        used = sel_pairings.edu_rows()
+        if self.edus.rows is None:
+            sel_rows = used
+        else:
+            sel_rows = self.edus.rows[np.in1d(self.edus.rows, used)]
+        return EduView(self.pairings.table, sel_rows)
+
+    def sliced(self, start, stop):
+        '''
+        Return the rows from `start` up to (not including) `stop`.
+
+        Unlike :py:meth:`selected`, the result is a view: its
+        feature matrix shares the `data` and `indices` buffers of
+        this datapack (only the row pointers are copied), and
+        its target (and graph) arrays are slices of ours. Be
+        careful not to modify them in place.
+        '''
+        if isinstance(self.data, FeaturePlaceholder):
+            sel_data = self.data[start:stop]
+        elif scipy.sparse.isspmatrix_csr(self.data):
+            sel_data = _csr_rows_view(self.data, start, stop)
+        else:
+            return self.selected(np.arange(start, stop))
+        if self.is_columnar():
+            sel_pairings = self.pairings[start:stop]
+            sel_edus = self._columnar_edus(sel_pairings)
+        else:
+            sel_pack = self.selected(np.arange(start, stop))
+            sel_pairings = sel_pack.pairings
+            sel_edus = sel_pack.edus
+        if self.graph is None:
+            graph = None
+        else:
+            graph = self.graph.selected(slice(start, stop))
+        return DataPack(edus=sel_edus,
+                        pairings=sel_pairings,
+                        data=sel_data,
+                        target=self.target[start:stop],
+                        labels=self.labels,
+                        vocab=self.vocab,
+                        graph=graph)
+
+    def __reduce__(self):
+        # when pickling a columnar datapack that only uses a small
+        # part of its EDU table (eg. a single document picked out
+        # of a corpus), only send the rows we actually use
+        if self.is_columnar() and len(self.pairings.table) > 0:
+            rows = np.union1d(self.pairings.edu_rows(), self.edus.indices())
+            if len(rows) < len(self.pairings.table):
+                edus = self.pairings.table.edus
+                table = EduTable([edus[i] for i in rows.tolist()])
+                fields = self._asdict()
+                fields['edus'] = EduView(table, np.searchsorted(
+                    rows, self.edus.indices()))
+                fields['pairings'] = Pairings(table, np.searchsorted(
+                    rows, self.pairings.sources), np.searchsorted(
+                        rows, self.pairings.targets))
+                return (DataPack, tuple(fields[f] for f in self._fields))
+        return (DataPack, tuple(self))
+
     def set_graph(self, graph):
         '''
         Return a copy of the datapack with weights set
@@ -344,9 +908,55 @@ class DataPack(namedtuple('DataPack',
 
         See also
         --------
-        `get_label`
+        `get_label`, `label_numbers`
         '''
-        return self.labels.index(label)
+        try:
+            return _label_index(self.labels)[label]
+        except KeyError:
+            raise ValueError('%r is not in the labels list' % (label,))
+
+    def label_numbers(self, labels):
+        '''
+        Return the numerical labels for a sequence of string
+        labels (see `label_number`)
+
+        :rtype: array(int)
+        '''
+        index = _label_index(self.labels)
+        try:
+            return np.fromiter((index[l] for l in labels),
+                               dtype=np.int64)
+        except KeyError as oops:
+            raise ValueError('%r is not in the labels list' % oops.args)
+
+
+# pylint: disable=pointless-string-statement
+_LABEL_INDEXES = OrderedDict()
+"label indexes for the most recently used labels lists, by id"
+
+_LABEL_INDEXES_SIZE = 16
+"how many labels lists we keep an index for"
+# pylint: enable=pointless-string-statement
+
+
+def _label_index(labels):
+    '''
+    Dictionary from label strings to their numbers (see
+    :py:meth:`DataPack.label_number`), memoised for the last
+    few labels lists (datapacks taken from the same corpus share
+    their labels list). We assume labels lists are never modified
+    in place
+    '''
+    key = id(labels)
+    # (the entry holds on to the list, so its id can't be reused)
+    entry = _LABEL_INDEXES.get(key)
+    if entry is None:
+        entry = (labels,
+                 {l: i for i, l in reversed(list(enumerate(labels)))})
+        if len(_LABEL_INDEXES) >= _LABEL_INDEXES_SIZE:
+            _LABEL_INDEXES.popitem(last=False)
+        _LABEL_INDEXES[key] = entry
+    return entry[1]
 
 
 def groupings(pairings):
@@ -356,25 +966,27 @@ def groupings(pairings):
 
     :rtype: dict(string, [int])
     '''
-    res = defaultdict(list)
-    for i, (edu1, edu2) in enumerate(pairings):
-        grp1 = edu1.grouping
-        grp2 = edu2.grouping
-        if grp1 is None:
-            grp = grp2
-        elif grp2 is None:
-            grp = grp1
-        elif grp1 != grp2:
-            oops = ('Grouping mismatch: {edu1} is in group {grp1}, '
-                    'but {edu2} is in {grp2}')
-            raise(DataPackException(oops.format(edu1=edu1,
-                                                edu2=edu2,
-                                                grp1=grp1,
-                                                grp2=grp2)))
-        else:
-            grp = grp1
-        res[grp].append(i)
-    return res
+    pairings = Pairings.from_list(pairings)
+    codes = pairings.table.grouping
+    grp1 = codes[pairings.sources]
+    grp2 = codes[pairings.targets]
+    mismatch = np.where((grp1 >= 0) & (grp2 >= 0) & (grp1 != grp2))[0]
+    if len(mismatch):
+        edu1, edu2 = pairings[mismatch[0]]
+        oops = ('Grouping mismatch: {edu1} is in group {grp1}, '
+                'but {edu2} is in {grp2}')
+        raise(DataPackException(oops.format(edu1=edu1,
+                                            edu2=edu2,
+                                            grp1=edu1.grouping,
+                                            grp2=edu2.grouping)))
+    grp = np.where(grp1 < 0, grp2, grp1)
+    # stable sort so that rows stay in order within each group
+    order = np.argsort(grp, kind='mergesort')
+    grp_codes, starts = np.unique(grp[order], return_index=True)
+    names = pairings.table.grouping_names
+    return {(names[code] if code >= 0 else None): idxs.tolist()
+            for code, idxs in zip(grp_codes.tolist(),
+                                  np.split(order, starts[1:]))}
 
 
 def attached_only(dpack, target):
@@ -440,42 +1052,55 @@ def for_labelling(dpack, target):
     return dpack, target
 
 
+def _same_subgrouping(pairings):
+    """Mask for pairings whose EDUs are in the same grouping and
+    subgrouping, and mask for those that start from the fake root
+
+    :rtype (array(bool), array(bool))
+    """
+    pairings = Pairings.from_list(pairings)
+    table = pairings.table
+    src = pairings.sources
+    tgt = pairings.targets
+    same = ((table.grouping[src] == table.grouping[tgt]) &
+            (table.subgrouping[src] == table.subgrouping[tgt]))
+    return same, table.is_root[src]
+
+
 def idxes_fakeroot(dpack):
     """Return datapack indices only the pairings which involve the
     fakeroot node
+
+    :rtype [int]
     """
-    return [i for i, (edu1, _) in enumerate(dpack.pairings)
-            if edu1.id == FAKE_ROOT_ID]
+    pairings = Pairings.from_list(dpack.pairings)
+    return np.where(pairings.table.is_root[pairings.sources])[0].tolist()
 
 
 def idxes_intra(dpack, include_fake_root=False):
     """Return datapack indices for pairings which correspond to
     EDUs in the same sentence (or the fake root).
+
+    :rtype [int]
     """
-    idxes = []
-    for i, (edu1, edu2) in enumerate(dpack.pairings):
-        if edu1.id == FAKE_ROOT_ID:
-            if include_fake_root:
-                idxes.append(i)
-        elif (edu1.grouping == edu2.grouping and
-              edu1.subgrouping == edu2.subgrouping):
-            idxes.append(i)
-    return idxes
+    same, froot = _same_subgrouping(dpack.pairings)
+    if include_fake_root:
+        return np.where(same | froot)[0].tolist()
+    else:
+        return np.where(same & ~froot)[0].tolist()
 
 
 def idxes_inter(dpack, include_fake_root=False):
     """Return datapack indices for pairings which correspond to
     EDUs in different sentences (or the fake root).
+
+    :rtype [int]
     """
-    idxes = []
-    for i, (edu1, edu2) in enumerate(dpack.pairings):
-        if edu1.id == FAKE_ROOT_ID:
-            if include_fake_root:
-                idxes.append(i)
-        elif (edu1.grouping != edu2.grouping or
-              edu1.subgrouping != edu2.subgrouping):
-            idxes.append(i)
-    return idxes
+    same, froot = _same_subgrouping(dpack.pairings)
+    if include_fake_root:
+        return np.where(~same | froot)[0].tolist()
+    else:
+        return np.where(~same & ~froot)[0].tolist()
 
 
 class Multipack(dict):
@@ -503,6 +1128,66 @@ def _edu_positions(dpack):
     return position
 
 
+def _pairing_gaps(dpack):
+    """Return for each pairing in the datapack the signed distance
+    (in EDUs) from its first to its second EDU, with positions as
+    in :py:func:`_edu_positions`
+
+    Note that this will only work correctly on single-document
+    datapacks.
+
+    :rtype array(int)
+    """
+    if dpack.is_columnar():
+        return _columnar_pairing_gaps(dpack)
+    pairings = Pairings.from_list(dpack.pairings)
+    position = _edu_positions(dpack)
+    edus = pairings.table.edus
+    # only look up the EDUs we actually use (the table may be
+    # shared with a much larger pack)
+    rows, inverse = np.unique(np.concatenate([pairings.sources,
+                                              pairings.targets]),
+                              return_inverse=True)
+    row_pos = np.fromiter((position[edus[r].id] for r in rows.tolist()),
+                          dtype=np.int64, count=len(rows))
+    pos = row_pos[inverse]
+    return pos[len(pairings):] - pos[:len(pairings)]
+
+
+def _columnar_pairing_gaps(dpack):
+    """:py:func:`_pairing_gaps` for columnar datapacks, working
+    directly on the table row numbers
+    """
+    table = dpack.pairings.table
+    rows = dpack.edus.indices()
+    # rank of each EDU in the datapack (by starting position)
+    ranks = np.empty(len(rows), dtype=np.int64)
+    ranks[np.argsort(table.start[rows], kind='mergesort')] =\
+        np.arange(len(rows))
+    sorter = np.argsort(rows, kind='mergesort')
+    sorted_rows = rows[sorter]
+
+    def positions(pair_rows):
+        'position for each of the given rows'
+        if not len(sorted_rows):
+            idx = np.zeros(len(pair_rows), dtype=np.int64)
+            found = np.zeros(len(pair_rows), dtype=np.bool_)
+        else:
+            # pick the last of any duplicate rows
+            idx = np.searchsorted(sorted_rows, pair_rows, side='right') - 1
+            idx = np.maximum(idx, 0)
+            found = sorted_rows[idx] == pair_rows
+        missing = ~found & ~table.is_root[pair_rows]
+        if missing.any():
+            raise KeyError(table.edus[pair_rows[missing][0]].id)
+        pos = np.zeros(len(pair_rows), dtype=np.int64)
+        pos[found] = ranks[sorter[idx[found]]]
+        return pos
+
+    pairings = dpack.pairings
+    return positions(pairings.targets) - positions(pairings.sources)
+
+
 def select_window(dpack, window):
     '''Select only EDU pairs that are at most `window` EDUs apart
     from each other (adjacent EDUs would be considered `0` apart)
@@ -514,13 +1199,8 @@ def select_window(dpack, window):
     '''
     if window is None:
         return dpack
-    position = _edu_positions(dpack)
-    indices = []
-    for i, (edu1, edu2) in enumerate(dpack.pairings):
-        gap = abs(position[edu2.id] - position[edu1.id])
-        if gap <= window:
-            indices.append(i)
-    return dpack.selected(indices)
+    gaps = np.abs(_pairing_gaps(dpack))
+    return dpack.selected(np.where(gaps <= window)[0])
 
 
 def pairing_distances(dpack):
@@ -534,18 +1214,14 @@ def pairing_distances(dpack):
 
     :rtype dict(int, (int, int))
     """
-    position = _edu_positions(dpack)
-    max_l = defaultdict(int)
-    max_r = defaultdict(int)
-    for i, (edu1, edu2) in enumerate(dpack.pairings):
-        gap = position[edu2.id] - position[edu1.id]
-        lbl = dpack.target[i]
-        if gap < 0:
-            max_l[lbl] = max(max_l[lbl], -gap)
-        else:
-            max_r[lbl] = max(max_r[lbl], gap)
-    keys = frozenset(max_l.keys() + max_r.keys())
-    return {k: (max_l[k], max_r[k]) for k in keys}
+    gaps = _pairing_gaps(dpack)
+    lbls, lbl_idx = np.unique(np.asarray(dpack.target), return_inverse=True)
+    max_l = np.zeros(len(lbls), dtype=np.int64)
+    max_r = np.zeros(len(lbls), dtype=np.int64)
+    left = gaps < 0
+    np.maximum.at(max_l, lbl_idx[left], -gaps[left])
+    np.maximum.at(max_r, lbl_idx[~left], gaps[~left])
+    return {k: (int(l), int(r)) for k, l, r in zip(lbls, max_l, max_r)}
 
 
 def mpack_pairing_distances(mpack):
@@ -588,8 +1264,75 @@ def locate_in_subpacks(dpack, subpacks):
     [None or (DataPack, float)]
     """
     subpacks = list(subpacks)  # in case of iterable
-    pmap = {}
-    for subpack in subpacks:
-        for i, pair in enumerate(subpack.pairings):
-            pmap[pair] = subpack, i
-    return [pmap.get(x) for x in dpack.pairings]
+    which, sub_idxes = locate_pairings(dpack.pairings,
+                                       [x.pairings for x in subpacks])
+    return [None if w < 0 else (subpacks[w], i)
+            for w, i in zip(which.tolist(), sub_idxes.tolist())]
+
+
+def _pair_keys(pairings_list):
+    """Integer keys for each pairing in each of the given sequences
+    of pairings, such that the same pairs get the same keys.
+
+    If all the sequences share the same EDU table, we key on the
+    table rows, so two rows with the same EDU id (if the table has
+    any) count as different EDUs. Otherwise we key on EDU ids, so
+    pairs of EDUs with the same ids get the same keys
+
+    :rtype [array(int)]
+    """
+    pairings_list = [Pairings.from_list(p) for p in pairings_list]
+    if not pairings_list:
+        return []
+    table = pairings_list[0].table
+    if all(p.table is table for p in pairings_list):
+        size = len(table)
+        return [p.sources * size + p.targets for p in pairings_list]
+    # different tables: go through the EDU ids of the rows we use
+    codes = {}
+    coded = []
+    for pairs in pairings_list:
+        rows, inverse = np.unique(np.concatenate([pairs.sources,
+                                                  pairs.targets]),
+                                  return_inverse=True)
+        row_codes = np.fromiter((codes.setdefault(pairs.table.edus[r].id,
+                                                  len(codes))
+                                 for r in rows.tolist()),
+                                dtype=np.int64, count=len(rows))
+        edu_codes = row_codes[inverse]
+        coded.append((edu_codes[:len(pairs)], edu_codes[len(pairs):]))
+    size = len(codes)
+    return [src * size + tgt for src, tgt in coded]
+
+
+def locate_pairings(pairings, sub_pairings):
+    """
+    Array version of :py:func:`locate_in_subpacks`: given some
+    pairings, and a list of sequences of pairings, return for
+    each pair the number of the sequence it appears in and its
+    index there (-1 and -1 if it is not found). If a pair occurs
+    more than once, the last occurrence wins.
+
+    Returns
+    -------
+    which: array(int)
+    indices: array(int)
+    """
+    keys = _pair_keys([pairings] + list(sub_pairings))
+    which = np.repeat(-1, len(keys[0]))
+    idxes = np.repeat(-1, len(keys[0]))
+    sub_keys = keys[1:]
+    if not sum(len(k) for k in sub_keys):
+        return which, idxes
+    all_which = np.concatenate([np.repeat(w, len(k))
+                                for w, k in enumerate(sub_keys)])
+    all_idxes = np.concatenate([np.arange(len(k)) for k in sub_keys])
+    all_keys = np.concatenate(sub_keys)
+    # keep the last occurrence of each key
+    uniq, first_rev = np.unique(all_keys[::-1], return_index=True)
+    last = len(all_keys) - 1 - first_rev
+    pos = np.minimum(np.searchsorted(uniq, keys[0]), len(uniq) - 1)
+    found = uniq[pos] == keys[0]
+    which[found] = all_which[last[pos[found]]]
+    idxes[found] = all_idxes[last[pos[found]]]
+    return which, idxes
@@ -6,8 +6,14 @@ attelo tests
 # no-member: numpy
 
 from __future__ import print_function
+from os import path as fp
+import glob
+import os
+import shutil
+import tempfile
 import unittest
 
+from sklearn.datasets import load_svmlight_file
 import scipy.sparse
 import numpy
 import numpy as np
@@ -17,10 +23,28 @@ import attelo.fold
 
 from .edu import EDU, FAKE_ROOT
 from .fold import select_training
+from .io import (IoException,
+                 _EduStream,
+                 iter_multipack,
+                 load_mpack_cache,
+                 load_svmlight_chunked,
+                 load_multipack,
+                 load_predictions,
+                 mpack_cache_path,
+                 write_document_predictions)
+from .score import (Count, CountPair, EduCount,
+                    align_predictions, score_edges, score_predictions)
 from .table import (DataPack,
                     DataPackException,
+                    EduView,
+                    Pairings,
                     attached_only,
-                    groupings)
+                    groupings,
+                    idxes_fakeroot,
+                    idxes_inter,
+                    idxes_intra,
+                    locate_in_subpacks,
+                    select_window)
 
 MAX_FOLDS = 2
 
@@ -115,6 +139,46 @@ class DataPackTest(unittest.TestCase):
                                None)
         self.assertEqualishDatapack(triv, dpack2)
 
+    def test_score(self):
+        'counting correct edges, labels and edus'
+        edus = self.edus
+        dpack = DataPack(edus=edus,
+                         pairings=[(edus[0], edus[1]),
+                                   (edus[1], edus[0]),
+                                   (edus[0], edus[2]),
+                                   (edus[1], edus[2])],
+                         data=scipy.sparse.csr_matrix((4, 2)),
+                         target=numpy.array([1, 3, 1, 3]),
+                         labels=['__UNK__', 'x', 'y', 'UNRELATED'],
+                         graph=None,
+                         vocab=None)
+        predictions = [('e3', 'e1', 'x'),  # not in the pack
+                       ('e2', 'e1', 'x'),
+                       ('e1', 'e3', 'y'),
+                       ('e2', 'e3', 'UNRELATED')]
+        scores = score_predictions(dpack, predictions)
+        # predictions outside of the pack do not count
+        self.assertEqual(score_edges(dpack, predictions),
+                         score_edges(dpack, predictions[1:]))
+        self.assertEqual(scores.edges,
+                         CountPair(undirected=Count(2, 0, 2, 2),
+                                   directed=Count(1, 0, 2, 2)))
+        self.assertEqual(dict(scores.edges_by_label),
+                         {'__UNK__': CountPair(Count(0, 0, 0, 0),
+                                               Count(0, 0, 0, 0)),
+                          'x': CountPair(Count(1, 0, 1, 2),
+                                         Count(0, 0, 1, 2)),
+                          'y': CountPair(Count(0, 0, 1, 0),
+                                         Count(0, 0, 1, 0))})
+        self.assertEqual(scores.edus, EduCount(1, 0, 3))
+        expected = numpy.zeros((4, 4), dtype=int)
+        expected[1, 3] = expected[3, 1] = expected[1, 2] = 1
+        expected[3, 3] = 1
+        self.assertEqual(scores.confusion.tolist(), expected.tolist())
+        aligned = align_predictions(dpack, predictions)
+        self.assertEqual(aligned.tolist(), [3, 1, 2, 3])
+        self.assertEqual(score_predictions(dpack, aligned)[:3], scores[:3])
+
     def test_get_label(self):
         'correctly picks out labels and unrelated'
         pack = DataPack(self.edus,
@@ -129,6 +193,10 @@ class DataPackTest(unittest.TestCase):
                         vocab=None)
         labels = [pack.get_label(t) for t in pack.target]
         self.assertEqual(['y', 'x', 'x', 'UNRELATED'], labels)
+        self.assertEqual(pack.label_number('y'), 2)
+        self.assertEqual(pack.label_numbers(labels).tolist(),
+                         pack.target.tolist())
+        self.assertRaises(ValueError, pack.label_number, 'z')
 
 
     def test_select_classes(self):
@@ -163,6 +231,77 @@ class DataPackTest(unittest.TestCase):
         pack3 = pack.selected([1, 2])
         self.assertEqual(orig_classes, pack3.labels)
 
+    def test_columnar_pairings(self):
+        'columnar pairings behave like the equivalent lists'
+        # pylint: disable=invalid-name
+        e1, e2, e3 = self.edus
+        # pylint: enable=invalid-name
+        pairs = [(FAKE_ROOT, e1), (e1, e2), (e2, e1), (e1, e3), (e3, e2)]
+        cpairs = Pairings.from_list(pairs, [FAKE_ROOT] + self.edus)
+        self.assertEqual(cpairs, pairs)
+        self.assertEqual(pairs, cpairs)
+        self.assertEqual(cpairs[3], (e1, e3))
+        self.assertEqual(cpairs.selected([4, 0]), [(e3, e2), (FAKE_ROOT, e1)])
+        rows, src_idx, tgt_idx = cpairs.edu_numbers()
+        self.assertEqual(rows.tolist(), [0, 1, 2, 3])
+        self.assertEqual(src_idx.tolist(), [0, 1, 2, 1, 3])
+        self.assertEqual(tgt_idx.tolist(), [1, 2, 1, 3, 2])
+        self.assertTrue(cpairs.edu_numbers()[0] is rows)
+
+        pack = DataPack.load(edus=[FAKE_ROOT] + self.edus,
+                             pairings=pairs,
+                             data=scipy.sparse.csr_matrix([[1], [2], [3],
+                                                           [4], [5]]),
+                             target=numpy.array([1, 2, 1, 2, 2]),
+                             labels=['__UNK__', 'x', 'UNRELATED'],
+                             vocab=None)
+        cpack = DataPack.load(edus=pack.edus,
+                              pairings=cpairs,
+                              data=pack.data,
+                              target=pack.target,
+                              labels=pack.labels,
+                              vocab=None)
+        for func in [idxes_intra, idxes_inter]:
+            for froot in [True, False]:
+                self.assertEqual(list(func(cpack, froot)),
+                                 list(func(pack, froot)))
+        self.assertEqual(list(idxes_fakeroot(cpack)), [0])
+        self.assertEqual(list(idxes_intra(cpack)), [1, 2])
+        self.assertEqual(list(idxes_inter(cpack)), [3, 4])
+        self.assertEqual(list(groupings(cpairs)['a']), [0, 1, 2, 3, 4])
+        self.assertEqualishDatapack(cpack.selected([1, 3]),
+                                    pack.selected([1, 3]))
+        self.assertEqualishDatapack(select_window(cpack, 0),
+                                    select_window(pack, 0))
+        subpacks = [cpack.selected([3, 1]), pack.selected([1])]
+        located = locate_in_subpacks(cpack, subpacks)
+        self.assertEqual(located[0], None)
+        self.assertTrue(located[1][0] is subpacks[1])
+        self.assertEqual(located[1][1], 0)
+        self.assertTrue(located[3][0] is subpacks[0])
+        self.assertEqual(located[3][1], 0)
+
+    def test_sliced(self):
+        'slicing is like selecting, but without copying'
+        # pylint: disable=invalid-name
+        e1, e2, e3 = self.edus
+        # pylint: enable=invalid-name
+        pairs = Pairings.from_list([(FAKE_ROOT, e1), (e1, e2),
+                                    (e2, e3), (e3, e2)],
+                                   [FAKE_ROOT] + self.edus)
+        pack = DataPack.load(edus=EduView(pairs.table),
+                             pairings=pairs,
+                             data=scipy.sparse.csr_matrix([[1, 0], [0, 2],
+                                                           [3, 4], [0, 5]]),
+                             target=numpy.array([1, 2, 1, 2]),
+                             labels=['__UNK__', 'x', 'UNRELATED'],
+                             vocab=None)
+        sliced = pack.sliced(1, 3)
+        self.assertEqualishDatapack(sliced, pack.selected([1, 2]))
+        self.assertTrue(numpy.may_share_memory(sliced.data.data,
+                                               pack.data.data))
+        self.assertTrue(numpy.may_share_memory(sliced.target, pack.target))
+
     def test_folds(self):
         'test that fold selection does something sensible'
 
@@ -218,3 +357,154 @@ class DataPackTest(unittest.TestCase):
                                ['a1', 'a2', 'c1', 'c2'])
         self.assertEqualEduIds(attelo.fold.select_testing(mpack, fold_dict, 1),
                                ['b1', 'b2', 'd1', 'd2'])
+
+
+class MultipackIoTest(unittest.TestCase):
+    '''
+    the compiled multipack cache and the streaming reader should
+    give the same results as just loading the multipack
+    '''
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        for cpath in glob.glob('doc/example-corpus/tiny.*'):
+            shutil.copy(cpath, self._tmpdir)
+        core_path = fp.join(self._tmpdir, 'tiny')
+        self._cache_dir = fp.join(self._tmpdir, 'cache')
+        self._paths = (core_path + '.edus',
+                       core_path + '.pairings',
+                       core_path + '.features.sparse',
+                       core_path + '.features.sparse.vocab')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def assertEqualishMultipack(self, mpack1, mpack2):
+        '''
+        same groupings and same contents for each grouping
+        '''
+        self.assertEqual(sorted(mpack1), sorted(mpack2))
+        for key in mpack1:
+            pack1 = mpack1[key]
+            pack2 = mpack2[key]
+            self.assertEqual(pack1.edus, pack2.edus)
+            self.assertEqual(pack1.pairings, pack2.pairings)
+            self.assertEqual(pack1.labels, pack2.labels)
+            self.assertEqual(pack1.vocab, pack2.vocab)
+            self.assertEqual(pack1.target.tolist(), pack2.target.tolist())
+            self.assertEqual(squish(pack1.data), squish(pack2.data))
+
+    def test_cache_roundtrip(self):
+        'loading through the cache gives the same multipack'
+        plain = load_multipack(*self._paths)
+        self.assertFalse(fp.exists(self._cache_dir))
+        first = load_multipack(*self._paths, cache_dir=self._cache_dir)
+        self.assertTrue(fp.exists(mpack_cache_path(self._cache_dir,
+                                                   self._paths[2])))
+        second = load_multipack(*self._paths, cache_dir=self._cache_dir)
+        self.assertEqualishMultipack(plain, first)
+        self.assertEqualishMultipack(plain, second)
+        # the cached arrays are read-only memory maps
+        self.assertFalse(second.values()[0].target.flags.writeable)
+
+    def test_cache_invalidation(self):
+        'touching an input file makes us ignore the cache'
+        load_multipack(*self._paths, cache_dir=self._cache_dir)
+        self.assertTrue(load_mpack_cache(self._cache_dir,
+                                         self._paths) is not None)
+        stat = os.stat(self._paths[0])
+        os.utime(self._paths[0], (stat.st_atime, stat.st_mtime + 10))
+        self.assertTrue(load_mpack_cache(self._cache_dir,
+                                         self._paths) is None)
+
+    def test_iter_multipack(self):
+        'streaming gives us the same datapacks'
+        plain = load_multipack(*self._paths)
+        streamed = dict(iter_multipack(*self._paths))
+        self.assertEqualishMultipack(plain, streamed)
+
+    def test_targets_only(self):
+        'targets-only mode: same packs, but no features'
+        plain = load_multipack(*self._paths)
+        # so we try the cache too
+        load_multipack(*self._paths, cache_dir=self._cache_dir)
+        for cache_dir in [None, self._cache_dir]:
+            for mpack in [load_multipack(*self._paths, cache_dir=cache_dir,
+                                         targets_only=True),
+                          dict(iter_multipack(*self._paths,
+                                              targets_only=True))]:
+                self.assertEqual(sorted(plain), sorted(mpack))
+                for key in plain:
+                    pack = mpack[key]
+                    self.assertEqual(plain[key].pairings, pack.pairings)
+                    self.assertEqual(plain[key].target.tolist(),
+                                     pack.target.tolist())
+                    self.assertEqual(plain[key].data.shape, pack.data.shape)
+                    self.assertRaises(DataPackException,
+                                      lambda p: p.data.toarray(), pack)
+                stacked = DataPack.vstack(list(mpack.values()))
+                self.assertEqual(stacked.data.shape[0], len(stacked))
+                sel = stacked.selected([0, 2])
+                self.assertEqual(sel.data.shape[0], 2)
+
+    def test_iter_multipack_unsorted(self):
+        'streaming complains about unsorted inputs'
+        # move the first pairing (and its features) to the end
+        for path in self._paths[1:3]:
+            with open(path) as stream:
+                lines = stream.readlines()
+            first = 1 if lines[0].startswith('#') else 0
+            lines = lines[:first] + lines[first + 1:] + [lines[first]]
+            with open(path, 'w') as stream:
+                stream.writelines(lines)
+        self.assertRaises(IoException, list, iter_multipack(*self._paths))
+
+    def test_edu_stream_unpaired(self):
+        'streaming forgets groupings that have no pairings'
+        # pylint: disable=protected-access
+        edu_file = fp.join(self._tmpdir, 'unpaired.edus')
+        with open(edu_file, 'w') as stream:
+            for edu_id, grouping in [('a1', 'a'), ('a2', 'a'),
+                                     ('x1', 'x'),
+                                     ('b1', 'b')]:
+                stream.write('\t'.join([edu_id, 'hi', grouping, 's1',
+                                        '0', '2']) + '\n')
+        with open(edu_file, 'rb') as stream:
+            edus = _EduStream(edu_file, stream)
+            edus.lookup('a2')
+            self.assertEqual([e.id for e in edus.pop_group('a')],
+                             ['a1', 'a2'])
+            edus.lookup('b1')
+            self.assertEqual([e.id for e in edus.pop_group('b')], ['b1'])
+            self.assertTrue(edus.is_finished('x'))
+            self.assertEqual(edus._known, {})
+        # pylint: enable=protected-access
+
+    def test_prediction_formats(self):
+        'predictions read back the same whatever the output format'
+        mpack = load_multipack(*self._paths)
+        docs = [(mpack[k], mpack[k].target) for k in sorted(mpack)]
+        expected = None
+        for ext in ['', '.gz', '.npz']:
+            path = fp.join(self._tmpdir, 'output' + ext)
+            write_document_predictions(iter(docs), path)
+            got = load_predictions(path)
+            if expected is None:
+                expected = got
+                self.assertEqual(len(got),
+                                 sum(len(d.pairings) for d, _ in docs))
+            self.assertEqual(got, expected)
+
+    def test_load_svmlight_chunked(self):
+        'parsing features in chunks is the same as parsing in one go'
+        feature_file = self._paths[2]
+        # pylint: disable=unbalanced-tuple-unpacking
+        data, target = load_svmlight_file(feature_file, n_features=7)
+        for n_jobs in [2, 5]:
+            c_data, c_target = load_svmlight_chunked(feature_file, 7,
+                                                     n_jobs=n_jobs,
+                                                     min_chunk_size=1)
+            self.assertEqual(data.indptr.tolist(), c_data.indptr.tolist())
+            self.assertEqual(data.indices.tolist(), c_data.indices.tolist())
+            self.assertEqual(data.data.tolist(), c_data.data.tolist())
+            self.assertEqual(target.tolist(), c_target.tolist())
+        # pylint: enable=unbalanced-tuple-unpacking
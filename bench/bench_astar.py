@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for the A* decoder search
+
+We decode the example corpus (and optionally some longer synthetic
+documents), with random attachment probabilities, and report how
+many search states we expand per second
+"""
+
+from __future__ import print_function
+import argparse
+import time
+
+import numpy as np
+
+from attelo.edu import EDU
+from attelo.io import load_multipack
+from attelo.table import (DataPack, Graph, UNKNOWN, UNRELATED)
+from attelo.decoding import astar
+from attelo.decoding.util import (get_prob_map,
+                                  get_sorted_edus,
+                                  simple_candidates)
+
+
+def with_random_graph(dpack, rng):
+    """
+    The datapack with random attachment and labelling weights
+    """
+    graph = Graph(prediction=np.zeros(len(dpack), dtype=np.int16),
+                  attach=rng.uniform(0.01, 1, size=len(dpack)),
+                  label=rng.uniform(0, 1, size=(len(dpack),
+                                                len(dpack.labels))))
+    return dpack.set_graph(graph)
+
+
+def mk_synthetic_doc(doc_size):
+    """
+    A document in which each EDU may attach to any earlier one
+    """
+    edus = [EDU('s_{}'.format(i), 'x', i * 10, i * 10 + 9, 'synth', None)
+            for i in range(doc_size)]
+    pairings = [(edus[i], edus[j])
+                for j in range(1, doc_size) for i in range(j)]
+    return DataPack(edus=edus, pairings=pairings, data=None,
+                    target=np.zeros(len(pairings)),
+                    labels=[UNKNOWN, UNRELATED, 'elaboration', 'narration'],
+                    vocab=None, graph=None)
+
+
+def search(dpack, args):
+    """
+    Run the A* search on a datapack (as the decoder would),
+    returning the number of states expanded
+    """
+    cands = simple_candidates(dpack)
+    edus = [x.id for x in get_sorted_edus(cands)]
+    shared = {"probs": get_prob_map(cands),
+              "use_prob": True,
+              "heuristics": astar.preprocess_heuristics(cands),
+              "RFC": astar.RfcConstraint.simple}
+    heuristic = astar.HEURISTICS[astar.Heuristic.average]
+    srch = astar.DiscourseSearch(heuristic=heuristic, shared=shared)
+    genall = srch.launch(astar.DiscData(accessible=[edus[0]],
+                                        tolink=edus[1:]),
+                         norepeat=True)
+    next(genall)
+    return srch.iterations
+
+
+def bench(name, dpacks, args):
+    "Decode the datapacks repeatedly, and print the search rate"
+    expansions = 0
+    start = time.time()
+    for _ in range(args.repeat):
+        for dpack in dpacks:
+            expansions += search(dpack, args)
+    elapsed = time.time() - start
+    print('{:>12}: {:8d} expansions in {:6.2f}s ({:9.0f}/s)'
+          ''.format(name, expansions, elapsed, expansions / elapsed))
+
+
+def main():
+    "Run the benchmark"
+    psr = argparse.ArgumentParser(description=__doc__)
+    psr.add_argument('--corpus', default='doc/example-corpus/tiny')
+    psr.add_argument('--repeat', type=int, default=200)
+    psr.add_argument('--synthetic', type=int, default=14,
+                     help='size of synthetic documents (0 to skip)')
+    args = psr.parse_args()
+
+    rng = np.random.RandomState(0)
+    paths = [args.corpus + sfx for sfx in ['.edus',
+                                           '.pairings',
+                                           '.features.sparse',
+                                           '.features.sparse.vocab']]
+    mpack = load_multipack(*paths)
+    corpus = [with_random_graph(mpack[k], rng) for k in sorted(mpack)]
+    bench('example', corpus, args)
+    if args.synthetic:
+        synth = [with_random_graph(mk_synthetic_doc(args.synthetic), rng)
+                 for _ in range(5)]
+        bench('synthetic', synth, argparse.Namespace(repeat=1))
+
+
+if __name__ == '__main__':
+    main()
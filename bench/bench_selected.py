@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for DataPack.selected
+
+We build a synthetic corpus (all pairs of EDUs within each document,
+plus the fake root), and time
+
+* splitting the corpus into one datapack per document
+* selecting half of the pairings in each document
+
+both with plain lists of EDUs/pairings, and with columnar
+(EduView/Pairings) datapacks
+"""
+
+from __future__ import print_function
+import argparse
+import timeit
+
+import numpy as np
+import scipy.sparse
+
+from attelo.edu import EDU, FAKE_ROOT
+from attelo.table import (DataPack, EduView, Pairings,
+                          UNKNOWN, UNRELATED, groupings)
+
+
+def mk_corpus(num_docs, doc_size, num_features=100):
+    """
+    Return a list-based and a columnar version of the same corpus
+    """
+    edus = [FAKE_ROOT]
+    pairings = []
+    for doc in range(num_docs):
+        grouping = 'd{}'.format(doc)
+        doc_edus = [EDU('{}_{}'.format(grouping, i), 'x', i * 10, i * 10 + 9,
+                        grouping, 's{}'.format(i // 5))
+                    for i in range(doc_size)]
+        edus.extend(doc_edus)
+        for edu2 in doc_edus:
+            pairings.append((FAKE_ROOT, edu2))
+            for edu1 in doc_edus:
+                if edu1 != edu2:
+                    pairings.append((edu1, edu2))
+    num_pairs = len(pairings)
+    data = scipy.sparse.random(num_pairs, num_features, density=0.05,
+                               format='csr')
+    target = np.random.randint(1, 3, size=num_pairs)
+    labels = [UNKNOWN, 'elaboration', UNRELATED]
+    plain = DataPack(edus=edus, pairings=pairings, data=data, target=target,
+                     labels=labels, vocab=None, graph=None)
+    cpairings = Pairings.from_list(pairings, edus)
+    columnar = DataPack(edus=EduView(cpairings.table), pairings=cpairings,
+                        data=data, target=target, labels=labels,
+                        vocab=None, graph=None)
+    return plain, columnar
+
+
+def split(dpack):
+    "one datapack per document"
+    return [dpack.selected(idxs) for idxs in
+            groupings(dpack.pairings).values()]
+
+
+def select_half(dpacks):
+    "every other pairing in each document"
+    return [d.selected(np.arange(0, len(d), 2)) for d in dpacks]
+
+
+def main():
+    "benchmark main"
+    psr = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    psr.add_argument('--docs', type=int, default=50,
+                     help='number of documents (default: 50)')
+    psr.add_argument('--sizes', type=int, nargs='+', default=[10, 30, 60],
+                     help='EDUs per document (default: 10 30 60)')
+    psr.add_argument('--repeat', type=int, default=3,
+                     help='take the best of this many runs (default: 3)')
+    args = psr.parse_args()
+
+    print('{:>6} {:>9} {:>10} {:>10} {:>10} {:>10}'.format(
+        'edus', 'pairs', 'split', 'split', 'half', 'half'))
+    print('{:>6} {:>9} {:>10} {:>10} {:>10} {:>10}'.format(
+        '/doc', '', 'list', 'columnar', 'list', 'columnar'))
+    for size in args.sizes:
+        plain, columnar = mk_corpus(args.docs, size)
+        timings = []
+        docs = {}
+        for name, dpack in [('list', plain), ('columnar', columnar)]:
+            timings.append(min(timeit.repeat(lambda: split(dpack),
+                                             number=1, repeat=args.repeat)))
+            docs[name] = split(dpack)
+        for name in ['list', 'columnar']:
+            timings.append(min(timeit.repeat(lambda: select_half(docs[name]),
+                                             number=1, repeat=args.repeat)))
+        print('{:>6} {:>9} {:>9.4f}s {:>9.4f}s {:>9.4f}s {:>9.4f}s'.format(
+            size, len(plain), *timings))
+
+
+if __name__ == '__main__':
+    main()